@@ -743,7 +743,383 @@ def migrate_database_columns():
             current_app.logger.warning(f"Error in pay_amount migration: {e}")
             db.session.rollback()
             # Don't fail the entire migration for this step
-            
+
+        # Link conversations and messages to canonical per-pair message threads
+        try:
+            result = db.session.execute(text("""
+                SELECT migration_name FROM migrations
+                WHERE migration_name = 'add_message_threads'
+            """))
+            message_threads_migration_exists = result.fetchone() is not None
+
+            if not message_threads_migration_exists:
+                from .auto_migrate import check_column_exists
+
+                # message_thread itself is created by db.create_all()
+                if not check_column_exists('conversation', 'thread_id'):
+                    current_app.logger.info("Adding thread_id column to conversation table...")
+                    db.session.execute(text("""
+                        ALTER TABLE conversation
+                        ADD COLUMN thread_id INTEGER REFERENCES message_thread(id)
+                    """))
+                    db.session.commit()
+
+                if not check_column_exists('message', 'thread_id'):
+                    current_app.logger.info("Adding thread_id column to message table...")
+                    db.session.execute(text("""
+                        ALTER TABLE message
+                        ADD COLUMN thread_id INTEGER REFERENCES message_thread(id)
+                    """))
+                    db.session.commit()
+
+                db.session.execute(text("""
+                    CREATE INDEX IF NOT EXISTS ix_conversation_thread_created
+                    ON conversation (thread_id, created_at)
+                """))
+                db.session.execute(text("""
+                    CREATE INDEX IF NOT EXISTS ix_message_thread_created
+                    ON message (thread_id, created_at)
+                """))
+
+                # Backfill one thread per (min(user_a, user_b), max(user_a, user_b)) pair
+                current_app.logger.info("📝 Backfilling message threads...")
+                db.session.execute(text("""
+                    INSERT INTO message_thread (user_low_id, user_high_id, created_at)
+                    SELECT pairs.low_id, pairs.high_id, pairs.first_at
+                    FROM (
+                        SELECT CASE WHEN resident_id < employer_id THEN resident_id ELSE employer_id END AS low_id,
+                               CASE WHEN resident_id < employer_id THEN employer_id ELSE resident_id END AS high_id,
+                               MIN(created_at) AS first_at
+                        FROM conversation
+                        WHERE resident_id <> employer_id
+                        GROUP BY CASE WHEN resident_id < employer_id THEN resident_id ELSE employer_id END,
+                                 CASE WHEN resident_id < employer_id THEN employer_id ELSE resident_id END
+                    ) pairs
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM message_thread t
+                        WHERE t.user_low_id = pairs.low_id AND t.user_high_id = pairs.high_id
+                    )
+                """))
+                db.session.execute(text("""
+                    UPDATE conversation SET thread_id = (
+                        SELECT t.id FROM message_thread t
+                        WHERE t.user_low_id = CASE WHEN conversation.resident_id < conversation.employer_id
+                                                   THEN conversation.resident_id ELSE conversation.employer_id END
+                          AND t.user_high_id = CASE WHEN conversation.resident_id < conversation.employer_id
+                                                    THEN conversation.employer_id ELSE conversation.resident_id END
+                    )
+                    WHERE thread_id IS NULL
+                """))
+                db.session.execute(text("""
+                    UPDATE message SET thread_id = (
+                        SELECT c.thread_id FROM conversation c WHERE c.id = message.conversation_id
+                    )
+                    WHERE thread_id IS NULL
+                """))
+
+                db.session.execute(text("""
+                    INSERT INTO migrations (migration_name)
+                    VALUES ('add_message_threads')
+                    ON CONFLICT (migration_name) DO NOTHING
+                """))
+                db.session.commit()
+                current_app.logger.info("✅ Message threads migration completed")
+        except Exception as e:
+            current_app.logger.warning(f"Error in message threads migration: {e}")
+            db.session.rollback()
+
+        # Denormalized vote tallies on forum posts and comments
+        try:
+            result = db.session.execute(text("""
+                SELECT migration_name FROM migrations
+                WHERE migration_name = 'add_forum_vote_tallies'
+            """))
+            vote_tallies_migration_exists = result.fetchone() is not None
+
+            if not vote_tallies_migration_exists:
+                from .auto_migrate import check_column_exists
+
+                for table, vote_column in (('forum_post', 'post_id'), ('forum_comment', 'comment_id')):
+                    for column in ('upvotes', 'downvotes', 'score'):
+                        if not check_column_exists(table, column):
+                            current_app.logger.info(f"Adding {column} column to {table} table...")
+                            db.session.execute(text(f"""
+                                ALTER TABLE {table}
+                                ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0
+                            """))
+                    db.session.execute(text(f"""
+                        CREATE INDEX IF NOT EXISTS ix_{table}_score ON {table} (score)
+                    """))
+
+                    # Backfill tallies from existing votes
+                    current_app.logger.info(f"📝 Backfilling vote tallies for {table}...")
+                    db.session.execute(text(f"""
+                        UPDATE {table} SET
+                            upvotes = (SELECT COUNT(*) FROM forum_vote v
+                                       WHERE v.{vote_column} = {table}.id AND v.vote_type = 'upvote'),
+                            downvotes = (SELECT COUNT(*) FROM forum_vote v
+                                         WHERE v.{vote_column} = {table}.id AND v.vote_type = 'downvote')
+                    """))
+                    db.session.execute(text(f"UPDATE {table} SET score = upvotes - downvotes"))
+
+                db.session.execute(text("""
+                    INSERT INTO migrations (migration_name)
+                    VALUES ('add_forum_vote_tallies')
+                    ON CONFLICT (migration_name) DO NOTHING
+                """))
+                db.session.commit()
+                current_app.logger.info("✅ Forum vote tallies migration completed")
+        except Exception as e:
+            current_app.logger.warning(f"Error in forum vote tallies migration: {e}")
+            db.session.rollback()
+
+        # Denormalized comment count for forum posts
+        try:
+            result = db.session.execute(text("""
+                SELECT migration_name FROM migrations
+                WHERE migration_name = 'add_forum_comment_count'
+            """))
+            comment_count_migration_exists = result.fetchone() is not None
+
+            if not comment_count_migration_exists:
+                from .auto_migrate import check_column_exists
+
+                if not check_column_exists('forum_post', 'comment_count'):
+                    current_app.logger.info("Adding comment_count column to forum_post table...")
+                    db.session.execute(text("""
+                        ALTER TABLE forum_post
+                        ADD COLUMN comment_count INTEGER NOT NULL DEFAULT 0
+                    """))
+
+                current_app.logger.info("📝 Backfilling forum post comment counts...")
+                db.session.execute(text("""
+                    UPDATE forum_post SET comment_count = (
+                        SELECT COUNT(*) FROM forum_comment c
+                        WHERE c.post_id = forum_post.id AND c.is_deleted = false
+                    )
+                """))
+
+                db.session.execute(text("""
+                    INSERT INTO migrations (migration_name)
+                    VALUES ('add_forum_comment_count')
+                    ON CONFLICT (migration_name) DO NOTHING
+                """))
+                db.session.commit()
+                current_app.logger.info("✅ Forum comment count migration completed")
+        except Exception as e:
+            current_app.logger.warning(f"Error in forum comment count migration: {e}")
+            db.session.rollback()
+
+        # Index the photos JSON of existing forum posts and comments (photo_reference)
+        try:
+            result = db.session.execute(text("""
+                SELECT migration_name FROM migrations
+                WHERE migration_name = 'add_photo_references'
+            """))
+            photo_references_migration_exists = result.fetchone() is not None
+
+            if not photo_references_migration_exists:
+                current_app.logger.info("📝 Backfilling forum photo references...")
+                from .photos import backfill_photo_references
+                count = backfill_photo_references()
+
+                db.session.execute(text("""
+                    INSERT INTO migrations (migration_name)
+                    VALUES ('add_photo_references')
+                    ON CONFLICT (migration_name) DO NOTHING
+                """))
+                db.session.commit()
+                current_app.logger.info(f"✅ Photo reference migration completed ({count} references)")
+        except Exception as e:
+            current_app.logger.warning(f"Error in photo reference migration: {e}")
+            db.session.rollback()
+
+        # Comment tree version for forum posts (keys the cached comment trees)
+        try:
+            from .auto_migrate import check_column_exists
+            if not check_column_exists('forum_post', 'comments_version'):
+                current_app.logger.info("Adding comments_version column to forum_post table...")
+                db.session.execute(text("""
+                    ALTER TABLE forum_post
+                    ADD COLUMN comments_version INTEGER NOT NULL DEFAULT 0
+                """))
+                db.session.commit()
+        except Exception as e:
+            current_app.logger.warning(f"Could not add forum_post.comments_version: {e}")
+            db.session.rollback()
+
+        # Buffered view counters (see view_counts)
+        try:
+            from .auto_migrate import check_column_exists
+            for table in ('forum_post', 'opportunity'):
+                if not check_column_exists(table, 'view_count'):
+                    current_app.logger.info(f"Adding view_count column to {table} table...")
+                    db.session.execute(text(f"""
+                        ALTER TABLE {table}
+                        ADD COLUMN view_count INTEGER NOT NULL DEFAULT 0
+                    """))
+            db.session.commit()
+        except Exception as e:
+            current_app.logger.warning(f"Could not add view_count columns: {e}")
+            db.session.rollback()
+
+        # Hot ranking score for forum posts
+        try:
+            result = db.session.execute(text("""
+                SELECT migration_name FROM migrations
+                WHERE migration_name = 'add_forum_hot_score'
+            """))
+            hot_score_migration_exists = result.fetchone() is not None
+
+            if not hot_score_migration_exists:
+                from .auto_migrate import check_column_exists
+
+                if not check_column_exists('forum_post', 'hot_score'):
+                    current_app.logger.info("Adding hot_score column to forum_post table...")
+                    db.session.execute(text("""
+                        ALTER TABLE forum_post
+                        ADD COLUMN hot_score FLOAT NOT NULL DEFAULT 0
+                    """))
+                db.session.execute(text("""
+                    CREATE INDEX IF NOT EXISTS ix_forum_post_hot_score ON forum_post (hot_score)
+                """))
+
+                # Rank recent posts now; the periodic sweep keeps them decaying afterwards
+                from .forum_ranking import refresh_hot_scores
+                refresh_hot_scores()
+
+                db.session.execute(text("""
+                    INSERT INTO migrations (migration_name)
+                    VALUES ('add_forum_hot_score')
+                    ON CONFLICT (migration_name) DO NOTHING
+                """))
+                db.session.commit()
+                current_app.logger.info("✅ Forum hot score migration completed")
+        except Exception as e:
+            current_app.logger.warning(f"Error in forum hot score migration: {e}")
+            db.session.rollback()
+
+        # Composite (sort_key, id) indexes for forum keyset pagination (idempotent)
+        try:
+            for index_name, table, columns in (
+                ('ix_forum_post_created_id', 'forum_post', 'created_at, id'),
+                ('ix_forum_post_score_id', 'forum_post', 'score, id'),
+                ('ix_forum_post_hot_id', 'forum_post', 'hot_score, id'),
+                ('ix_forum_post_comments_id', 'forum_post', 'comment_count, id'),
+                ('ix_forum_post_views_id', 'forum_post', 'view_count, id'),
+                ('ix_forum_comment_thread_created', 'forum_comment', 'post_id, parent_comment_id, created_at, id'),
+                ('ix_forum_comment_thread_score', 'forum_comment', 'post_id, parent_comment_id, score, id'),
+            ):
+                db.session.execute(text(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({columns})"))
+            db.session.commit()
+        except Exception as e:
+            current_app.logger.warning(f"Could not create forum keyset indexes: {e}")
+            db.session.rollback()
+
+        # Full-text search indexes (idempotent; maintained by the database on write)
+        try:
+            from .fulltext import ensure_message_search_index
+            ensure_message_search_index()
+        except Exception as e:
+            current_app.logger.warning(f"Could not create message search index: {e}")
+            db.session.rollback()
+
+        try:
+            from .fulltext import ensure_forum_search_index
+            ensure_forum_search_index()
+        except Exception as e:
+            current_app.logger.warning(f"Could not create forum search index: {e}")
+            db.session.rollback()
+
+        # ON DELETE CASCADE on foreign keys from purely dependent child rows
+        # (PostgreSQL; new SQLite databases get them from the models)
+        try:
+            result = db.session.execute(text("""
+                SELECT migration_name FROM migrations
+                WHERE migration_name = 'add_delete_cascades'
+            """))
+            delete_cascades_migration_exists = result.fetchone() is not None
+
+            if not delete_cascades_migration_exists and db.engine.dialect.name == 'postgresql':
+                current_app.logger.info("Adding ON DELETE CASCADE to dependent foreign keys...")
+                for table, column, referenced in (
+                    ('forum_vote', 'post_id', 'forum_post'),
+                    ('forum_vote', 'comment_id', 'forum_comment'),
+                    ('forum_comment', 'post_id', 'forum_post'),
+                    ('forum_comment', 'parent_comment_id', 'forum_comment'),
+                    ('message', 'conversation_id', 'conversation'),
+                    ('calendar_slot', 'opportunity_id', 'opportunity'),
+                    ('application', 'opportunity_id', 'opportunity'),
+                    ('rvu_record', 'shift_session_id', 'shift_session'),
+                ):
+                    existing = db.session.execute(text("""
+                        SELECT tc.constraint_name
+                        FROM information_schema.table_constraints tc
+                        JOIN information_schema.key_column_usage kcu
+                          ON kcu.constraint_name = tc.constraint_name AND kcu.table_name = tc.table_name
+                        WHERE tc.constraint_type = 'FOREIGN KEY'
+                          AND tc.table_name = :table AND kcu.column_name = :column
+                    """), {'table': table, 'column': column}).scalars().all()
+                    constraint_name = f"{table}_{column}_fkey"
+                    drops = ''.join(f'DROP CONSTRAINT "{name}", ' for name in existing)
+                    # NOT VALID, committed, then VALIDATE: existing rows are checked
+                    # without holding the table lock that blocks writes
+                    db.session.execute(text(f"""
+                        ALTER TABLE "{table}" {drops}
+                        ADD CONSTRAINT "{constraint_name}" FOREIGN KEY ({column})
+                        REFERENCES "{referenced}" (id) ON DELETE CASCADE NOT VALID
+                    """))
+                    db.session.commit()
+                    db.session.execute(text(f'ALTER TABLE "{table}" VALIDATE CONSTRAINT "{constraint_name}"'))
+                    db.session.commit()
+
+            if not delete_cascades_migration_exists:
+                db.session.execute(text("""
+                    INSERT INTO migrations (migration_name)
+                    VALUES ('add_delete_cascades')
+                    ON CONFLICT (migration_name) DO NOTHING
+                """))
+                db.session.commit()
+                current_app.logger.info("✅ Delete cascade migration completed")
+        except Exception as e:
+            current_app.logger.warning(f"Error in delete cascade migration: {e}")
+            db.session.rollback()
+
+        # Backfill the pre-aggregated compensation statistics (compensation_cube)
+        try:
+            result = db.session.execute(text("""
+                SELECT migration_name FROM migrations
+                WHERE migration_name = 'add_compensation_cube'
+            """))
+            compensation_cube_migration_exists = result.fetchone() is not None
+
+            if not compensation_cube_migration_exists:
+                current_app.logger.info("📝 Building compensation statistics cube...")
+                from .compensation_stats import rebuild_compensation_cube
+                cells = rebuild_compensation_cube()
+
+                db.session.execute(text("""
+                    INSERT INTO migrations (migration_name)
+                    VALUES ('add_compensation_cube')
+                    ON CONFLICT (migration_name) DO NOTHING
+                """))
+                db.session.commit()
+                current_app.logger.info(f"✅ Compensation cube migration completed ({cells} cells)")
+        except Exception as e:
+            current_app.logger.warning(f"Error in compensation cube migration: {e}")
+            db.session.rollback()
+
+        # Cohort index for compensation percentile lookups (idempotent)
+        try:
+            db.session.execute(text("""
+                CREATE INDEX IF NOT EXISTS ix_compensation_data_cohort
+                ON compensation_data (specialty, region, practice_type, total_compensation)
+            """))
+            db.session.commit()
+        except Exception as e:
+            current_app.logger.warning(f"Could not create compensation cohort index: {e}")
+            db.session.rollback()
+
     except Exception as e:
         current_app.logger.error(f"Migration failed: {e}")
         db.session.rollback()
@@ -812,6 +1188,10 @@ def create_app(config_class: type = Config) -> Flask:
             except Exception as migration_error:
                 app.logger.warning(f"Legacy migration failed (non-critical): {migration_error}")
             
+            # Snapshot the migrated schema so feature checks answer from memory
+            from .schema_capabilities import schema_capabilities
+            schema_capabilities.refresh()
+            
             # Final validation
             try:
                 from .database_validator import run_database_validation
@@ -886,6 +1266,12 @@ def create_app(config_class: type = Config) -> Flask:
     # Register additional message routes
     register_message_routes(app)
     
+    # Periodic tasks and background jobs (started lazily in each worker process)
+    from .background import background
+    background.init_app(app)
+    from .view_counts import view_counter
+    view_counter.init_app(app)
+    
     # Add health check route
     @app.route('/health')
     def health_check():
@@ -956,15 +1342,23 @@ def create_app(config_class: type = Config) -> Flask:
     @app.context_processor
     def utility_processor():
         from .opportunities import get_zip_location
-        return dict(get_unread_count=get_unread_count, get_zip_location=get_zip_location)
+        from .photos import photo_sources
+        from .forum_rendering import rendered_post
+        return dict(get_unread_count=get_unread_count, get_zip_location=get_zip_location,
+                    photo_sources=photo_sources, rendered_post=rendered_post)
     
     # Serve uploaded files
     @app.route('/uploads/<path:filename>')
     def uploaded_file(filename):
-        from flask import send_from_directory
-        import os
-        uploads_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads')
-        return send_from_directory(uploads_dir, filename)
+        from .media import profile_upload_dir, send_media
+        return send_media(profile_upload_dir(), filename, app.config.get('MEDIA_ACCEL_UPLOADS_PREFIX'))
+    
+    # Forum photos; takes precedence over the generic static route for this prefix
+    @app.route('/static/uploads/photos/<path:filename>')
+    def forum_photo(filename):
+        from .media import send_media
+        from .photos import photo_dir
+        return send_media(photo_dir(), filename, app.config.get('MEDIA_ACCEL_PHOTOS_PREFIX'))
 
     # Database initialization is already handled above with proper error handling
     # This section is redundant and can cause issues if the database connection fails
@@ -3,9 +3,12 @@ from flask_login import login_required, current_user
 from functools import wraps
 from app.models import (
     db, User, Opportunity, ProgramReview, JobReview, CompensationData, 
-    ForumPost, ForumComment, ForumVote, Application, CalendarSlot, Message, Conversation,
-    ResidencySwap, ResidencyOpening
+    ForumPost, ForumComment, Conversation, ResidencySwap, ResidencyOpening, BackgroundJob
 )
+from app.background import background
+from app.compensation_stats import retract_compensation
+from app.compensation_import import import_compensation_file
+from app.cascade_delete import delete_forum_comments, delete_forum_posts, delete_opportunities, delete_user_data
 from sqlalchemy import desc
 import os
 
@@ -135,6 +138,30 @@ def compensation_data():
         flash(f'Error loading compensation data: {str(e)}', 'error')
         return redirect(url_for('admin.dashboard'))
 
+@admin_bp.route('/compensation-data/import', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def import_compensation_data():
+    """Bulk import survey compensation data from a CSV or XLSX file"""
+    report = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Choose a CSV or XLSX file to import.', 'error')
+        else:
+            try:
+                report = import_compensation_file(
+                    upload.stream, upload.filename,
+                    skip_invalid=bool(request.form.get('skip_invalid')),
+                    dry_run=bool(request.form.get('dry_run'))
+                )
+            except ValueError as e:
+                flash(str(e), 'error')
+            except Exception as e:
+                flash(f'Import failed: {str(e)}', 'error')
+    
+    return render_template('admin/compensation_import.html', report=report)
+
 @admin_bp.route('/forum-posts')
 @login_required
 @admin_required
@@ -178,22 +205,10 @@ def forum_comments():
 def delete_opportunity(opportunity_id):
     """Delete a job opportunity"""
     try:
-        opportunity = Opportunity.query.get_or_404(opportunity_id)
-        
-        # Delete related calendar slots first (cascade should handle this, but being explicit)
-        CalendarSlot.query.filter_by(opportunity_id=opportunity_id).delete()
+        Opportunity.query.get_or_404(opportunity_id)
         
-        # Delete related applications
-        Application.query.filter_by(opportunity_id=opportunity_id).delete()
-        
-        # Delete related conversations and messages
-        conversations = Conversation.query.filter_by(opportunity_id=opportunity_id).all()
-        for conv in conversations:
-            Message.query.filter_by(conversation_id=conv.id).delete()
-            db.session.delete(conv)
-        
-        # Delete the opportunity
-        db.session.delete(opportunity)
+        # Slots, applications and conversations go with it
+        delete_opportunities([opportunity_id])
         db.session.commit()
         
         return jsonify({'success': True, 'message': 'Opportunity deleted successfully'})
@@ -246,6 +261,7 @@ def delete_compensation_data(data_id):
         if not data.is_anonymous_submission:
             return jsonify({'error': 'Cannot delete MGMA survey data'}), 403
         
+        retract_compensation(data)
         db.session.delete(data)
         db.session.commit()
         
@@ -261,23 +277,9 @@ def delete_compensation_data(data_id):
 def delete_forum_post(post_id):
     """Delete a forum post and all its comments"""
     try:
-        post = ForumPost.query.get_or_404(post_id)
-        
-        # Get all comments for this post
-        comments = ForumComment.query.filter_by(post_id=post_id).all()
-        
-        # Delete votes for comments first
-        for comment in comments:
-            ForumVote.query.filter_by(comment_id=comment.id).delete()
+        ForumPost.query.get_or_404(post_id)
         
-        # Delete votes for the post itself
-        ForumVote.query.filter_by(post_id=post_id).delete()
-        
-        # Delete all comments
-        ForumComment.query.filter_by(post_id=post_id).delete()
-        
-        # Delete the post
-        db.session.delete(post)
+        delete_forum_posts([post_id])
         db.session.commit()
         
         return jsonify({'success': True, 'message': 'Forum post deleted successfully'})
@@ -292,19 +294,10 @@ def delete_forum_post(post_id):
 def delete_forum_comment(comment_id):
     """Delete a forum comment"""
     try:
-        comment = ForumComment.query.get_or_404(comment_id)
-        
-        # Delete votes for this comment first
-        ForumVote.query.filter_by(comment_id=comment_id).delete()
-        
-        # If this comment has replies, handle them recursively
-        replies = ForumComment.query.filter_by(parent_comment_id=comment_id).all()
-        for reply in replies:
-            # Delete votes for replies
-            ForumVote.query.filter_by(comment_id=reply.id).delete()
-            db.session.delete(reply)
+        ForumComment.query.get_or_404(comment_id)
         
-        db.session.delete(comment)
+        # Replies at every depth go with it; the post's comment count is recounted
+        delete_forum_comments([comment_id])
         db.session.commit()
         
         return jsonify({'success': True, 'message': 'Forum comment deleted successfully'})
@@ -384,78 +377,31 @@ def delete_residency_opening(opening_id):
 @login_required
 @admin_required
 def delete_user(user_id):
-    """Delete a user and all their associated data"""
+    """Delete a user and all their associated data (runs as a background job)"""
     try:
         # Prevent admin from deleting themselves
         if user_id == current_user.id:
             return jsonify({'error': 'Cannot delete your own admin account'}), 403
         
-        user = User.query.get_or_404(user_id)
-        
-        # Delete all user's data in the correct order to avoid foreign key issues
-        # 1. Delete messages in conversations
-        user_conversations = Conversation.query.filter(
-            (Conversation.resident_id == user_id) | (Conversation.employer_id == user_id)
-        ).all()
-        
-        for conv in user_conversations:
-            Message.query.filter_by(conversation_id=conv.id).delete()
-            db.session.delete(conv)
-        
-        # 2. Delete applications
-        Application.query.filter_by(resident_id=user_id).delete()
+        User.query.get_or_404(user_id)
         
-        # 3. Delete opportunities and related data
-        user_opportunities = Opportunity.query.filter_by(employer_id=user_id).all()
-        for opp in user_opportunities:
-            CalendarSlot.query.filter_by(opportunity_id=opp.id).delete()
-            Application.query.filter_by(opportunity_id=opp.id).delete()
-            db.session.delete(opp)
+        job = background.start_job('delete_user', delete_user_data, user_id, created_by_id=current_user.id)
         
-        # 4. Delete forum-related data
-        # Delete forum votes first
-        ForumVote.query.filter_by(user_id=user_id).delete()
-        
-        # Get user's comments and posts to delete their votes too
-        user_comments = ForumComment.query.filter_by(author_id=user_id).all()
-        user_posts = ForumPost.query.filter_by(author_id=user_id).all()
-        
-        # Delete votes on user's comments
-        for comment in user_comments:
-            ForumVote.query.filter_by(comment_id=comment.id).delete()
-        
-        # Delete votes on user's posts
-        for post in user_posts:
-            ForumVote.query.filter_by(post_id=post.id).delete()
-        
-        # Delete user's comments
-        ForumComment.query.filter_by(author_id=user_id).delete()
-        
-        # Delete user's posts
-        ForumPost.query.filter_by(author_id=user_id).delete()
-        
-        # 5. Delete reviews
-        ProgramReview.query.filter_by(user_id=user_id).delete()
-        JobReview.query.filter_by(user_id=user_id).delete()
-        
-        # 6. Delete profiles
-        if user.role.value == 'resident':
-            from app.models import ResidentProfile
-            ResidentProfile.query.filter_by(user_id=user_id).delete()
-        elif user.role.value == 'employer':
-            from app.models import EmployerProfile
-            EmployerProfile.query.filter_by(user_id=user_id).delete()
-        
-        # 7. Delete user sessions
-        from app.models import UserSession
-        UserSession.query.filter_by(user_id=user_id).delete()
-        
-        # 8. Finally delete the user
-        db.session.delete(user)
-        db.session.commit()
-        
-        return jsonify({'success': True, 'message': 'User and all associated data deleted successfully'})
+        return jsonify({
+            'success': True,
+            'message': 'User deletion started',
+            'job_id': job.id,
+            'status_url': url_for('admin.job_status', job_id=job.id)
+        }), 202
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'Failed to delete user: {str(e)}'}), 500
+
+@admin_bp.route('/api/jobs/<int:job_id>')
+@login_required
+@admin_required
+def job_status(job_id):
+    """Status and progress of a background job"""
+    job = BackgroundJob.query.get_or_404(job_id)
+    return jsonify(job.to_dict())
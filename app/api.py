@@ -1,22 +1,61 @@
 from flask import Blueprint, jsonify, request, current_app, Response
 from flask_login import login_required, current_user
-from app.models import Conversation, Message, User, ResidentProfile, EmployerProfile
+from app.models import Conversation, Message, MessageThread, User, ResidentProfile, EmployerProfile
 from app import db
-from sqlalchemy import desc, and_
+from sqlalchemy import desc, and_, func
 from datetime import datetime
 import uuid
 import json
 import time
 from app.models import UserSession
+from app.chat import get_profile_photo, invalidate_unread_count
 from flask_mail import Message as MailMessage
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+# Online status in the recent-conversations payload is refreshed at most this often
+PRESENCE_BUCKET_SECONDS = 60
+
+
+def conversation_version_stamp(user_id):
+    """
+    Cheap per-user version of the recent-conversations payload.
+    Combines the newest message id, the read watermark (newest received message
+    marked read) and the conversation count/max id across the user's threads.
+    """
+    user_threads = db.session.query(MessageThread.id).filter(
+        (MessageThread.user_low_id == user_id) | (MessageThread.user_high_id == user_id)
+    ).subquery()
+    thread_messages = Message.query.filter(Message.thread_id.in_(db.select(user_threads.c.id)))
+    thread_conversations = Conversation.query.filter(Conversation.thread_id.in_(db.select(user_threads.c.id)))
+    
+    stamp = db.session.query(
+        thread_messages.with_entities(func.max(Message.id)).scalar_subquery(),
+        thread_messages.filter(
+            Message.is_read == True,
+            Message.sender_id != user_id
+        ).with_entities(func.max(Message.id)).scalar_subquery(),
+        thread_conversations.with_entities(func.max(Conversation.id)).scalar_subquery(),
+        thread_conversations.with_entities(func.count(Conversation.id)).scalar_subquery()
+    ).one()
+    
+    presence_bucket = int(time.time() // PRESENCE_BUCKET_SECONDS)
+    return f"conv-{user_id}-" + "-".join(str(value or 0) for value in stamp) + f"-{presence_bucket}"
+
+
 @api_bp.route('/conversations/recent')
 @login_required
 def recent_conversations():
     """Get recent conversations for the current user, consolidated by user"""
     try:
+        # Answer polling with 304 before running the per-conversation queries
+        etag = conversation_version_stamp(current_user.id)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        
         # Get all conversations where current user is involved
         all_conversations = Conversation.query.filter(
             (Conversation.resident_id == current_user.id) | 
@@ -54,12 +93,8 @@ def recent_conversations():
             
             # If we haven't seen this user before, initialize their data
             if other_user_id not in user_conversations:
-                # Get the other user's profile
-                other_profile = None
-                if other_user.role.value == 'resident':
-                    other_profile = ResidentProfile.query.filter_by(user_id=other_user.id).first()
-                elif other_user.role.value == 'employer':
-                    other_profile = EmployerProfile.query.filter_by(user_id=other_user.id).first()
+                # Get the other user's profile photo (cached across polls)
+                other_photo = get_profile_photo(other_user)
                 
                 user_conversations[other_user_id] = {
                     'other_user': {
@@ -69,8 +104,8 @@ def recent_conversations():
                         'is_online': other_user.is_online()
                     },
                     'other_user_profile': {
-                        'photo_filename': other_profile.photo_filename if other_profile else None
-                    } if other_profile else None,
+                        'photo_filename': other_photo
+                    } if other_photo else None,
                     'conversation_ids': [],
                     'total_unread': 0,
                     'last_message': None,
@@ -118,10 +153,13 @@ def recent_conversations():
         conversation_data.sort(key=lambda x: x['updated_at'] or '', reverse=True)
         conversation_data = conversation_data[:10]
         
-        return jsonify({
+        response = jsonify({
             'conversations': conversation_data,
             'unread_count': total_unread
         })
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
         
     except Exception as e:
         current_app.logger.error(f"Error fetching recent conversations: {str(e)}")
@@ -132,17 +170,7 @@ def recent_conversations():
 def current_user_profile():
     """Get current user's profile information including photo"""
     try:
-        current_user_photo = None
-        if current_user.role.value == 'resident':
-            from .models import ResidentProfile
-            resident_profile = ResidentProfile.query.filter_by(user_id=current_user.id).first()
-            if resident_profile and resident_profile.photo_filename:
-                current_user_photo = resident_profile.photo_filename
-        elif current_user.role.value == 'employer':
-            from .models import EmployerProfile
-            employer_profile = EmployerProfile.query.filter_by(user_id=current_user.id).first()
-            if employer_profile and employer_profile.photo_filename:
-                current_user_photo = employer_profile.photo_filename
+        current_user_photo = get_profile_photo(current_user)
         
         return jsonify({
             'id': current_user.id,
@@ -156,6 +184,18 @@ def current_user_profile():
         return jsonify({'error': 'Failed to fetch profile'}), 500
 
 
+def thread_scope(conversation):
+    """
+    (Message filter, Conversation filter) covering every conversation in this
+    one's thread. Conversations the message_thread backfill could not pair
+    (legacy ones with the same user on both sides) have no thread_id and are
+    scoped to themselves, never to every unthreaded row.
+    """
+    if conversation.thread_id is None:
+        return Message.conversation_id == conversation.id, Conversation.id == conversation.id
+    return Message.thread_id == conversation.thread_id, Conversation.thread_id == conversation.thread_id
+
+
 @api_bp.route('/conversations/<int:conversation_id>/messages')
 @login_required
 def conversation_messages(conversation_id):
@@ -180,62 +220,39 @@ def conversation_messages(conversation_id):
             other_user = conversation.resident
             other_user_id = conversation.resident_id
         
-        # Find all conversations with this user
-        related_conversations = Conversation.query.filter(
+        # All conversations with this user share one thread, so every message
+        # between the pair comes back from a single (thread_id, created_at) index range
+        thread_messages, thread_conversations = thread_scope(conversation)
+        messages = Message.query.filter(thread_messages).order_by(Message.created_at).all()
+        all_messages = [{
+            'id': msg.id,
+            'content': msg.body,
+            'user_id': msg.sender_id,
+            'timestamp': msg.created_at.isoformat() if msg.created_at else None,
+            'conversation_id': msg.conversation_id,
+            'is_read': msg.is_read
+        } for msg in messages]
+        
+        # Mark all messages from the other user as read across the thread
+        Message.query.filter(
             and_(
-                ((Conversation.resident_id == current_user.id) & (Conversation.employer_id == other_user_id)) |
-                ((Conversation.resident_id == other_user_id) & (Conversation.employer_id == current_user.id))
+                thread_messages,
+                Message.sender_id == other_user_id,
+                Message.is_read == False
             )
-        ).all()
+        ).update({Message.is_read: True}, synchronize_session=False)
         
-        # Get messages from all related conversations
-        all_messages = []
-        for conv in related_conversations:
-            messages = Message.query.filter_by(conversation_id=conv.id).order_by(Message.created_at).all()
-            for msg in messages:
-                all_messages.append({
-                    'id': msg.id,
-                    'content': msg.body,
-                    'user_id': msg.sender_id,
-                    'timestamp': msg.created_at.isoformat() if msg.created_at else None,
-                    'conversation_id': conv.id,
-                    'is_read': msg.is_read
-                })
-        
-        # Sort all messages by timestamp
-        all_messages.sort(key=lambda x: x['timestamp'] or '')
-        
-        # Mark all messages from the other user as read in all related conversations
-        for conv in related_conversations:
-            # Mark messages from other user as read
-            unread_messages = Message.query.filter(
-                and_(
-                    Message.conversation_id == conv.id,
-                    Message.sender_id == other_user_id,
-                    Message.is_read == False
-                )
-            ).all()
-            
-            for msg in unread_messages:
-                msg.is_read = True
-            
-            # Reset unread count for this conversation
-            conv.unread_count = 0
+        # Reset unread count for every conversation in the thread
+        Conversation.query.filter(thread_conversations).update(
+            {Conversation.unread_count: 0}, synchronize_session=False
+        )
         
         db.session.commit()
         
+        invalidate_unread_count(current_user.id, other_user_id)
+        
         # Get profile photo for other user
-        other_user_photo = None
-        if other_user.role.value == 'resident':
-            from .models import ResidentProfile
-            resident_profile = ResidentProfile.query.filter_by(user_id=other_user.id).first()
-            if resident_profile and resident_profile.photo_filename:
-                other_user_photo = resident_profile.photo_filename
-        elif other_user.role.value == 'employer':
-            from .models import EmployerProfile
-            employer_profile = EmployerProfile.query.filter_by(user_id=other_user.id).first()
-            if employer_profile and employer_profile.photo_filename:
-                other_user_photo = employer_profile.photo_filename
+        other_user_photo = get_profile_photo(other_user)
         
         return jsonify({
             'messages': all_messages,
@@ -288,11 +305,9 @@ def send_message():
         
         # Find the most recent conversation with this user to add the message to
         # This ensures messages go to the most recent conversation thread
+        _thread_messages, thread_conversations = thread_scope(conversation)
         most_recent_conversation = Conversation.query.filter(
-            and_(
-                ((Conversation.resident_id == current_user.id) & (Conversation.employer_id == other_user_id)) |
-                ((Conversation.resident_id == other_user_id) & (Conversation.employer_id == current_user.id))
-            )
+            thread_conversations
         ).order_by(desc(Conversation.created_at)).first()
         
         if not most_recent_conversation:
@@ -301,6 +316,7 @@ def send_message():
         # Create new message in the most recent conversation
         message = Message(
             conversation_id=most_recent_conversation.id,
+            thread_id=most_recent_conversation.thread_id,
             sender_id=current_user.id,
             body=content,
             created_at=datetime.utcnow()
@@ -308,19 +324,13 @@ def send_message():
         
         db.session.add(message)
         
-        # Update unread count for the other user in all related conversations
-        related_conversations = Conversation.query.filter(
-            and_(
-                ((Conversation.resident_id == current_user.id) & (Conversation.employer_id == other_user_id)) |
-                ((Conversation.resident_id == other_user_id) & (Conversation.employer_id == current_user.id))
-            )
-        ).all()
-        
-        for conv in related_conversations:
-            # Increment unread count for the other user
-            conv.unread_count += 1
+        # Increment unread count for the other user in all related conversations
+        Conversation.query.filter(thread_conversations).update(
+            {Conversation.unread_count: Conversation.unread_count + 1}, synchronize_session=False
+        )
         
         db.session.commit()
+        invalidate_unread_count(current_user.id, other_user_id)
         
         return jsonify({
             'success': True,
@@ -332,6 +342,80 @@ def send_message():
         current_app.logger.error(f"Error sending message: {str(e)}")
         return jsonify({'error': 'Failed to send message'}), 500
 
+@api_bp.route('/messages/search')
+@login_required
+def search_messages():
+    """Full-text search over the current user's messages (ranked, highlighted, paginated)"""
+    try:
+        query = request.args.get('q', '').strip()
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), 50)
+        
+        if len(query) < 2:
+            return jsonify({'results': [], 'page': page, 'per_page': per_page, 'has_more': False})
+        
+        from .fulltext import search_messages as run_message_search
+        
+        # Fetch one extra row to know whether another page exists
+        rows = run_message_search(current_user.id, query, limit=per_page + 1, offset=(page - 1) * per_page)
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        
+        # Batch load the other participant of every matching conversation
+        conversation_ids = {row['conversation_id'] for row in rows}
+        conversations = {
+            conv.id: conv for conv in Conversation.query.filter(Conversation.id.in_(conversation_ids)).all()
+        } if conversation_ids else {}
+        
+        results = []
+        for row in rows:
+            conv = conversations.get(row['conversation_id'])
+            other_user = None
+            if conv:
+                other_user = conv.employer if conv.resident_id == current_user.id else conv.resident
+            created_at = row['created_at']
+            results.append({
+                'id': row['id'],
+                'conversation_id': row['conversation_id'],
+                'sender_id': row['sender_id'],
+                'timestamp': created_at.isoformat() if hasattr(created_at, 'isoformat') else created_at,
+                'snippet': row['snippet'],
+                'rank': row['rank'],
+                'other_user': {
+                    'id': other_user.id,
+                    'name': other_user.name
+                } if other_user else None
+            })
+        
+        return jsonify({'results': results, 'page': page, 'per_page': per_page, 'has_more': has_more})
+        
+    except Exception as e:
+        current_app.logger.error(f"Error searching messages: {str(e)}")
+        return jsonify({'error': 'Failed to search messages'}), 500
+
+@api_bp.route('/forum/search')
+@login_required
+def search_forum():
+    """Full-text search over forum posts and comments (ranked, highlighted, cursor-paginated)"""
+    try:
+        query = request.args.get('q', '').strip()
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), 50)
+        
+        if len(query) < 2:
+            return jsonify({'results': [], 'next_cursor': None})
+        
+        from .fulltext import search_forum as run_forum_search
+        
+        results, next_cursor = run_forum_search(query, limit=per_page, after=request.args.get('after'))
+        for result in results:
+            result['url'] = f"/forum/post/{result['post_id']}"
+        
+        return jsonify({'results': results, 'next_cursor': next_cursor})
+    
+    except Exception as e:
+        current_app.logger.error(f"Error searching forum: {str(e)}")
+        return jsonify({'error': 'Failed to search forum'}), 500
+
 @api_bp.route('/users/online-status')
 @login_required
 def get_online_status():
@@ -476,14 +560,11 @@ def start_direct_conversation():
             return jsonify({'error': 'User not found'}), 404
         
         # Check if conversation already exists (including opportunity-based ones)
-        existing_convo = Conversation.query.filter(
-            and_(
-                ((Conversation.resident_id == current_user.id) & (Conversation.employer_id == other_user_id)) |
-                ((Conversation.resident_id == other_user_id) & (Conversation.employer_id == current_user.id))
-            )
-        ).first()
+        thread = MessageThread.get_or_create(current_user.id, other_user_id)
+        existing_convo = Conversation.query.filter_by(thread_id=thread.id).first()
         
         if existing_convo:
+            db.session.commit()
             return jsonify({
                 'conversation_id': existing_convo.id,
                 'message': 'Conversation already exists'
@@ -493,12 +574,14 @@ def start_direct_conversation():
         if current_user.role.value == 'resident':
             new_convo = Conversation(
                 resident_id=current_user.id,
-                employer_id=other_user_id
+                employer_id=other_user_id,
+                thread_id=thread.id
             )
         else:
             new_convo = Conversation(
                 resident_id=other_user_id,
-                employer_id=current_user.id
+                employer_id=current_user.id,
+                thread_id=thread.id
             )
         
         db.session.add(new_convo)
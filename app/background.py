@@ -0,0 +1,133 @@
+"""
+In-process background work for the web workers
+
+Three kinds of work are supported:
+- periodic tasks, registered with @periodic(seconds), each run on its own
+  daemon thread inside an app context
+- one-off jobs handed to submit(), run on a small thread pool so a request
+  can return before slow work (image processing, large deletes) finishes
+- tracked jobs started with start_job(), which record their status and
+  progress in a BackgroundJob row that any worker can report on
+
+gunicorn runs with --preload, so threads started in the master process would
+not survive the fork. Threads are therefore started lazily on the first
+request each worker process serves (tracked by PID). When
+BACKGROUND_JOBS_ENABLED is off (tests, one-off scripts) submit() runs the job
+inline and periodic tasks are never started.
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from .models import db, BackgroundJob
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundRunner:
+    """Per-process owner of the periodic task threads and the job pool"""
+
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self._app = None
+        self._tasks = []  # (name, interval, func)
+        self._pid = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self._app = app
+        app.before_request(self._ensure_started)
+
+    @property
+    def enabled(self):
+        return self._app is not None and self._app.config.get("BACKGROUND_JOBS_ENABLED", True)
+
+    def periodic(self, interval, name=None):
+        """Decorator registering func to run every `interval` seconds"""
+        def decorator(func):
+            self._tasks.append((name or func.__name__, interval, func))
+            return func
+        return decorator
+
+    def submit(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) in the background with an app context"""
+        if not self.enabled:
+            return func(*args, **kwargs)
+        self._ensure_started()
+        return self._executor.submit(self._run_job, func.__name__, func, args, kwargs)
+
+    def start_job(self, kind, func, *args, created_by_id=None):
+        """
+        Run func(*args, progress=callback) in the background, tracked by a BackgroundJob row.
+        Calling progress(done, total, message) records progress and commits the work so far.
+        Returns the job.
+        """
+        job = BackgroundJob(kind=kind, created_by_id=created_by_id)
+        db.session.add(job)
+        db.session.commit()
+        self.submit(self._run_tracked, job.id, func, args)
+        return job
+
+    def _run_tracked(self, job_id, func, args):
+        job = db.session.get(BackgroundJob, job_id)
+        job.status = "running"
+        db.session.commit()
+
+        def progress(done, total, message=None):
+            job.progress, job.total, job.message = done, total, message
+            db.session.commit()
+
+        try:
+            func(*args, progress=progress)
+            job.status = "done"
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Background job {job.kind} #{job_id} failed: {e}", exc_info=True)
+            job.status = "failed"
+            job.message = str(e)
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+    def run_pending(self):
+        """Run every periodic task once in the current thread (scripts, manual triggers)"""
+        for name, _interval, func in self._tasks:
+            self._run_job(name, func, (), {})
+
+    def _ensure_started(self):
+        if not self.enabled or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="background-job")
+            for name, interval, func in self._tasks:
+                thread = threading.Thread(
+                    target=self._loop, args=(name, interval, func),
+                    name=f"periodic-{name}", daemon=True
+                )
+                thread.start()
+            logger.info(f"Started {len(self._tasks)} periodic task(s) in process {self._pid}")
+
+    def _loop(self, name, interval, func):
+        while True:
+            self._run_job(name, func, (), {})
+            time.sleep(interval)
+
+    def _run_job(self, name, func, args, kwargs):
+        with self._app.app_context():
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Background job {name} failed: {e}", exc_info=True)
+            finally:
+                db.session.remove()
+
+
+background = BackgroundRunner()
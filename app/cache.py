@@ -0,0 +1,73 @@
+"""
+Small in-process caches shared by the blueprints
+
+Two layers are used throughout the app:
+- request_memo(): per-request memoization stored on flask.g, so repeated
+  lookups during one render hit the database once
+- TTLCache: a bounded, thread-safe LRU whose entries expire after a few
+  seconds, used to absorb polling traffic across requests in one worker
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, has_app_context
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache with a per-entry time-to-live"""
+
+    def __init__(self, maxsize=1024, ttl=5.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_or_set(self, key, factory, ttl=None):
+        """Return the cached value for key, computing and storing it on a miss"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(key, value, ttl=ttl)
+        return value
+
+
+def request_memo(namespace):
+    """Return the dict used to memoize values for the current request (empty outside one)"""
+    if not has_app_context():
+        return {}
+    memo = g.setdefault('_request_memo', {})
+    return memo.setdefault(namespace, {})
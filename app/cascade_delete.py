@@ -0,0 +1,170 @@
+"""
+Set-based deletes for forum content, opportunities and users
+
+Each function removes a whole object graph with a fixed handful of
+DELETE ... WHERE ... IN (subquery) statements, however many comments, votes
+or conversations are involved, instead of one statement per row. Comment
+reply trees are resolved with a recursive CTE.
+
+The foreign keys from child rows (votes, comments, messages, slots...) also
+cascade in the database (migration add_delete_cascades), but the statements
+here stay explicit so SQLite, which does not enforce foreign keys by
+default, ends up in the same state.
+
+None of these functions commit; callers own the transaction. Denormalized
+counters on surviving rows (vote tallies, comment counts) are corrected
+with set-based UPDATEs in the same transaction.
+"""
+
+from sqlalchemy import delete, func, or_, select, update
+
+from .forum_ranking import refresh_hot_scores
+from .models import (
+    db, Application, CalendarSlot, CompensationData, Conversation, EmployerProfile,
+    ForumComment, ForumPost, ForumVote, JobReview, Message, MessageThread, Opportunity,
+    PhotoAsset, PhotoReference, ProgramReview, ResidencyOpening, ResidencySwap,
+    ResidentProfile, RVURecord, ShiftSession, User, UserSession
+)
+
+
+def _delete(model, *criteria):
+    statement = delete(model).where(*criteria).execution_options(synchronize_session=False)
+    return db.session.execute(statement).rowcount
+
+
+def comment_subtree(root_ids):
+    """SELECT of the given comment ids plus every reply below them, at any depth"""
+    tree = select(ForumComment.id).where(ForumComment.id.in_(root_ids)).cte("comment_subtree", recursive=True)
+    tree = tree.union_all(select(ForumComment.id).where(ForumComment.parent_comment_id == tree.c.id))
+    return select(tree.c.id)
+
+
+def delete_forum_posts(post_ids):
+    """Delete posts (ids, or a SELECT of ids) with all their comments, votes and photo references"""
+    comment_ids = select(ForumComment.id).where(ForumComment.post_id.in_(post_ids))
+    _delete(ForumVote, or_(ForumVote.post_id.in_(post_ids), ForumVote.comment_id.in_(comment_ids)))
+    _delete(PhotoReference, or_(PhotoReference.post_id.in_(post_ids), PhotoReference.comment_id.in_(comment_ids)))
+    _delete(ForumComment, ForumComment.post_id.in_(post_ids))
+    return _delete(ForumPost, ForumPost.id.in_(post_ids))
+
+
+def delete_forum_comments(comment_ids):
+    """
+    Hard-delete comments (ids, or a SELECT of ids) with every reply below them,
+    their votes and photo references, then recount the posts they were on.
+    """
+    # Counted up front: SQLite reports no rowcount for a WITH ... DELETE
+    per_post = db.session.execute(
+        select(ForumComment.post_id, func.count(ForumComment.id))
+        .where(ForumComment.id.in_(comment_subtree(comment_ids)))
+        .group_by(ForumComment.post_id)
+    ).all()
+    post_ids = [post_id for post_id, _count in per_post]
+
+    _delete(ForumVote, ForumVote.comment_id.in_(comment_subtree(comment_ids)))
+    _delete(PhotoReference, PhotoReference.comment_id.in_(comment_subtree(comment_ids)))
+    _delete(ForumComment, ForumComment.id.in_(comment_subtree(comment_ids)))
+
+    ForumPost.recount_comments(post_ids)
+    refresh_hot_scores(post_ids)
+    return sum(count for _post_id, count in per_post)
+
+
+def _retract_votes(model, vote_column, user_id):
+    """Take a user's votes out of the denormalized tallies of everything they voted on"""
+    def user_votes(vote_type):
+        return select(func.count(ForumVote.id)).where(
+            vote_column == model.id,
+            ForumVote.user_id == user_id,
+            ForumVote.vote_type == vote_type
+        ).scalar_subquery()
+
+    voted = model.id.in_(select(vote_column).where(ForumVote.user_id == user_id))
+    upvotes, downvotes = user_votes("upvote"), user_votes("downvote")
+    db.session.execute(update(model).where(voted).values({
+        model.upvotes: model.upvotes - upvotes,
+        model.downvotes: model.downvotes - downvotes,
+        model.score: model.score - upvotes + downvotes,
+        model.updated_at: model.updated_at
+    }).execution_options(synchronize_session=False))
+
+
+def delete_user_votes(user_id):
+    """Delete every forum vote a user cast, keeping the tallies of surviving posts and comments right"""
+    # Cached comment trees show comment scores
+    db.session.execute(update(ForumPost).where(ForumPost.id.in_(
+        select(ForumComment.post_id).join(ForumVote, ForumVote.comment_id == ForumComment.id)
+        .where(ForumVote.user_id == user_id)
+    )).values({
+        ForumPost.comments_version: ForumPost.comments_version + 1,
+        ForumPost.updated_at: ForumPost.updated_at
+    }).execution_options(synchronize_session=False))
+
+    _retract_votes(ForumPost, ForumVote.post_id, user_id)
+    _retract_votes(ForumComment, ForumVote.comment_id, user_id)
+    return _delete(ForumVote, ForumVote.user_id == user_id)
+
+
+def delete_opportunities(opportunity_ids):
+    """Delete opportunities (ids, or a SELECT of ids) with their slots, applications and conversations"""
+    conversation_ids = select(Conversation.id).where(Conversation.opportunity_id.in_(opportunity_ids))
+    _delete(Message, Message.conversation_id.in_(conversation_ids))
+    _delete(Conversation, Conversation.opportunity_id.in_(opportunity_ids))
+    _delete(CalendarSlot, CalendarSlot.opportunity_id.in_(opportunity_ids))
+    _delete(Application, Application.opportunity_id.in_(opportunity_ids))
+    return _delete(Opportunity, Opportunity.id.in_(opportunity_ids))
+
+
+def delete_user_data(user_id, progress=None):
+    """
+    Delete a user and everything that belongs to them, one step at a time.
+    progress(done, total, message) is called after each step; tracked jobs
+    commit there, so a failed run can simply be started again.
+    """
+    user_conversations = or_(Conversation.resident_id == user_id, Conversation.employer_id == user_id)
+    user_opportunities = select(Opportunity.id).where(Opportunity.employer_id == user_id)
+    user_shifts = select(ShiftSession.id).where(ShiftSession.user_id == user_id)
+
+    def delete_messages():
+        _delete(Message, Message.conversation_id.in_(select(Conversation.id).where(user_conversations)))
+        _delete(Conversation, user_conversations)
+        _delete(MessageThread, or_(MessageThread.user_low_id == user_id, MessageThread.user_high_id == user_id))
+
+    def delete_opportunity_data():
+        _delete(Application, Application.resident_id == user_id)
+        delete_opportunities(user_opportunities)
+
+    def delete_forum_content():
+        # The user's posts go with every comment on them; the user's other
+        # comments go with the replies below them
+        delete_forum_posts(select(ForumPost.id).where(ForumPost.author_id == user_id))
+        delete_forum_comments(select(ForumComment.id).where(ForumComment.author_id == user_id))
+
+    def delete_profile_data():
+        _delete(ProgramReview, ProgramReview.user_id == user_id)
+        _delete(JobReview, JobReview.user_id == user_id)
+        _delete(ResidencySwap, ResidencySwap.user_id == user_id)
+        _delete(ResidencyOpening, ResidencyOpening.user_id == user_id)
+        _delete(RVURecord, RVURecord.shift_session_id.in_(user_shifts))
+        _delete(ShiftSession, ShiftSession.user_id == user_id)
+        _delete(ResidentProfile, ResidentProfile.user_id == user_id)
+        _delete(EmployerProfile, EmployerProfile.user_id == user_id)
+        _delete(UserSession, UserSession.user_id == user_id)
+        # Survey submissions and uploads stay, detached from the account
+        db.session.execute(update(CompensationData).where(CompensationData.user_id == user_id)
+                           .values(user_id=None).execution_options(synchronize_session=False))
+        db.session.execute(update(PhotoAsset).where(PhotoAsset.uploaded_by_id == user_id)
+                           .values(uploaded_by_id=None).execution_options(synchronize_session=False))
+
+    steps = [
+        ("Deleting conversations", delete_messages),
+        ("Deleting applications and opportunities", delete_opportunity_data),
+        ("Retracting forum votes", lambda: delete_user_votes(user_id)),
+        ("Deleting forum posts and comments", delete_forum_content),
+        ("Deleting reviews, shifts and profiles", delete_profile_data),
+        ("Deleting account", lambda: _delete(User, User.id == user_id)),
+    ]
+    for done, (message, step) in enumerate(steps, start=1):
+        step()
+        if progress:
+            progress(done, len(steps), message)
@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, redirect, url_for, request, abort
 from flask_login import login_required, current_user
-from .models import db, Conversation, Message, User, Opportunity, ResidentProfile
+from .models import db, Conversation, Message, MessageThread, User, Opportunity, ResidentProfile, EmployerProfile
+from .cache import TTLCache, request_memo
 
 chat_bp = Blueprint("chat", __name__, url_prefix="/messages")
 
@@ -19,13 +20,7 @@ def inbox():
 			convo.other_user = convo.resident
 		
 		# Get the other user's profile photo
-		if convo.other_user.role.value == 'resident':
-			convo.other_user_profile = ResidentProfile.query.filter_by(user_id=convo.other_user.id).first()
-		elif convo.other_user.role.value == 'employer':
-			from .models import EmployerProfile
-			convo.other_user_profile = EmployerProfile.query.filter_by(user_id=convo.other_user.id).first()
-		else:
-			convo.other_user_profile = None
+		convo.other_user_profile = get_user_profile(convo.other_user)
 		
 		# Get the last message for this conversation
 		last_message = Message.query.filter_by(conversation_id=convo.id).order_by(Message.created_at.desc()).first()
@@ -66,19 +61,17 @@ def start():
 			abort(400)
 		
 		# Check if conversation already exists
-		convo = Conversation.query.filter(
-			((Conversation.resident_id == current_user.id) & (Conversation.employer_id == other_user.id)) |
-			((Conversation.resident_id == other_user.id) & (Conversation.employer_id == current_user.id))
-		).filter(Conversation.opportunity_id.is_(None)).first()
+		thread = MessageThread.get_or_create(current_user.id, other_user.id)
+		convo = Conversation.query.filter_by(thread_id=thread.id, opportunity_id=None).first()
 		
 		if not convo:
 			# Create new direct conversation (no opportunity_id)
 			if current_user.role.value == "resident":
-				convo = Conversation(resident_id=current_user.id, employer_id=other_user.id)
+				convo = Conversation(resident_id=current_user.id, employer_id=other_user.id, thread_id=thread.id)
 			else:
-				convo = Conversation(resident_id=other_user.id, employer_id=current_user.id)
+				convo = Conversation(resident_id=other_user.id, employer_id=current_user.id, thread_id=thread.id)
 			db.session.add(convo)
-			db.session.commit()
+		db.session.commit()
 		
 		return redirect(url_for("chat.thread", conversation_id=convo.id))
 	
@@ -93,7 +86,8 @@ def start():
 	# Find existing conversation
 	convo = Conversation.query.filter_by(opportunity_id=opp.id, resident_id=current_user.id, employer_id=employer_id).first()
 	if not convo:
-		convo = Conversation(opportunity_id=opp.id, resident_id=current_user.id, employer_id=employer_id)
+		thread = MessageThread.get_or_create(current_user.id, employer_id)
+		convo = Conversation(opportunity_id=opp.id, resident_id=current_user.id, employer_id=employer_id, thread_id=thread.id)
 		db.session.add(convo)
 		db.session.commit()
 	return redirect(url_for("chat.thread", conversation_id=convo.id))
@@ -114,13 +108,7 @@ def direct():
 			convo.other_user = convo.resident
 		
 		# Get the other user's profile photo
-		if convo.other_user.role.value == 'resident':
-			convo.other_user_profile = ResidentProfile.query.filter_by(user_id=convo.other_user.id).first()
-		elif convo.other_user.role.value == 'employer':
-			from .models import EmployerProfile
-			convo.other_user_profile = EmployerProfile.query.filter_by(user_id=convo.other_user.id).first()
-		else:
-			convo.other_user_profile = None
+		convo.other_user_profile = get_user_profile(convo.other_user)
 	
 	return render_template("chat/direct.html", convos=convos)
 
@@ -165,19 +153,17 @@ def start_direct():
 		abort(400)
 	
 	# Check if conversation already exists
-	convo = Conversation.query.filter(
-		((Conversation.resident_id == current_user.id) & (Conversation.employer_id == other_user.id)) |
-		((Conversation.resident_id == other_user.id) & (Conversation.employer_id == current_user.id))
-	).filter(Conversation.opportunity_id.is_(None)).first()
+	thread = MessageThread.get_or_create(current_user.id, other_user.id)
+	convo = Conversation.query.filter_by(thread_id=thread.id, opportunity_id=None).first()
 	
 	if not convo:
 		# Create new direct conversation (no opportunity_id)
 		if current_user.role.value == "resident":
-			convo = Conversation(resident_id=current_user.id, employer_id=other_user.id)
+			convo = Conversation(resident_id=current_user.id, employer_id=other_user.id, thread_id=thread.id)
 		else:
-			convo = Conversation(resident_id=other_user.id, employer_id=current_user.id)
+			convo = Conversation(resident_id=other_user.id, employer_id=current_user.id, thread_id=thread.id)
 		db.session.add(convo)
-		db.session.commit()
+	db.session.commit()
 	
 	return redirect(url_for("chat.thread", conversation_id=convo.id))
 
@@ -192,7 +178,7 @@ def thread(conversation_id: int):
 	if request.method == "POST":
 		body = request.form.get("body", "").strip()
 		if body:
-			msg = Message(conversation_id=convo.id, sender_id=current_user.id, body=body)
+			msg = Message(conversation_id=convo.id, thread_id=convo.thread_id, sender_id=current_user.id, body=body)
 			db.session.add(msg)
 			
 			# Update unread count for the other user
@@ -200,6 +186,7 @@ def thread(conversation_id: int):
 			convo.unread_count += 1
 			
 			db.session.commit()
+			invalidate_unread_count(convo.resident_id, convo.employer_id)
 			return redirect(url_for("chat.thread", conversation_id=convo.id))
 
 	# Mark messages as read when viewing the thread
@@ -211,6 +198,7 @@ def thread(conversation_id: int):
 	# Reset unread count for current user
 	convo.unread_count = 0
 	db.session.commit()
+	invalidate_unread_count(convo.resident_id, convo.employer_id)
 
 	msgs = Message.query.filter_by(conversation_id=convo.id).order_by(Message.created_at.asc()).all()
 	other_user = User.query.get(other_id)
@@ -223,7 +211,7 @@ def thread(conversation_id: int):
 	# Get the current user's profile photo for the template
 	current_user_profile = None
 	if current_user.role.value == 'resident':
-		current_user_profile = ResidentProfile.query.filter_by(user_id=current_user.id).first()
+		current_user_profile = get_user_profile(current_user)
 	
 	return render_template("chat/thread.html", convo=convo, msgs=msgs, other_user=other_user, other_user_profile=other_user_profile, current_user_profile=current_user_profile)
 
@@ -236,9 +224,60 @@ def register_message_routes(app):
 		return redirect(url_for("chat.inbox"))
 
 
+# Short-lived per-user caches shared by the polling endpoints
+_unread_count_cache = TTLCache(maxsize=4096, ttl=5)
+_profile_photo_cache = TTLCache(maxsize=4096, ttl=60)
+
+
 # Helper function to get unread message count for a user
 def get_unread_count(user_id: int) -> int:
-	return Conversation.query.filter(
-		((Conversation.resident_id == user_id) | (Conversation.employer_id == user_id)) &
-		(Conversation.unread_count > 0)
-	).with_entities(db.func.sum(Conversation.unread_count)).scalar() or 0
+	"""Unread total for a user, memoized per request and cached briefly across requests"""
+	memo = request_memo("unread_count")
+	if user_id not in memo:
+		memo[user_id] = _unread_count_cache.get_or_set(user_id, lambda: Conversation.query.filter(
+			((Conversation.resident_id == user_id) | (Conversation.employer_id == user_id)) &
+			(Conversation.unread_count > 0)
+		).with_entities(db.func.sum(Conversation.unread_count)).scalar() or 0)
+	return memo[user_id]
+
+
+def invalidate_unread_count(*user_ids: int) -> None:
+	"""Drop cached unread totals after messages are sent or read"""
+	memo = request_memo("unread_count")
+	for user_id in user_ids:
+		_unread_count_cache.delete(user_id)
+		memo.pop(user_id, None)
+
+
+# Helper function to get the resident or employer profile for a user
+def get_user_profile(user):
+	"""Resident/employer profile for a user, loaded at most once per request"""
+	if user is None or not getattr(user, "is_authenticated", True):
+		return None
+	memo = request_memo("user_profile")
+	if user.id not in memo:
+		if user.role.value == 'resident':
+			memo[user.id] = ResidentProfile.query.filter_by(user_id=user.id).first()
+		elif user.role.value == 'employer':
+			memo[user.id] = EmployerProfile.query.filter_by(user_id=user.id).first()
+		else:
+			memo[user.id] = None
+	return memo[user.id]
+
+
+def get_profile_photo(user):
+	"""Profile photo filename for a user, cached across polling requests"""
+	if user is None or not getattr(user, "is_authenticated", True):
+		return None
+
+	def load_photo():
+		profile = get_user_profile(user)
+		return profile.photo_filename if profile and profile.photo_filename else None
+
+	return _profile_photo_cache.get_or_set(user.id, load_photo)
+
+
+def invalidate_user_profile(user_id: int) -> None:
+	"""Drop cached profile data after a profile or photo is updated"""
+	_profile_photo_cache.delete(user_id)
+	request_memo("user_profile").pop(user_id, None)
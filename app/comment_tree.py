@@ -0,0 +1,250 @@
+"""
+Comment tree service for forum posts
+
+Comments are served a page at a time: the first COMMENTS_PAGE_SIZE top-level
+comments in the requested sort, each with up to REPLIES_PAGE_SIZE replies per
+level and REPLY_DEPTH levels deep. Anything beyond that is fetched later
+through the "load more" and "expand replies" endpoints, using keyset cursors
+over the (post_id, parent_comment_id, created_at, id) index. A large thread
+therefore never loads or renders every comment in one request.
+
+Each serialized page is cached per (post, comments_version, ...). Every comment,
+reply, edit, delete and comment vote bumps ForumPost.comments_version, so a
+stale page is never served by any worker - old versions simply age out of
+the LRU. Only the reader's own vote state is computed per request.
+
+Cached nodes are plain dicts and are never mutated after build; templates
+see them through CommentView, which exposes the same attributes the ORM
+objects did (author, content, _total_votes, _user_vote, _nested_replies...).
+"""
+
+import logging
+
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+
+from .cache import TTLCache
+from .models import db, ForumComment, ForumVote, ResidentProfile, EmployerProfile
+from .pagination import encode_cursor, keyset_paginate
+from .photos import parse_photo_list, preload_photo_sources
+
+logger = logging.getLogger(__name__)
+
+COMMENTS_PAGE_SIZE = 20
+REPLIES_PAGE_SIZE = 10
+REPLY_DEPTH = 3
+
+# "most_recent" is an alias the comments AJAX endpoint has always accepted
+COMMENT_SORT_ALIASES = {"most_recent": "newest"}
+
+# sort name -> (key column, ascending) for top-level comments; id breaks ties.
+# Replies are always oldest first.
+COMMENT_SORT_KEYS = {
+    "oldest": (ForumComment.created_at, True),
+    "newest": (ForumComment.created_at, False),
+    "most_voted": (ForumComment.score, False),
+    "most_downvoted": (ForumComment.score, True),
+}
+REPLY_KEY_COLUMNS = (ForumComment.created_at, ForumComment.id)
+
+# (post_id, comments_version, kind, ...) -> (tuple of node dicts, next cursor)
+_page_cache = TTLCache(maxsize=1024, ttl=300)
+
+
+class CommentView:
+    """Per-request view of a cached comment node, adding the reader's vote"""
+
+    __slots__ = ("_node", "_user_votes")
+
+    def __init__(self, node, user_votes):
+        self._node = node
+        self._user_votes = user_votes
+
+    def __getattr__(self, name):
+        try:
+            return self._node[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    @property
+    def _total_votes(self):
+        return self._node["score"]
+
+    @property
+    def _user_vote(self):
+        return self._user_votes.get(self._node["id"])
+
+    @property
+    def _nested_replies(self):
+        return [CommentView(reply, self._user_votes) for reply in self._node["replies"]]
+
+    @property
+    def has_more_replies(self):
+        return bool(self._node["replies_cursor"] or self._node["hidden_reply_count"])
+
+
+def normalize_sort(sort_by):
+    sort_by = COMMENT_SORT_ALIASES.get(sort_by, sort_by)
+    return sort_by if sort_by in COMMENT_SORT_KEYS else "oldest"
+
+
+def _new_node(comment):
+    return {
+        "id": comment.id,
+        "post_id": comment.post_id,
+        "parent_comment_id": comment.parent_comment_id,
+        "author_id": comment.author_id,
+        "author": None,
+        "content": comment.content,
+        "photos": tuple(parse_photo_list(comment.photos)),  # parsed once per cached page
+        "created_at": comment.created_at,
+        "is_edited": comment.is_edited,
+        "is_deleted": comment.is_deleted,
+        "score": comment.score or 0,
+        "replies": [],
+        "replies_cursor": None,  # set when this level holds more replies than were loaded
+        "hidden_reply_count": 0,  # set when replies exist below the depth limit
+    }
+
+
+def _attach_authors(pairs):
+    """Serialize authors (with avatar photos) onto nodes, batch loading profiles"""
+    author_ids = {comment.author_id for _node, comment in pairs if comment.author_id}
+    resident_profiles, employer_profiles = {}, {}
+    if author_ids:
+        resident_profiles = {p.user_id: p for p in ResidentProfile.query.filter(ResidentProfile.user_id.in_(author_ids))}
+        employer_profiles = {p.user_id: p for p in EmployerProfile.query.filter(EmployerProfile.user_id.in_(author_ids))}
+
+    for node, comment in pairs:
+        user = comment.author
+        if user is None:
+            continue
+        resident = resident_profiles.get(user.id)
+        employer = employer_profiles.get(user.id)
+        node["author"] = {
+            "id": user.id,
+            "name": user.name,
+            "resident_profile": {"photo_filename": resident.photo_filename} if resident else None,
+            "employer_profile": {"photo_filename": employer.photo_filename} if employer else None,
+        }
+
+
+def _attach_replies(post_id, pairs, depth):
+    """
+    Load replies under the given (node, comment) pairs, REPLY_DEPTH levels at most,
+    one query per level. Returns every (node, comment) pair loaded, parents included.
+    """
+    loaded = list(pairs)
+    level = {node["id"]: node for node, _comment in pairs}
+
+    for _ in range(depth):
+        if not level:
+            break
+        # First REPLIES_PAGE_SIZE + 1 replies of every parent on this level
+        rank = func.row_number().over(
+            partition_by=ForumComment.parent_comment_id,
+            order_by=REPLY_KEY_COLUMNS
+        ).label("rank")
+        ranked = db.session.query(ForumComment.id, rank).filter(
+            ForumComment.post_id == post_id,
+            ForumComment.parent_comment_id.in_(list(level))
+        ).subquery()
+        children = ForumComment.query.join(ranked, ranked.c.id == ForumComment.id).filter(
+            ranked.c.rank <= REPLIES_PAGE_SIZE + 1
+        ).options(joinedload(ForumComment.author)).order_by(*REPLY_KEY_COLUMNS).all()
+
+        next_level = {}
+        for comment in children:
+            parent = level[comment.parent_comment_id]
+            if len(parent["replies"]) == REPLIES_PAGE_SIZE:
+                last = parent["replies"][-1]
+                parent["replies_cursor"] = encode_cursor((last["created_at"], last["id"]))
+                continue
+            node = _new_node(comment)
+            parent["replies"].append(node)
+            next_level[comment.id] = node
+            loaded.append((node, comment))
+        level = next_level
+
+    # Below the depth limit only say how many replies are waiting
+    if level:
+        counts = db.session.query(
+            ForumComment.parent_comment_id, func.count(ForumComment.id)
+        ).filter(
+            ForumComment.post_id == post_id,
+            ForumComment.parent_comment_id.in_(list(level))
+        ).group_by(ForumComment.parent_comment_id).all()
+        for parent_id, count in counts:
+            level[parent_id]["hidden_reply_count"] = count
+
+    return loaded
+
+
+def build_comment_page(post_id, sort_by="oldest", after=None):
+    """Top-level comments of a post (one page) with their first levels of replies"""
+    sort_column, ascending = COMMENT_SORT_KEYS[sort_by]
+    query = ForumComment.query.filter(
+        ForumComment.post_id == post_id,
+        ForumComment.parent_comment_id.is_(None)
+    ).options(joinedload(ForumComment.author))
+    page = keyset_paginate(query, (sort_column, ForumComment.id), ascending=ascending,
+                           after=after, per_page=COMMENTS_PAGE_SIZE)
+
+    pairs = [(_new_node(comment), comment) for comment in page.items]
+    _attach_authors(_attach_replies(post_id, pairs, REPLY_DEPTH))
+    return tuple(node for node, _comment in pairs), page.next_cursor
+
+
+def build_reply_page(post_id, comment_id, after=None):
+    """Replies to one comment (one page, oldest first) with their first levels of replies"""
+    query = ForumComment.query.filter(
+        ForumComment.post_id == post_id,
+        ForumComment.parent_comment_id == comment_id
+    ).options(joinedload(ForumComment.author))
+    page = keyset_paginate(query, REPLY_KEY_COLUMNS, ascending=True,
+                           after=after, per_page=REPLIES_PAGE_SIZE)
+
+    pairs = [(_new_node(comment), comment) for comment in page.items]
+    _attach_authors(_attach_replies(post_id, pairs, REPLY_DEPTH - 1))
+    return tuple(node for node, _comment in pairs), page.next_cursor
+
+
+def _user_votes(post_id, user_id):
+    if not user_id:
+        return {}
+    return dict(db.session.query(ForumVote.comment_id, ForumVote.vote_type).join(
+        ForumComment, ForumComment.id == ForumVote.comment_id
+    ).filter(
+        ForumVote.user_id == user_id,
+        ForumComment.post_id == post_id
+    ).all())
+
+
+def _preload_photos(nodes):
+    """Warm photo_sources for every photo in the nodes and their loaded replies"""
+    filenames = []
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        filenames.extend(node["photos"])
+        stack.extend(node["replies"])
+    preload_photo_sources(filenames)
+
+
+def get_comment_page(post, sort_by="oldest", user_id=None, after=None):
+    """Return (CommentViews, next_cursor) for a page of the post's top-level comments"""
+    sort_by = normalize_sort(sort_by)
+    key = (post.id, post.comments_version, "comments", sort_by, after)
+    nodes, next_cursor = _page_cache.get_or_set(key, lambda: build_comment_page(post.id, sort_by, after))
+    user_votes = _user_votes(post.id, user_id) if nodes else {}
+    _preload_photos(nodes)
+    return [CommentView(node, user_votes) for node in nodes], next_cursor
+
+
+def get_reply_page(post, comment_id, user_id=None, after=None):
+    """Return (CommentViews, next_cursor) for a page of replies to one comment"""
+    key = (post.id, post.comments_version, "replies", comment_id, after)
+    nodes, next_cursor = _page_cache.get_or_set(key, lambda: build_reply_page(post.id, comment_id, after))
+    user_votes = _user_votes(post.id, user_id) if nodes else {}
+    _preload_photos(nodes)
+    return [CommentView(node, user_votes) for node in nodes], next_cursor
@@ -1,8 +1,16 @@
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
+from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, Response, stream_with_context
 from flask_login import login_required, current_user
 from .models import CompensationData, db
+from sqlalchemy import literal, select, tuple_
+import csv
+import io
+import json
 from .forms import CompensationSubmissionForm
-from sqlalchemy import func
+from .pagination import decode_cursor, encode_cursor
+from .compensation_stats import (
+    compensation_criteria, compensation_distribution, compensation_filter_options, compensation_rank,
+    compensation_summary, record_compensation, DEFAULT_HISTOGRAM_BINS
+)
 
 compensation_bp = Blueprint('compensation', __name__)
 
@@ -44,6 +52,11 @@ def get_specialty_display_name(specialty_code):
         return 'N/A'
     return SPECIALTY_DISPLAY_NAMES.get(specialty_code, specialty_code.replace('_', ' ').title())
 
+def ordinal(n):
+    """1 -> '1st', 22 -> '22nd', 13 -> '13th'"""
+    suffix = 'th' if 10 <= n % 100 <= 20 else {1: 'st', 2: 'nd', 3: 'rd'}.get(n % 10, 'th')
+    return f"{n}{suffix}"
+
 @compensation_bp.route('/compensation')
 def index():
     """Display compensation data dashboard"""
@@ -62,21 +75,10 @@ def index():
     practice_type = request.args.get('practice_type', '')
     
     # Build query
-    query = CompensationData.query
-    
-    if year:
-        query = query.filter(CompensationData.year == year)
-    if region:
-        query = query.filter(CompensationData.region.ilike(f'%{region}%'))
-    if specialty:
-        query = query.filter(CompensationData.specialty.ilike(f'%{specialty}%'))
-    if practice_type:
-        query = query.filter(CompensationData.practice_type == practice_type)
-    
-    # Get available filter options
-    years = db.session.query(CompensationData.year).distinct().order_by(CompensationData.year.desc()).all()
-    regions = db.session.query(CompensationData.region).distinct().order_by(CompensationData.region).all()
-    specialties = db.session.query(CompensationData.specialty).distinct().order_by(CompensationData.specialty).all()
+    query = CompensationData.query.filter(*compensation_criteria(year, region, specialty, practice_type))
+    
+    # Get available filter options (from the pre-aggregated cube)
+    years, regions, specialties = compensation_filter_options()
     
     # Get all possible practice types from the form definition (matching job reviews form)
     all_practice_types = [
@@ -84,84 +86,173 @@ def index():
         'Telemedicine', '1099 Contractor', 'Other'
     ]
     
-    # Get summary statistics based on filtered data - only include non-null values for averages
-    filtered_summary_stats = db.session.query(
-        func.avg(CompensationData.total_compensation).label('avg_total_comp'),
-        func.avg(CompensationData.base_salary).label('avg_base_salary'),
-        func.avg(CompensationData.bonus).label('avg_bonus'),
-        func.avg(CompensationData.rvu_per_work_rvu).label('avg_rvu_rate'),
-        func.avg(CompensationData.hours_per_week).label('avg_hours'),
-        func.count(CompensationData.id).label('total_records')
-    ).filter(query.whereclause).first()
-    
-    # Get overall summary statistics (all data) for comparison
-    overall_summary_stats = db.session.query(
-        func.avg(CompensationData.total_compensation).label('avg_total_comp'),
-        func.avg(CompensationData.base_salary).label('avg_base_salary'),
-        func.avg(CompensationData.bonus).label('avg_bonus'),
-        func.avg(CompensationData.rvu_per_work_rvu).label('avg_rvu_rate'),
-        func.avg(CompensationData.hours_per_week).label('avg_hours'),
-        func.count(CompensationData.id).label('total_records')
-    ).first()
-    
-    # Use filtered stats if filters are applied, otherwise use overall stats
-    summary_stats = filtered_summary_stats if any([year, region, specialty, practice_type]) else overall_summary_stats
+    # Summary statistics for the filter, rolled up from the pre-aggregated cube
+    summary_stats = compensation_summary(year, region, specialty, practice_type)
     
     # Get compensation data
     compensation_data = query.order_by(CompensationData.year.desc(), CompensationData.total_compensation.desc()).limit(100).all()
     
     # Create list of specialties with both codes and display names for the filter dropdown
-    specialty_options = [{'code': s[0], 'name': get_specialty_display_name(s[0])} for s in specialties]
+    specialty_options = [{'code': s, 'name': get_specialty_display_name(s)} for s in specialties]
     specialty_options.sort(key=lambda x: x['name'])  # Sort by display name
     
     return render_template('compensation/index.html',
                          compensation_data=compensation_data,
-                         years=[y[0] for y in years],
-                         regions=[r[0] for r in regions],
-                         specialties=[s[0] for s in specialties],
+                         years=years,
+                         regions=regions,
+                         specialties=specialties,
                          specialty_options=specialty_options,
                          practice_types=all_practice_types,
                          summary_stats=summary_stats,
                          current_filters={'year': year, 'region': region, 'specialty': specialty, 'practice_type': practice_type},
                          get_specialty_display_name=get_specialty_display_name)
 
+# Columns served by /compensation/api/data, in output order
+API_DATA_COLUMNS = [
+    CompensationData.id, CompensationData.year, CompensationData.region, CompensationData.specialty,
+    CompensationData.total_compensation, CompensationData.base_salary, CompensationData.bonus,
+    CompensationData.rvu_total, CompensationData.rvu_per_work_rvu, CompensationData.work_rvus,
+    CompensationData.total_rvus, CompensationData.hours_per_week, CompensationData.weeks_per_year,
+    CompensationData.source, CompensationData.is_anonymous_submission, CompensationData.practice_type,
+    CompensationData.experience_years
+]
+API_DATA_FIELDS = [column.key for column in API_DATA_COLUMNS]
+API_DATA_KEY_COLUMNS = (CompensationData.year, CompensationData.id)  # newest year first, id breaks ties
+API_DATA_PAGE_SIZE = 500
+API_DATA_MAX_PAGE_SIZE = 5000
+API_DATA_STREAM_BATCH_SIZE = 1000
+
+
+def _api_data_rows(criteria):
+    """Every matching row as a plain tuple, fetched from the database in batches"""
+    statement = select(*API_DATA_COLUMNS).where(*criteria).order_by(
+        *[column.desc() for column in API_DATA_KEY_COLUMNS]
+    ).execution_options(yield_per=API_DATA_STREAM_BATCH_SIZE)
+    for row in db.session.execute(statement):
+        yield tuple(row)
+
+
+def _stream_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(API_DATA_FIELDS)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % API_DATA_STREAM_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _stream_ndjson(rows):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(API_DATA_FIELDS, row))))
+        if len(lines) == API_DATA_STREAM_BATCH_SIZE:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
 @compensation_bp.route('/compensation/api/data')
 def api_data():
-    """API endpoint for compensation data"""
-    year = request.args.get('year', type=int)
-    region = request.args.get('region', '')
-    specialty = request.args.get('specialty', '')
+    """
+    API endpoint for compensation data.
+    JSON (default) is served a page at a time; the next page's cursor is in
+    the X-Next-Cursor and Link headers. format=csv or format=ndjson streams
+    every matching row with flat memory use.
+    """
+    if not current_user.is_authenticated:
+        return jsonify({'error': 'Login required'}), 401
+    
+    from .utils import user_has_contributed
+    if not user_has_contributed():
+        return jsonify({'error': 'Contribute compensation data to access the data'}), 403
+    
+    criteria = compensation_criteria(
+        request.args.get('year', type=int),
+        request.args.get('region', ''),
+        request.args.get('specialty', ''),
+        request.args.get('practice_type', '')
+    )
+    output_format = request.args.get('format', 'json')
+    
+    if output_format == 'csv':
+        return Response(stream_with_context(_stream_csv(_api_data_rows(criteria))), mimetype='text/csv',
+                        headers={'Content-Disposition': 'attachment; filename=compensation_data.csv'})
+    if output_format == 'ndjson':
+        return Response(stream_with_context(_stream_ndjson(_api_data_rows(criteria))), mimetype='application/x-ndjson')
+    if output_format != 'json':
+        return jsonify({'error': 'format must be json, csv or ndjson'}), 400
+    
+    limit = min(max(request.args.get('limit', API_DATA_PAGE_SIZE, type=int), 1), API_DATA_MAX_PAGE_SIZE)
+    statement = select(*API_DATA_COLUMNS).where(*criteria)
+    cursor = decode_cursor(request.args.get('after'), API_DATA_KEY_COLUMNS)
+    if cursor is not None:
+        bound = tuple_(*[literal(value, type_=column.type) for value, column in zip(cursor, API_DATA_KEY_COLUMNS)])
+        statement = statement.where(tuple_(*API_DATA_KEY_COLUMNS) < bound)
+    rows = db.session.execute(
+        statement.order_by(*[column.desc() for column in API_DATA_KEY_COLUMNS]).limit(limit + 1)
+    ).all()
+    
+    response = jsonify([dict(zip(API_DATA_FIELDS, row)) for row in rows[:limit]])
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor((last.year, last.id))
+        next_args = {**request.args.to_dict(), 'after': next_cursor}
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{url_for("compensation.api_data", _external=True, **next_args)}>; rel="next"'
+    return response
+
+
+@compensation_bp.route('/compensation/api/stats')
+def api_stats():
+    """Median, percentiles and histograms of compensation, RVU rate and hours for the dashboard filters"""
+    if not current_user.is_authenticated:
+        return jsonify({'error': 'Login required'}), 401
+    
+    from .utils import user_has_contributed
+    if not user_has_contributed():
+        return jsonify({'error': 'Contribute compensation data to access statistics'}), 403
+    
+    filters = {
+        'year': request.args.get('year', type=int),
+        'region': request.args.get('region', ''),
+        'specialty': request.args.get('specialty', ''),
+        'practice_type': request.args.get('practice_type', ''),
+    }
+    bins = request.args.get('bins', DEFAULT_HISTOGRAM_BINS, type=int)
+    
+    return jsonify({
+        'filters': filters,
+        'metrics': compensation_distribution(bins=bins, **filters)
+    })
+
+
+@compensation_bp.route('/compensation/api/my-rank')
+@login_required
+def api_my_rank():
+    """Percentile of the user's submission (latest, or ?submission_id=) within its specialty/region/practice type cohort"""
+    query = CompensationData.query.filter_by(user_id=current_user.id)
+    submission_id = request.args.get('submission_id', type=int)
+    if submission_id:
+        query = query.filter(CompensationData.id == submission_id)
+    submission = query.order_by(CompensationData.created_at.desc(), CompensationData.id.desc()).first()
+    if submission is None:
+        return jsonify({'error': 'No compensation submission found'}), 404
     
-    query = CompensationData.query
-    
-    if year:
-        query = query.filter(CompensationData.year == year)
-    if region:
-        query = query.filter(CompensationData.region.ilike(f'%{region}%'))
-    if specialty:
-        query = query.filter(CompensationData.specialty.ilike(f'%{specialty}%'))
-    
-    data = query.order_by(CompensationData.year.desc()).all()
-    
-    return jsonify([{
-        'id': item.id,
-        'year': item.year,
-        'region': item.region,
-        'specialty': item.specialty,
-        'total_compensation': item.total_compensation,
-        'base_salary': item.base_salary,
-        'bonus': item.bonus,
-        'rvu_total': item.rvu_total,
-        'rvu_per_work_rvu': item.rvu_per_work_rvu,
-        'work_rvus': item.work_rvus,
-        'total_rvus': item.total_rvus,
-        'hours_per_week': item.hours_per_week,
-        'weeks_per_year': item.weeks_per_year,
-        'source': item.source,
-        'is_anonymous_submission': item.is_anonymous_submission,
-        'practice_type': item.practice_type,
-        'experience_years': item.experience_years
-    } for item in data])
+    return jsonify({
+        'submission_id': submission.id,
+        'total_compensation': submission.total_compensation,
+        'cohort': {
+            'specialty': submission.specialty,
+            'region': submission.region,
+            'practice_type': submission.practice_type
+        },
+        **compensation_rank(submission)
+    })
 
 
 @compensation_bp.route('/compensation/submit', methods=['GET', 'POST'])
@@ -198,8 +289,13 @@ def submit_compensation():
         
         try:
             db.session.add(compensation_data)
+            record_compensation(compensation_data)
             db.session.commit()
             flash('Thank you! Your anonymous compensation data has been submitted successfully.', 'success')
+            rank = compensation_rank(compensation_data)
+            if rank['percentile'] is not None:
+                flash(f"Your total compensation is at the {ordinal(round(rank['percentile']))} percentile of "
+                      f"{rank['cohort_size']} submissions for your specialty, region and practice type.", 'info')
             return redirect(url_for('compensation.index'))
         except Exception as e:
             db.session.rollback()
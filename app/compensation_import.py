@@ -0,0 +1,285 @@
+"""
+Bulk import of survey compensation data (MGMA-style reference rows)
+
+A CSV or XLSX file is streamed in CHUNK_SIZE rows at a time. Each chunk is
+validated column-wise with NumPy (number parsing, ranges, required fields)
+and every problem is reported against its file line. Valid rows are loaded
+with COPY on PostgreSQL or a single executemany INSERT elsewhere, all in one
+transaction, and the compensation statistics cube is rebuilt before commit.
+
+By default an import is all-or-nothing: any invalid row rolls the whole file
+back (the rest of the file is still validated so every error is reported).
+skip_invalid loads the valid rows and reports the others; dry_run only
+validates.
+
+Used by the admin import page and by import_compensation_data.py.
+"""
+
+import csv
+import io
+from datetime import datetime
+from itertools import islice
+
+import numpy as np
+from sqlalchemy import insert
+
+from .compensation import SPECIALTY_DISPLAY_NAMES
+from .compensation_stats import rebuild_compensation_cube
+from .models import db, CompensationData
+
+CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+DEFAULT_SOURCE = "MGMA Survey"
+
+REGIONS = ("Northeast", "Southeast", "Midwest", "West")
+
+# column -> (required, whole number, min, max); base_salary, bonus and
+# weeks_per_year get defaults below when left empty
+NUMERIC_COLUMNS = {
+    "year": (True, True, 1990, 2100),
+    "total_compensation": (True, True, 1, 50_000_000),
+    "base_salary": (False, True, 0, 50_000_000),
+    "bonus": (False, True, 0, 50_000_000),
+    "rvu_total": (False, True, 0, 1_000_000),
+    "rvu_per_work_rvu": (False, False, 0, 10_000),
+    "work_rvus": (False, True, 0, 1_000_000),
+    "total_rvus": (False, True, 0, 1_000_000),
+    "hours_per_week": (False, False, 1, 168),
+    "weeks_per_year": (False, False, 1, 53),
+    "experience_years": (False, True, 0, 70),
+}
+TEXT_COLUMNS = ("region", "specialty", "practice_type", "source")
+REQUIRED_COLUMNS = ("year", "region", "specialty", "total_compensation")
+MAX_TEXT_LENGTH = 100
+
+# Column order of the COPY / INSERT
+LOAD_COLUMNS = (
+    "year", "region", "specialty", "total_compensation", "base_salary", "bonus", "rvu_total",
+    "rvu_per_work_rvu", "work_rvus", "total_rvus", "hours_per_week", "weeks_per_year", "source",
+    "is_anonymous_submission", "practice_type", "experience_years", "created_at",
+)
+
+_REGIONS_BY_NAME = {region.lower(): region for region in REGIONS}
+_SPECIALTIES_BY_NAME = {
+    **{name.lower(): code for code, name in SPECIALTY_DISPLAY_NAMES.items()},
+    **{code: code for code in SPECIALTY_DISPLAY_NAMES},
+}
+
+
+class ImportReport:
+    """Outcome of an import: row counts and (line, message) errors"""
+
+    def __init__(self):
+        self.rows_read = 0
+        self.rows_imported = 0
+        self.error_count = 0
+        self.errors = []  # first MAX_REPORTED_ERRORS (line, message)
+        self.ignored_columns = []
+        self.committed = False
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def to_dict(self):
+        return {
+            "rows_read": self.rows_read,
+            "rows_imported": self.rows_imported,
+            "error_count": self.error_count,
+            "errors": [{"line": line, "message": message} for line, message in self.errors],
+            "ignored_columns": self.ignored_columns,
+            "committed": self.committed,
+        }
+
+
+def _normalize_header(name):
+    return str(name or "").strip().lower().replace(" ", "_").replace("-", "_")
+
+
+def _read_csv(stream):
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    reader = csv.reader(text)
+    header = next(reader, None)
+    yield header
+    for row in reader:
+        if any(cell.strip() for cell in row):
+            yield reader.line_num, row
+
+
+def _read_xlsx(stream):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("XLSX import needs the openpyxl package; upload a CSV file instead")
+    sheet = load_workbook(stream, read_only=True, data_only=True).active
+    rows = sheet.iter_rows(values_only=True)
+    yield next(rows, None)
+    for line, row in enumerate(rows, start=2):
+        if any(cell not in (None, "") for cell in row):
+            yield line, row
+
+
+def read_rows(stream, filename):
+    """(header, iterator of (line, {column: raw value})) for a CSV or XLSX upload"""
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        rows = _read_xlsx(stream)
+    elif filename.lower().endswith(".csv"):
+        rows = _read_csv(stream)
+    else:
+        raise ValueError("Upload a .csv or .xlsx file")
+
+    header = next(rows)
+    if not header:
+        raise ValueError("The file is empty")
+    header = [_normalize_header(name) for name in header]
+    missing = [column for column in REQUIRED_COLUMNS if column not in header]
+    if missing:
+        raise ValueError(f"Missing required column(s): {', '.join(missing)}")
+
+    def records():
+        for line, row in rows:
+            yield line, dict(zip(header, row))
+    return header, records()
+
+
+def _numeric(raw_values, name, lines, report, invalid):
+    """Parse one column of a chunk into a float array (NaN = empty), flagging bad rows"""
+    required, whole, low, high = NUMERIC_COLUMNS[name]
+    text = np.array(["" if value is None else str(value) for value in raw_values], dtype=str)
+    text = np.char.strip(np.char.replace(np.char.replace(text, ",", ""), "$", ""))
+    empty = text == ""
+    unparsed = np.zeros(len(text), dtype=bool)
+    values = np.full(len(text), np.nan)
+
+    try:
+        values[~empty] = text[~empty].astype(float)
+    except ValueError:
+        # Rare: find the offending cells one by one
+        for i in np.flatnonzero(~empty):
+            try:
+                values[i] = float(text[i])
+            except ValueError:
+                report.add_error(lines[i], f"{name}: {raw_values[i]!r} is not a number")
+                unparsed[i] = True
+
+    invalid |= unparsed
+    present = ~np.isnan(values)
+    for i in np.flatnonzero(present & ((values < low) | (values > high))):
+        report.add_error(lines[i], f"{name}: {text[i]} is outside {low}-{high}")
+        invalid[i] = True
+    if whole:
+        for i in np.flatnonzero(present & (values != np.floor(values))):
+            report.add_error(lines[i], f"{name}: {text[i]} is not a whole number")
+            invalid[i] = True
+    if required:
+        for i in np.flatnonzero(~present & ~unparsed):
+            report.add_error(lines[i], f"{name} is required")
+            invalid[i] = True
+    return values
+
+
+def _text(raw_values, name, lines, report, invalid):
+    values = np.array(["" if value is None else str(value).strip() for value in raw_values], dtype=object)
+    lengths = np.fromiter((len(value) for value in values), dtype=int, count=len(values))
+    for i in np.flatnonzero(lengths > MAX_TEXT_LENGTH):
+        report.add_error(lines[i], f"{name} is longer than {MAX_TEXT_LENGTH} characters")
+        invalid[i] = True
+    return values
+
+
+def _lookup(values, mapping, name, lines, report, invalid):
+    """Map names to their canonical value (case-insensitive), flagging unknown or empty ones"""
+    result = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        canonical = mapping.get(value.lower())
+        if canonical is None:
+            report.add_error(lines[i], f"{name} is required" if not value else f"{name}: unknown value {value!r}")
+            invalid[i] = True
+        result[i] = canonical
+    return result
+
+
+def _validate_chunk(chunk, report):
+    """Validate a chunk of (line, record) pairs; returns the load tuples of its valid rows"""
+    lines = [line for line, _record in chunk]
+    records = [record for _line, record in chunk]
+    invalid = np.zeros(len(chunk), dtype=bool)
+
+    def column(name):
+        return [record.get(name) for record in records]
+
+    numbers = {name: _numeric(column(name), name, lines, report, invalid) for name in NUMERIC_COLUMNS}
+    texts = {name: _text(column(name), name, lines, report, invalid) for name in TEXT_COLUMNS}
+    region = _lookup(texts["region"], _REGIONS_BY_NAME, "region", lines, report, invalid)
+    specialty = _lookup(texts["specialty"], _SPECIALTIES_BY_NAME, "specialty", lines, report, invalid)
+
+    # Defaults, as the submission form sets them
+    base_salary = np.where(np.isnan(numbers["base_salary"]), numbers["total_compensation"], numbers["base_salary"])
+    bonus = np.nan_to_num(numbers["bonus"], nan=0.0)
+    weeks = np.nan_to_num(numbers["weeks_per_year"], nan=52.0)
+
+    def whole(value):
+        return None if np.isnan(value) else int(value)
+
+    def real(value):
+        return None if np.isnan(value) else float(value)
+
+    now = datetime.utcnow()
+    rows = []
+    for i in np.flatnonzero(~invalid):
+        rows.append((
+            int(numbers["year"][i]), region[i], specialty[i], int(numbers["total_compensation"][i]),
+            int(base_salary[i]), int(bonus[i]), whole(numbers["rvu_total"][i]),
+            real(numbers["rvu_per_work_rvu"][i]), whole(numbers["work_rvus"][i]), whole(numbers["total_rvus"][i]),
+            real(numbers["hours_per_week"][i]), float(weeks[i]), texts["source"][i] or DEFAULT_SOURCE,
+            False, texts["practice_type"][i] or None, whole(numbers["experience_years"][i]), now,
+        ))
+    return rows
+
+
+def _load_rows(rows):
+    """Insert load tuples in the session's transaction: COPY on PostgreSQL, executemany elsewhere"""
+    connection = db.session.connection()
+    if connection.dialect.name == "postgresql":
+        driver_connection = connection.connection.driver_connection
+        table = CompensationData.__tablename__
+        with driver_connection.cursor() as cursor:
+            with cursor.copy(f"COPY {table} ({', '.join(LOAD_COLUMNS)}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+    else:
+        db.session.execute(insert(CompensationData.__table__), [dict(zip(LOAD_COLUMNS, row)) for row in rows])
+
+
+def import_compensation_file(stream, filename, skip_invalid=False, dry_run=False):
+    """Validate and load a CSV/XLSX file of compensation rows; returns an ImportReport"""
+    report = ImportReport()
+    header, records = read_rows(stream, filename)
+    known = set(NUMERIC_COLUMNS) | set(TEXT_COLUMNS)
+    report.ignored_columns = [name for name in header if name and name not in known]
+
+    try:
+        while True:
+            chunk = list(islice(records, CHUNK_SIZE))
+            if not chunk:
+                break
+            report.rows_read += len(chunk)
+            rows = _validate_chunk(chunk, report)
+            # Strict imports stop loading at the first error but keep validating
+            if rows and not dry_run and (skip_invalid or not report.error_count):
+                _load_rows(rows)
+                report.rows_imported += len(rows)
+
+        if dry_run or (report.error_count and not skip_invalid) or not report.rows_imported:
+            db.session.rollback()
+            report.rows_imported = 0
+            return report
+
+        rebuild_compensation_cube()
+        db.session.commit()
+        report.committed = True
+        return report
+    except Exception:
+        db.session.rollback()
+        raise
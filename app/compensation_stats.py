@@ -0,0 +1,371 @@
+"""
+Pre-aggregated compensation statistics
+
+CompensationCube holds one row per (year, region, specialty, practice_type)
+with the count, sum and sum of squares of every dashboard metric plus a
+quantile sketch of total compensation. Each submission or delete adjusts
+its cell in the same transaction, so the dashboard answers any filter by
+rolling up a handful of cube rows instead of scanning raw submissions.
+rebuild_compensation_cube() recomputes the cube from CompensationData
+(migration backfill, bulk imports).
+
+Medians, percentiles and histograms cannot be rolled up exactly, so
+compensation_distribution() loads the metric columns of the filtered
+submissions once as NumPy arrays and computes them vectorized.
+
+"Where do I rank" answers come from the sorted total compensation values of
+a (specialty, region, practice_type) cohort, cached per cohort and searched
+with bisect, so a lookup is O(log n) once the cohort is loaded. A submission
+or delete drops its cohort, which is reloaded (one index range scan) on the
+next lookup.
+
+Roll-ups and distributions are cached for ROLLUP_CACHE_TTL seconds per
+filter; the worker that takes a submission drops its cache at once, other
+workers catch up within that window.
+"""
+
+import json
+import math
+from bisect import bisect_left, bisect_right
+from collections import Counter, namedtuple
+
+import numpy as np
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+
+from .cache import TTLCache
+from .models import db, CompensationCube, CompensationData
+
+ROLLUP_CACHE_TTL = 60  # seconds
+REBUILD_BATCH_SIZE = 1000
+
+# cube column prefix -> CompensationData column
+METRICS = {
+    "total_comp": "total_compensation",
+    "base_salary": "base_salary",
+    "bonus": "bonus",
+    "rvu_rate": "rvu_per_work_rvu",
+    "hours": "hours_per_week",
+}
+
+SKETCH_RELATIVE_ACCURACY = 0.01
+_SKETCH_GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+_SKETCH_LOG_GAMMA = math.log(_SKETCH_GAMMA)
+
+CompensationSummary = namedtuple("CompensationSummary", [
+    "total_records", "avg_total_comp", "avg_base_salary", "avg_bonus", "avg_rvu_rate", "avg_hours",
+    "stddev_total_comp", "median_total_comp",
+])
+
+# Metrics with distributions: name in the API -> CompensationData column
+DISTRIBUTION_METRICS = {
+    "total_compensation": "total_compensation",
+    "rvu_rate": "rvu_per_work_rvu",
+    "hours_per_week": "hours_per_week",
+}
+DISTRIBUTION_PERCENTILES = (25, 50, 75, 90)
+DEFAULT_HISTOGRAM_BINS = 20
+MAX_HISTOGRAM_BINS = 100
+
+# Cohorts smaller than this get no percentile, so a rank never singles out a few submissions
+MIN_COHORT_SIZE = 5
+COHORT_CACHE_TTL = 600  # seconds
+
+# (specialty, region, practice_type) -> sorted tuple of total compensation values
+_cohort_cache = TTLCache(maxsize=1024, ttl=COHORT_CACHE_TTL)
+
+# ("summary" / "arrays", filters...) -> CompensationSummary / metric arrays; ("options",) -> dropdown values
+_rollup_cache = TTLCache(maxsize=512, ttl=ROLLUP_CACHE_TTL)
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch: a histogram over logarithmic buckets, so every
+    quantile it reports is within SKETCH_RELATIVE_ACCURACY of a true value
+    (the DDSketch construction). Merging two sketches adds their bucket
+    counts, and a value is removed by adding it with weight -1.
+    """
+
+    def __init__(self, buckets=None):
+        self.buckets = Counter()
+        if buckets:
+            self.buckets.update({int(key): count for key, count in buckets.items()})
+
+    @classmethod
+    def from_json(cls, text):
+        try:
+            return cls(json.loads(text) if text else None)
+        except (json.JSONDecodeError, TypeError, ValueError):
+            return cls()
+
+    def to_json(self):
+        return json.dumps({str(key): count for key, count in sorted(self.buckets.items()) if count > 0},
+                          separators=(",", ":"))
+
+    @property
+    def count(self):
+        return sum(count for count in self.buckets.values() if count > 0)
+
+    def add(self, value, weight=1):
+        # Values below 1 (zero pay, missing data entered as 0) share the lowest bucket
+        key = math.ceil(math.log(max(value, 1)) / _SKETCH_LOG_GAMMA)
+        self.buckets[key] += weight
+        if self.buckets[key] <= 0:
+            del self.buckets[key]
+
+    def merge(self, other):
+        self.buckets.update(other.buckets)
+        return self
+
+    def quantile(self, q):
+        """Value at quantile q (0..1), or None for an empty sketch"""
+        total = self.count
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for key in sorted(self.buckets):
+            seen += max(self.buckets[key], 0)
+            if seen > rank:
+                # Midpoint of the bucket (gamma^(key-1), gamma^key], relative error <= accuracy
+                return 2 * _SKETCH_GAMMA ** key / (_SKETCH_GAMMA + 1)
+        return None
+
+
+def _cell_key(record):
+    return (record.year, record.region, record.specialty, record.practice_type or "")
+
+
+def _cohort_key(record):
+    return (record.specialty, record.region, record.practice_type)
+
+
+def _empty_cell(year, region, specialty, practice_type):
+    cell = CompensationCube(year=year, region=region, specialty=specialty, practice_type=practice_type,
+                            record_count=0, total_comp_sketch=None)
+    for prefix in METRICS:
+        setattr(cell, f"{prefix}_count", 0)
+        setattr(cell, f"{prefix}_sum", 0.0)
+        setattr(cell, f"{prefix}_sumsq", 0.0)
+    return cell
+
+
+def _apply(cell, values, weight, sketch=None):
+    """Add (weight 1) or remove (weight -1) one submission's values to a cell"""
+    cell.record_count += weight
+    for prefix, column in METRICS.items():
+        value = values[column]
+        if value is None:
+            continue
+        setattr(cell, f"{prefix}_count", getattr(cell, f"{prefix}_count") + weight)
+        setattr(cell, f"{prefix}_sum", getattr(cell, f"{prefix}_sum") + weight * value)
+        setattr(cell, f"{prefix}_sumsq", getattr(cell, f"{prefix}_sumsq") + weight * value * value)
+
+    if values["total_compensation"] is not None:
+        own_sketch = sketch is None
+        if own_sketch:
+            sketch = QuantileSketch.from_json(cell.total_comp_sketch)
+        sketch.add(values["total_compensation"], weight)
+        if own_sketch:
+            cell.total_comp_sketch = sketch.to_json()
+
+
+def _record_values(record):
+    return {column: getattr(record, column) for column in METRICS.values()}
+
+
+def _locked_cell(key, create):
+    year, region, specialty, practice_type = key
+    criteria = dict(year=year, region=region, specialty=specialty, practice_type=practice_type)
+    cell = CompensationCube.query.filter_by(**criteria).with_for_update().first()
+    if cell is None and create:
+        try:
+            with db.session.begin_nested():
+                cell = _empty_cell(**criteria)
+                db.session.add(cell)
+        except IntegrityError:
+            # Another submission created the cell first
+            cell = CompensationCube.query.filter_by(**criteria).with_for_update().first()
+    return cell
+
+
+def record_compensation(record):
+    """Add a new CompensationData row to the cube. Does not commit."""
+    _apply(_locked_cell(_cell_key(record), create=True), _record_values(record), 1)
+    _rollup_cache.clear()
+    _cohort_cache.delete(_cohort_key(record))
+
+
+def retract_compensation(record):
+    """Take a CompensationData row about to be deleted out of the cube. Does not commit."""
+    cell = _locked_cell(_cell_key(record), create=False)
+    if cell is None:
+        return
+    _apply(cell, _record_values(record), -1)
+    if cell.record_count <= 0:
+        db.session.delete(cell)
+    _rollup_cache.clear()
+    _cohort_cache.delete(_cohort_key(record))
+
+
+def rebuild_compensation_cube():
+    """Recompute every cube cell from CompensationData. Does not commit; returns the number of cells."""
+    cells, sketches = {}, {}
+    columns = [CompensationData.year, CompensationData.region, CompensationData.specialty,
+               CompensationData.practice_type] + [getattr(CompensationData, c) for c in METRICS.values()]
+    rows = db.session.execute(select(*columns).execution_options(yield_per=REBUILD_BATCH_SIZE))
+    for row in rows:
+        key = _cell_key(row)
+        cell = cells.get(key)
+        if cell is None:
+            cell = cells[key] = _empty_cell(*key)
+            sketches[key] = QuantileSketch()
+        _apply(cell, row._mapping, 1, sketch=sketches[key])
+
+    for key, cell in cells.items():
+        cell.total_comp_sketch = sketches[key].to_json()
+
+    db.session.execute(delete(CompensationCube).execution_options(synchronize_session=False))
+    db.session.add_all(cells.values())
+    db.session.flush()
+    _rollup_cache.clear()
+    _cohort_cache.clear()
+    return len(cells)
+
+
+def compensation_criteria(year=None, region="", specialty="", practice_type=""):
+    """WHERE criteria on CompensationData for the dashboard filters (substring match on region and specialty)"""
+    criteria = []
+    if year:
+        criteria.append(CompensationData.year == year)
+    if region:
+        criteria.append(CompensationData.region.ilike(f"%{region}%"))
+    if specialty:
+        criteria.append(CompensationData.specialty.ilike(f"%{specialty}%"))
+    if practice_type:
+        criteria.append(CompensationData.practice_type == practice_type)
+    return criteria
+
+
+def _filtered_cells(year=None, region="", specialty="", practice_type=""):
+    # Same matching as compensation_criteria()
+    query = CompensationCube.query
+    if year:
+        query = query.filter(CompensationCube.year == year)
+    if region:
+        query = query.filter(CompensationCube.region.ilike(f"%{region}%"))
+    if specialty:
+        query = query.filter(CompensationCube.specialty.ilike(f"%{specialty}%"))
+    if practice_type:
+        query = query.filter(CompensationCube.practice_type == practice_type)
+    return query.all()
+
+
+def _summarize(cells):
+    totals = Counter()
+    sketch = QuantileSketch()
+    for cell in cells:
+        totals["records"] += cell.record_count
+        for prefix in METRICS:
+            for stat in ("count", "sum", "sumsq"):
+                totals[f"{prefix}_{stat}"] += getattr(cell, f"{prefix}_{stat}")
+        sketch.merge(QuantileSketch.from_json(cell.total_comp_sketch))
+
+    def mean(prefix):
+        count = totals[f"{prefix}_count"]
+        return totals[f"{prefix}_sum"] / count if count else None
+
+    stddev = None
+    count = totals["total_comp_count"]
+    if count > 1:
+        variance = (totals["total_comp_sumsq"] - totals["total_comp_sum"] ** 2 / count) / (count - 1)
+        stddev = math.sqrt(max(variance, 0.0))
+
+    return CompensationSummary(
+        total_records=totals["records"],
+        avg_total_comp=mean("total_comp"),
+        avg_base_salary=mean("base_salary"),
+        avg_bonus=mean("bonus"),
+        avg_rvu_rate=mean("rvu_rate"),
+        avg_hours=mean("hours"),
+        stddev_total_comp=stddev,
+        median_total_comp=sketch.quantile(0.5),
+    )
+
+
+def compensation_summary(year=None, region="", specialty="", practice_type=""):
+    """Dashboard statistics for a filter, rolled up from the cube"""
+    key = ("summary", year or None, region, specialty, practice_type)
+    return _rollup_cache.get_or_set(key, lambda: _summarize(_filtered_cells(year, region, specialty, practice_type)))
+
+
+def compensation_filter_options():
+    """(years newest first, regions, specialties) present in the data, for the filter dropdowns"""
+    def load():
+        keys = db.session.query(CompensationCube.year, CompensationCube.region, CompensationCube.specialty).all()
+        return (sorted({k.year for k in keys}, reverse=True),
+                sorted({k.region for k in keys}),
+                sorted({k.specialty for k in keys}))
+    return _rollup_cache.get_or_set(("options",), load)
+
+
+def _metric_arrays(year, region, specialty, practice_type):
+    """Float arrays (nulls dropped) of every distribution metric for a filter, cached"""
+    def load():
+        columns = [getattr(CompensationData, column) for column in DISTRIBUTION_METRICS.values()]
+        rows = db.session.execute(
+            select(*columns).where(*compensation_criteria(year, region, specialty, practice_type))
+        ).all()
+        # None becomes NaN; one 2-D array, then one column per metric
+        table = np.array(rows, dtype=float).reshape(len(rows), len(columns))
+        return {name: table[:, i][~np.isnan(table[:, i])] for i, name in enumerate(DISTRIBUTION_METRICS)}
+    return _rollup_cache.get_or_set(("arrays", year or None, region, specialty, practice_type), load)
+
+
+def _describe(values, bins):
+    if not values.size:
+        return {"count": 0, "mean": None, "percentiles": None, "histogram": None}
+    percentiles = np.percentile(values, DISTRIBUTION_PERCENTILES)
+    counts, edges = np.histogram(values, bins=bins)
+    return {
+        "count": int(values.size),
+        "mean": float(values.mean()),
+        "percentiles": {f"p{p}": float(v) for p, v in zip(DISTRIBUTION_PERCENTILES, percentiles)},
+        "histogram": {"edges": edges.tolist(), "counts": counts.tolist()},
+    }
+
+
+def compensation_distribution(year=None, region="", specialty="", practice_type="", bins=DEFAULT_HISTOGRAM_BINS):
+    """Count, mean, P25/P50/P75/P90 and a histogram of each distribution metric for a filter"""
+    bins = min(max(int(bins), 1), MAX_HISTOGRAM_BINS)
+    arrays = _metric_arrays(year, region, specialty, practice_type)
+    return {name: _describe(values, bins) for name, values in arrays.items()}
+
+
+def _cohort_values(specialty, region, practice_type):
+    def load():
+        return tuple(db.session.execute(
+            select(CompensationData.total_compensation).where(
+                CompensationData.specialty == specialty,
+                CompensationData.region == region,
+                CompensationData.practice_type == practice_type,  # IS NULL when None
+                CompensationData.total_compensation.isnot(None)
+            ).order_by(CompensationData.total_compensation)
+        ).scalars())
+    return _cohort_cache.get_or_set((specialty, region, practice_type), load)
+
+
+def compensation_rank(record):
+    """
+    Where a submission's total compensation falls in its (specialty, region,
+    practice_type) cohort: {"cohort_size", "percentile"}. percentile counts
+    ties as half below, and is None for cohorts under MIN_COHORT_SIZE.
+    """
+    values = _cohort_values(*_cohort_key(record))
+    size = len(values)
+    percentile = None
+    if size >= MIN_COHORT_SIZE and record.total_compensation is not None:
+        below = bisect_left(values, record.total_compensation)
+        ties = bisect_right(values, record.total_compensation) - below
+        percentile = round(100.0 * (below + 0.5 * ties) / size, 1)
+    return {"cohort_size": size, "percentile": percentile}
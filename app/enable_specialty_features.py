@@ -4,43 +4,31 @@ This module dynamically enables/disables features based on database schema
 """
 
 import logging
-from .auto_migrate import check_column_exists
+from .schema_capabilities import schema_capabilities
 
 logger = logging.getLogger(__name__)
 
 def should_enable_forum_specialty():
     """Check if forum specialty features should be enabled"""
-    return check_column_exists('forum_post', 'specialty')
+    return schema_capabilities.has_column('forum_post', 'specialty')
 
 def should_enable_resident_specialty():
     """Check if resident profile specialty features should be enabled"""
-    return check_column_exists('resident_profile', 'medical_specialty')
+    return schema_capabilities.has_column('resident_profile', 'medical_specialty')
 
 def get_forum_query_with_specialty_support():
     """
     Return appropriate forum query based on whether specialty column exists
-    This allows the forum to work regardless of migration status
+    This allows the forum to work regardless of migration status.
+    Both cases return ForumPost entities; without the column it is simply
+    never loaded.
     """
-    from .models import ForumPost, ForumCategory
+    from sqlalchemy.orm import defer
+    from .models import ForumPost
     
     if should_enable_forum_specialty():
-        # Full query with specialty support
         return ForumPost.query
-    else:
-        # Limited query without specialty column
-        from .models import db
-        return db.session.query(
-            ForumPost.id,
-            ForumPost.author_id,
-            ForumPost.title, 
-            ForumPost.content,
-            ForumPost.category,
-            ForumPost.created_at,
-            ForumPost.updated_at,
-            ForumPost.is_pinned,
-            ForumPost.is_locked,
-            ForumPost.photos
-        )
+    return ForumPost.query.options(defer(ForumPost.specialty, raiseload=True))
 
 def log_feature_status():
     """Log which specialty features are currently enabled"""
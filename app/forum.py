@@ -1,25 +1,46 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
 from flask_login import login_required, current_user
-from sqlalchemy import and_, desc, asc, func, case, select
+from sqlalchemy import desc, asc, func, case, select, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import joinedload, selectinload
-from .models import db, ForumPost, ForumComment, ForumVote, ForumCategory, User, ResidentProfile, EmployerProfile
+from .models import db, ForumPost, ForumComment, ForumVote, ForumCategory, PhotoAsset, User
+from .forum_ranking import hot_score, refresh_hot_scores, HOT_SCORE_PG_SQL
+from .pagination import keyset_paginate
+from .cache import TTLCache
+from .comment_tree import get_comment_page, get_reply_page
+from .media import is_stored_name
+from .view_counts import view_counter
+from .forum_rendering import rendered_post
+from .cascade_delete import delete_forum_posts
+from .photos import PHOTO_URL_PREFIX, IMAGE_EXTENSIONS, preload_photo_sources, sniff_image, store_upload, is_photo_referenced, record_photo_references, delete_photo_files
 from datetime import datetime
-import os
-import uuid
 import json
-from werkzeug.utils import secure_filename
-from PIL import Image
 
 forum_bp = Blueprint("forum", __name__)
 
 
+FORUM_PAGE_SIZE = 20
+
+# sort name -> (key column, ascending); ForumPost.id is always the tie-breaker
+FORUM_SORT_KEYS = {
+    "newest": (ForumPost.created_at, False),
+    "oldest": (ForumPost.created_at, True),
+    "most_voted": (ForumPost.score, False),
+    "hot": (ForumPost.hot_score, False),
+    "most_commented": (ForumPost.comment_count, False),
+    "most_viewed": (ForumPost.view_count, False),
+}
+
+# (category, specialty) -> number of posts; shown as an approximate total
+_post_count_cache = TTLCache(maxsize=256, ttl=60)
+
+
 @forum_bp.route("/forum")
 def forum_index():
     """Main forum page showing all posts"""
     if not current_user.is_authenticated:
         return render_template("auth/login_required.html")
         
-    page = request.args.get("page", 1, type=int)
     category = request.args.get("category", "")
     specialty = request.args.get("specialty", "")
     sort_by = request.args.get("sort", "newest")
@@ -27,6 +48,7 @@ def forum_index():
     # Build query with dynamic specialty support
     from .enable_specialty_features import get_forum_query_with_specialty_support, should_enable_forum_specialty
     
+    specialty_enabled = should_enable_forum_specialty()
     query = get_forum_query_with_specialty_support()
     
     # Filter by category if specified
@@ -38,80 +60,36 @@ def forum_index():
             pass
     
     # Filter by specialty if specified and feature is enabled
-    if specialty and should_enable_forum_specialty():
+    if specialty and specialty_enabled:
         try:
             query = query.filter(ForumPost.specialty == specialty)
         except Exception:
             # Ignore specialty filtering if there's an error
             pass
     
-    # Sort posts
-    if sort_by == "newest":
-        query = query.order_by(ForumPost.created_at.desc())
-    elif sort_by == "oldest":
-        query = query.order_by(ForumPost.created_at.asc())
-    elif sort_by == "most_voted":
-        # Sort by net votes (upvotes - downvotes) descending
-        # Use subqueries to calculate vote counts
-        from sqlalchemy import select
-        
-        upvote_subquery = select(func.count(ForumVote.id)).where(
-            and_(ForumVote.post_id == ForumPost.id, ForumVote.vote_type == "upvote")
-        ).scalar_subquery()
-        
-        downvote_subquery = select(func.count(ForumVote.id)).where(
-            and_(ForumVote.post_id == ForumPost.id, ForumVote.vote_type == "downvote")
-        ).scalar_subquery()
-        
-        query = query.order_by((upvote_subquery - downvote_subquery).desc())
-    elif sort_by == "most_commented":
-        # Sort by comment count descending
-        query = query.outerjoin(ForumComment, ForumPost.id == ForumComment.post_id).group_by(ForumPost.id).order_by(
-            func.count(ForumComment.id).desc()
-        )
+    # Approximate total: exact count for the filter, cached briefly instead of counted per request
+    count_key = (category, specialty)
+    total = _post_count_cache.get(count_key)
+    if total is None:
+        total = query.with_entities(func.count(ForumPost.id)).scalar()
+        _post_count_cache.set(count_key, total)
+    
+    # Sort posts by a (sort_key, id) keyset so every page is an index range scan
+    if sort_by not in FORUM_SORT_KEYS:
+        sort_by = "newest"
+    sort_column, ascending = FORUM_SORT_KEYS[sort_by]
+    key_columns = (sort_column, ForumPost.id)
     
     # Eager load author relationships to avoid N+1 queries
     query = query.options(joinedload(ForumPost.author))
     
-    # Pagination
-    posts = query.paginate(page=page, per_page=20, error_out=False)
+    posts = keyset_paginate(
+        query, key_columns, ascending=ascending,
+        after=request.args.get("after"), before=request.args.get("before"),
+        per_page=FORUM_PAGE_SIZE, total=total
+    )
     
-    # Batch load comment counts for all posts in one query (exclude deleted comments from count)
     post_ids = [post.id for post in posts.items]
-    if post_ids:
-        comment_counts = db.session.query(
-            ForumComment.post_id,
-            func.count(ForumComment.id).label('count')
-        ).filter(
-            ForumComment.post_id.in_(post_ids),
-            ForumComment.is_deleted == False
-        ).group_by(ForumComment.post_id).all()
-        comment_count_dict = {post_id: count for post_id, count in comment_counts}
-    else:
-        comment_count_dict = {}
-    
-    # Batch load vote counts for all posts in one query
-    if post_ids:
-        vote_counts = db.session.query(
-            ForumVote.post_id,
-            ForumVote.vote_type,
-            func.count(ForumVote.id).label('count')
-        ).filter(
-            ForumVote.post_id.in_(post_ids),
-            ForumVote.post_id.isnot(None)
-        ).group_by(ForumVote.post_id, ForumVote.vote_type).all()
-        
-        # Build vote count dictionaries
-        upvote_dict = {}
-        downvote_dict = {}
-        for post_id, vote_type, count in vote_counts:
-            if vote_type == 'upvote':
-                upvote_dict[post_id] = count
-            elif vote_type == 'downvote':
-                downvote_dict[post_id] = count
-    else:
-        upvote_dict = {}
-        downvote_dict = {}
     
     # Batch load user vote states for all posts in one query
     user_vote_dict = {}
@@ -125,14 +103,11 @@ def forum_index():
     
     # Attach all data to posts
     for post in posts.items:
-        post._comment_count = comment_count_dict.get(post.id, 0)
-        upvotes = upvote_dict.get(post.id, 0)
-        downvotes = downvote_dict.get(post.id, 0)
-        post._total_votes = upvotes - downvotes
+        post._total_votes = post.score
         post._user_vote = user_vote_dict.get(post.id, None)
     
-    # Check if specialty features are enabled
-    specialty_enabled = should_enable_forum_specialty()
+    # The index previews each post's first photo
+    preload_photo_sources(photo for post in posts.items for photo in rendered_post(post).photos[:1])
     
     return render_template("forum/index.html", 
                          posts=posts, 
@@ -143,24 +118,45 @@ def forum_index():
                          current_sort=sort_by)
 
 
+@forum_bp.route("/forum/search")
+def search():
+    """Full-text search over forum posts and comments"""
+    if not current_user.is_authenticated:
+        return render_template("auth/login_required.html")
+    
+    from .fulltext import search_forum
+    
+    query = request.args.get("q", "").strip()
+    results, next_cursor = [], None
+    if len(query) >= 2:
+        results, next_cursor = search_forum(query, limit=FORUM_PAGE_SIZE, after=request.args.get("after"))
+    
+    return render_template("forum/search.html",
+                         query=query,
+                         results=results,
+                         next_cursor=next_cursor)
+
+
 @forum_bp.route("/forum/new", methods=["GET", "POST"])
 @login_required
 def new_post():
     """Create a new forum post"""
     from .enable_specialty_features import should_enable_forum_specialty
     
+    specialty_enabled = should_enable_forum_specialty()
+    
     if request.method == "POST":
         title = request.form.get("title", "").strip()
         content = request.form.get("content", "").strip()
         category = request.form.get("category", "")
-        specialty = request.form.get("specialty", "").strip() if should_enable_forum_specialty() else None
+        specialty = request.form.get("specialty", "").strip() if specialty_enabled else None
         photos_json = request.form.get("photos", "[]")
         
         if not title or not content or not category:
             flash("Please fill in all fields", "error")
             return render_template("forum/new_post.html", 
                                categories=ForumCategory,
-                               specialty_enabled=should_enable_forum_specialty())
+                               specialty_enabled=specialty_enabled)
         
         try:
             category_enum = ForumCategory(category)
@@ -168,7 +164,7 @@ def new_post():
             flash("Invalid category selected", "error")
             return render_template("forum/new_post.html", 
                                categories=ForumCategory,
-                               specialty_enabled=should_enable_forum_specialty())
+                               specialty_enabled=specialty_enabled)
         
         # Validate photos
         try:
@@ -177,7 +173,7 @@ def new_post():
                 flash(f"Maximum {MAX_PHOTOS_PER_POST} photos allowed per post", "error")
                 return render_template("forum/new_post.html", 
                                    categories=ForumCategory,
-                                   specialty_enabled=should_enable_forum_specialty())
+                                   specialty_enabled=specialty_enabled)
         except json.JSONDecodeError:
             photos = []
         
@@ -192,23 +188,16 @@ def new_post():
         
         # Add specialty if the column exists and feature is enabled
         # Convert empty strings to None (for "General (All Specialties)" option)
-        if should_enable_forum_specialty():
-            # Check if the ForumPost model actually has the specialty attribute
-            from .models import ForumPost
-            if hasattr(ForumPost, 'specialty'):
-                post_data['specialty'] = specialty if specialty else None
+        if specialty_enabled:
+            post_data['specialty'] = specialty if specialty else None
         
-        try:
-            post = ForumPost(**post_data)
-        except TypeError as e:
-            if 'specialty' in str(e):
-                # Specialty column doesn't exist yet, create post without it
-                post_data_without_specialty = {k: v for k, v in post_data.items() if k != 'specialty'}
-                post = ForumPost(**post_data_without_specialty)
-            else:
-                raise e
+        post = ForumPost(**post_data)
         
+        post.hot_score = hot_score(0, 0, datetime.utcnow())
         db.session.add(post)
+        if photos:
+            db.session.flush()
+            record_photo_references(post.photos, post_id=post.id)
         db.session.commit()
         
         flash("Post created successfully!", "success")
@@ -216,7 +205,7 @@ def new_post():
     
     return render_template("forum/new_post.html", 
                          categories=ForumCategory,
-                         specialty_enabled=should_enable_forum_specialty())
+                         specialty_enabled=specialty_enabled)
 
 
 @forum_bp.route("/forum/post/<int:post_id>")
@@ -226,139 +215,13 @@ def view_post(post_id):
     post = ForumPost.query.options(joinedload(ForumPost.author)).get_or_404(post_id)
     sort_by = request.args.get("sort", "oldest")  # Changed default to oldest
     
-    # Load ALL comments for this post in one query with eager loading (include deleted for tree structure)
-    all_comments = ForumComment.query.filter_by(
-        post_id=post_id
-    ).options(
-        joinedload(ForumComment.author)
-    ).order_by(ForumComment.created_at.asc()).all()
-    
-    # Eager load profile relationships to avoid N+1 queries when accessing author profiles
-    author_ids = {c.author_id for c in all_comments if c.author_id}
-    if author_ids:
-        # Load all resident profiles
-        resident_profiles = {p.user_id: p for p in ResidentProfile.query.filter(ResidentProfile.user_id.in_(author_ids)).all()}
-        # Load all employer profiles
-        employer_profiles = {p.user_id: p for p in EmployerProfile.query.filter(EmployerProfile.user_id.in_(author_ids)).all()}
-        # Attach profiles to authors
-        for comment in all_comments:
-            if comment.author_id:
-                if comment.author_id in resident_profiles:
-                    comment.author.resident_profile = resident_profiles[comment.author_id]
-                if comment.author_id in employer_profiles:
-                    comment.author.employer_profile = employer_profiles[comment.author_id]
-    
-    # Build comment tree structure in Python (much faster than recursive queries)
-    # Use _nested_replies to avoid conflict with SQLAlchemy's 'replies' relationship
-    comment_dict = {}  # id -> comment object
-    top_level_comments = []
-    
-    # First pass: create dictionary and initialize nested replies list
-    for comment in all_comments:
-        # Use _nested_replies to avoid SQLAlchemy relationship conflict
-        comment._nested_replies = []
-        comment_dict[comment.id] = comment
-    
-    # Second pass: build tree structure (include deleted comments to maintain tree structure)
-    # IMPORTANT: Only process each comment once, and ensure nested comments go to their parents
-    for comment in all_comments:
-        if comment.parent_comment_id is None:
-            # Top-level comment (no parent) - only add if not already added
-            if comment not in top_level_comments:
-                top_level_comments.append(comment)
-        else:
-            # This comment has a parent - MUST attach it to the parent, never to top-level
-            parent = comment_dict.get(comment.parent_comment_id)
-            if parent:
-                # Parent exists - attach as reply (even if parent is deleted)
-                if comment not in parent._nested_replies:
-                    parent._nested_replies.append(comment)
-                # Make sure it's not in top_level_comments (defensive)
-                if comment in top_level_comments:
-                    top_level_comments.remove(comment)
-            else:
-                # Parent not found - this is a data integrity issue, but log it
-                # Still don't add to top-level to avoid showing nested as top-level
-                current_app.logger.warning(f"Comment {comment.id} has parent_comment_id {comment.parent_comment_id} but parent not found")
-    
-    # Helper function to sort replies recursively
-    def sort_replies_recursive(comment):
-        # Sort replies by created_at (oldest first for nested replies)
-        comment._nested_replies.sort(key=lambda c: c.created_at)
-        # Recursively sort nested replies
-        for reply in comment._nested_replies:
-            sort_replies_recursive(reply)
-    
-    # Sort replies within each comment
-    for comment in top_level_comments:
-        sort_replies_recursive(comment)
-    
-    # Sort top-level comments based on sort_by parameter
-    if sort_by == "most_voted":
-        # We'll sort by vote counts after loading them
-        pass  # Will sort after loading vote data
-    elif sort_by == "newest":
-        top_level_comments.sort(key=lambda c: c.created_at, reverse=True)
-    elif sort_by == "oldest":
-        top_level_comments.sort(key=lambda c: c.created_at)
-    # else: already sorted by created_at.asc() in query
-    
-    # Batch load vote counts for all comments in one query
-    comment_ids = [c.id for c in all_comments]
-    if comment_ids:
-        vote_counts = db.session.query(
-            ForumVote.comment_id,
-            ForumVote.vote_type,
-            func.count(ForumVote.id).label('count')
-        ).filter(
-            ForumVote.comment_id.in_(comment_ids),
-            ForumVote.comment_id.isnot(None)
-        ).group_by(ForumVote.comment_id, ForumVote.vote_type).all()
-        
-        # Build vote count dictionaries
-        upvote_dict = {}
-        downvote_dict = {}
-        for comment_id, vote_type, count in vote_counts:
-            if vote_type == 'upvote':
-                upvote_dict[comment_id] = count
-            elif vote_type == 'downvote':
-                downvote_dict[comment_id] = count
-    else:
-        upvote_dict = {}
-        downvote_dict = {}
+    if not (current_user.is_authenticated and current_user.id == post.author_id):
+        view_counter.record(ForumPost, post.id)
     
-    # Batch load user vote states for all comments in one query
-    user_comment_vote_dict = {}
-    if current_user and current_user.is_authenticated and comment_ids:
-        user_votes = ForumVote.query.filter(
-            ForumVote.user_id == current_user.id,
-            ForumVote.comment_id.in_(comment_ids),
-            ForumVote.comment_id.isnot(None)
-        ).all()
-        user_comment_vote_dict = {vote.comment_id: vote.vote_type for vote in user_votes}
-    
-    # Attach vote data to all comments (recursively)
-    def attach_vote_data(comment):
-        upvotes = upvote_dict.get(comment.id, 0)
-        downvotes = downvote_dict.get(comment.id, 0)
-        comment._total_votes = upvotes - downvotes
-        comment._user_vote = user_comment_vote_dict.get(comment.id, None)
-        
-        # Process replies recursively
-        for reply in comment._nested_replies:
-            attach_vote_data(reply)
-    
-    for comment in top_level_comments:
-        attach_vote_data(comment)
-    
-    # Sort top-level comments by votes if needed
-    if sort_by == "most_voted":
-        top_level_comments.sort(key=lambda c: c._total_votes, reverse=True)
+    comments, comments_cursor = get_comment_page(post, sort_by, current_user.id if current_user.is_authenticated else None)
     
     # Add vote count and user vote state for the main post
-    upvotes = ForumVote.query.filter_by(post_id=post.id, vote_type="upvote").count()
-    downvotes = ForumVote.query.filter_by(post_id=post.id, vote_type="downvote").count()
-    post._total_votes = upvotes - downvotes
+    post._total_votes = post.score
     
     # Add user's current vote state if logged in
     if current_user.is_authenticated:
@@ -370,13 +233,13 @@ def view_post(post_id):
     else:
         post._user_vote = None
     
-    # Calculate comment count excluding deleted comments
-    non_deleted_count = sum(1 for c in all_comments if not c.is_deleted)
+    preload_photo_sources(rendered_post(post).photos)
     
     return render_template("forum/view_post.html", 
                          post=post, 
-                         comments=top_level_comments,
-                         comment_count=non_deleted_count,
+                         comments=comments,
+                         comments_cursor=comments_cursor,
+                         comment_count=post.comment_count,
                          current_sort=sort_by)
 
 
@@ -423,6 +286,11 @@ def add_comment(post_id):
         )
         
         db.session.add(comment)
+        if photos:
+            db.session.flush()
+            record_photo_references(comment.photos, comment_id=comment.id)
+        ForumPost.adjust_comment_count(post_id, 1)
+        refresh_hot_scores([post_id])
         db.session.commit()
         
         # Check if this is an AJAX request - use query parameter for reliability
@@ -483,6 +351,8 @@ def reply_to_comment(comment_id):
         )
         
         db.session.add(reply)
+        ForumPost.adjust_comment_count(post.id, 1)
+        refresh_hot_scores([post.id])
         db.session.commit()
         
         # Check if this is an AJAX request - use query parameter for reliability
@@ -537,85 +407,196 @@ def vote():
         except (ValueError, TypeError):
             return jsonify({"error": "Invalid comment ID"}), 400
     
-    # Check if user already voted
+    if (post_id is None) == (comment_id is None):
+        return jsonify({"error": "Vote on exactly one post or comment"}), 400
+    
+    try:
+        if db.engine.dialect.name == "postgresql":
+            action, total_votes, new_vote_type = upsert_vote(current_user.id, post_id, comment_id, vote_type)
+        else:
+            action, total_votes, new_vote_type = toggle_vote(current_user.id, post_id, comment_id, vote_type)
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent click won the insert race (missing targets return 404 below)
+        db.session.rollback()
+        return jsonify({"error": "Vote could not be recorded, please retry"}), 409
+    
+    if action is None:
+        return jsonify({"error": "Post or comment not found"}), 404
+    
+    return jsonify({
+        "success": True,
+        "action": action,
+        "total_votes": total_votes,
+        "user_vote": new_vote_type
+    })
+
+
+# One round trip for the whole toggle: the existing vote is locked, removed if
+# the same button was clicked, otherwise upserted, and the tally deltas are
+# derived from what was actually written (xmax = 0 means the row was inserted,
+# an update can only flip to the opposite type). A conflict on an identical
+# vote is a no-op, so a concurrent double-click cannot double count.
+_UPSERT_VOTE_SQL = """
+WITH target AS (
+    -- Missing target: nothing is written and no row comes back (404).
+    -- FOR KEY SHARE keeps it from being deleted under the insert.
+    SELECT id FROM {target_table} WHERE id = :target_id FOR KEY SHARE
+),
+existing AS (
+    SELECT id, vote_type FROM forum_vote
+    WHERE user_id = :user_id AND {target_column} = :target_id
+    FOR UPDATE
+),
+removed AS (
+    DELETE FROM forum_vote v
+    USING existing e
+    WHERE v.id = e.id AND e.vote_type = CAST(:vote_type AS VARCHAR)
+    RETURNING v.id
+),
+upserted AS (
+    INSERT INTO forum_vote (user_id, {target_column}, vote_type, created_at)
+    SELECT :user_id, :target_id, CAST(:vote_type AS VARCHAR), now() AT TIME ZONE 'utc'
+    WHERE EXISTS (SELECT 1 FROM target)
+      AND NOT EXISTS (SELECT 1 FROM existing WHERE vote_type = CAST(:vote_type AS VARCHAR))
+    ON CONFLICT (user_id, {target_column}) DO UPDATE
+        SET vote_type = EXCLUDED.vote_type
+        WHERE forum_vote.vote_type <> EXCLUDED.vote_type
+    RETURNING (xmax = 0) AS inserted
+),
+change AS (
+    SELECT
+        (SELECT count(*) FROM removed) AS removed,
+        (SELECT count(*) FROM upserted WHERE inserted) AS added,
+        (SELECT count(*) FROM upserted WHERE NOT inserted) AS changed
+),
+delta AS (
+    SELECT
+        CASE WHEN :is_upvote THEN added - removed + changed ELSE -changed END AS up,
+        CASE WHEN :is_upvote THEN -changed ELSE added - removed + changed END AS down
+    FROM change
+),
+tally AS (
+    UPDATE {target_table} t
+    SET upvotes = t.upvotes + d.up,
+        downvotes = t.downvotes + d.down,
+        score = t.score + d.up - d.down{hot_score_set}
+    FROM delta d
+    WHERE t.id = :target_id AND (d.up <> 0 OR d.down <> 0)
+    RETURNING {tally_returning}
+){extra_ctes}
+SELECT
+    CASE
+        WHEN c.removed > 0 THEN 'removed'
+        WHEN c.added > 0 THEN 'added'
+        WHEN c.changed > 0 THEN 'changed'
+        ELSE 'unchanged'
+    END AS action,
+    COALESCE((SELECT score FROM tally), t.score) AS score
+FROM change c
+JOIN {target_table} t ON t.id = :target_id
+"""
+
+
+def upsert_vote(user_id, post_id, comment_id, vote_type):
+    """
+    Toggle a vote with a single statement (PostgreSQL).
+    Returns (action, total_votes, user_vote); action is None if the target does not exist.
+    """
+    if post_id:
+        target_table, target_column, target_id = "forum_post", "post_id", post_id
+        # Posts are re-ranked in the same statement
+        hot_score_set = ",\n        hot_score = " + HOT_SCORE_PG_SQL.format(score="t.score + d.up - d.down")
+        tally_returning, extra_ctes = "t.score", ""
+    else:
+        target_table, target_column, target_id = "forum_comment", "comment_id", comment_id
+        hot_score_set = ""
+        # A changed comment score invalidates the post's cached comment tree
+        tally_returning = "t.score, t.post_id"
+        extra_ctes = """,
+bumped AS (
+    UPDATE forum_post p
+    SET comments_version = p.comments_version + 1
+    FROM tally
+    WHERE p.id = tally.post_id
+)"""
+    
+    row = db.session.execute(
+        text(_UPSERT_VOTE_SQL.format(target_table=target_table, target_column=target_column,
+                                     hot_score_set=hot_score_set, tally_returning=tally_returning,
+                                     extra_ctes=extra_ctes)),
+        {"user_id": user_id, "target_id": target_id, "vote_type": vote_type,
+         "is_upvote": vote_type == "upvote"}
+    ).fetchone()
+    
+    if row is None:
+        return None, 0, None
+    return row.action, row.score, (None if row.action == "removed" else vote_type)
+
+
+def toggle_vote(user_id, post_id, comment_id, vote_type):
+    """
+    Toggle a vote through the ORM (databases without data-modifying CTEs).
+    Returns (action, total_votes, user_vote); action is None if the target does not exist.
+    """
+    model = ForumPost if post_id else ForumComment
+    if not db.session.query(model.id).filter_by(id=post_id or comment_id).first():
+        return None, 0, None
+    
     existing_vote = ForumVote.query.filter_by(
-        user_id=current_user.id,
+        user_id=user_id,
         post_id=post_id,
         comment_id=comment_id
     ).first()
     
     if existing_vote:
-        if existing_vote.vote_type == vote_type:
+        old_vote_type = existing_vote.vote_type
+        if old_vote_type == vote_type:
             # Remove vote if clicking same button
             db.session.delete(existing_vote)
-            db.session.commit()
-            
-            # Calculate new totals
-            if post_id:
-                upvotes = ForumVote.query.filter_by(post_id=post_id, vote_type="upvote").count()
-                downvotes = ForumVote.query.filter_by(post_id=post_id, vote_type="downvote").count()
-                total_votes = upvotes - downvotes
-            else:
-                upvotes = ForumVote.query.filter_by(comment_id=comment_id, vote_type="upvote").count()
-                downvotes = ForumVote.query.filter_by(comment_id=comment_id, vote_type="downvote").count()
-                total_votes = upvotes - downvotes
-            
-            return jsonify({
-                "success": True,
-                "action": "removed",
-                "total_votes": total_votes,
-                "user_vote": None
-            })
+            action, new_vote_type = "removed", None
         else:
             # Change vote type
             existing_vote.vote_type = vote_type
-            db.session.commit()
-            
-            # Calculate new totals
-            if post_id:
-                upvotes = ForumVote.query.filter_by(post_id=post_id, vote_type="upvote").count()
-                downvotes = ForumVote.query.filter_by(post_id=post_id, vote_type="downvote").count()
-                total_votes = upvotes - downvotes
-            else:
-                upvotes = ForumVote.query.filter_by(comment_id=comment_id, vote_type="upvote").count()
-                downvotes = ForumVote.query.filter_by(comment_id=comment_id, vote_type="downvote").count()
-                total_votes = upvotes - downvotes
-            
-            return jsonify({
-                "success": True,
-                "action": "changed",
-                "total_votes": total_votes,
-                "user_vote": vote_type
-            })
+            action, new_vote_type = "changed", vote_type
     else:
         # Create new vote
-        vote = ForumVote(
-            user_id=current_user.id,
+        db.session.add(ForumVote(
+            user_id=user_id,
             post_id=post_id,
             comment_id=comment_id,
             vote_type=vote_type
-        )
-        db.session.add(vote)
-        db.session.commit()
-        
-        # Calculate new totals
-        if post_id:
-            upvotes = ForumVote.query.filter_by(post_id=post_id, vote_type="upvote").count()
-            downvotes = ForumVote.query.filter_by(post_id=post_id, vote_type="downvote").count()
-            total_votes = upvotes - downvotes
-        else:
-            upvotes = ForumVote.query.filter_by(comment_id=comment_id, vote_type="upvote").count()
-            downvotes = ForumVote.query.filter_by(comment_id=comment_id, vote_type="downvote").count()
-            total_votes = upvotes - downvotes
-        
-        return jsonify({
-            "success": True,
-            "action": "added",
-            "total_votes": total_votes,
-            "user_vote": vote_type
-        })
+        ))
+        old_vote_type = None
+        action, new_vote_type = "added", vote_type
+    
+    # Tallies and rank change in the same transaction as the vote itself
+    total_votes = apply_vote_tally(post_id, comment_id, old_vote_type, new_vote_type)
+    if post_id:
+        refresh_hot_scores([post_id])
+    else:
+        ForumPost.bump_comments_version(comment_id=comment_id)
+    return action, total_votes, new_vote_type
 
 
+def apply_vote_tally(post_id, comment_id, old_vote_type, new_vote_type):
+    """Apply a vote transition to the denormalized tallies and return the new net score"""
+    model = ForumPost if post_id else ForumComment
+    target_id = post_id if post_id else comment_id
+    
+    up_delta = (new_vote_type == "upvote") - (old_vote_type == "upvote")
+    down_delta = (new_vote_type == "downvote") - (old_vote_type == "downvote")
+    
+    if up_delta or down_delta:
+        model.query.filter_by(id=target_id).update({
+            model.upvotes: model.upvotes + up_delta,
+            model.downvotes: model.downvotes + down_delta,
+            model.score: model.score + (up_delta - down_delta),
+            # Keep updated_at untouched - a vote is not an edit
+            model.updated_at: model.updated_at
+        }, synchronize_session=False)
+    
+    return db.session.query(model.score).filter_by(id=target_id).scalar() or 0
 
 
 @forum_bp.route("/forum/comment/<int:comment_id>/edit", methods=["POST"])
@@ -643,6 +624,7 @@ def edit_comment(comment_id):
     comment.content = content
     comment.is_edited = True
     comment.updated_at = datetime.utcnow()
+    ForumPost.bump_comments_version(comment.post_id)
     
     db.session.commit()
     
@@ -674,6 +656,9 @@ def delete_comment(comment_id):
         return redirect(url_for("forum.view_post", post_id=comment.post_id))
     
     # Soft delete - mark as deleted instead of actually deleting
+    if not comment.is_deleted:
+        ForumPost.adjust_comment_count(comment.post_id, -1)
+        refresh_hot_scores([comment.post_id])
     comment.is_deleted = True
     comment.updated_at = datetime.utcnow()
     
@@ -699,16 +684,8 @@ def delete_post(post_id):
         flash("You can only delete your own posts", "error")
         return redirect(url_for("forum.view_post", post_id=post_id))
     
-    # Delete all votes associated with this post first
-    ForumVote.query.filter_by(post_id=post_id).delete()
-    
-    # Delete all comments and their votes
-    for comment in post.comments:
-        ForumVote.query.filter_by(comment_id=comment.id).delete()
-        db.session.delete(comment)
-    
-    # Finally delete the post
-    db.session.delete(post)
+    # Votes, comments and photo references go with it in a few set-based statements
+    delete_forum_posts([post_id])
     db.session.commit()
     
     # Check if this is an AJAX request
@@ -766,144 +743,14 @@ def get_comments(post_id):
         sort_by = request.args.get("sort", "oldest")
         current_app.logger.info(f"Getting comments for post {post_id}, sort: {sort_by}")
         
-        # Load ALL comments for this post in one query with eager loading (include deleted for tree structure)
-        all_comments = ForumComment.query.filter_by(
-            post_id=post_id
-        ).options(
-            joinedload(ForumComment.author)
-        ).order_by(ForumComment.created_at.asc()).all()
-        
-        # Eager load profile relationships to avoid N+1 queries when accessing author profiles
-        author_ids = {c.author_id for c in all_comments if c.author_id}
-        if author_ids:
-            # Load all resident profiles
-            resident_profiles = {p.user_id: p for p in ResidentProfile.query.filter(ResidentProfile.user_id.in_(author_ids)).all()}
-            # Load all employer profiles
-            employer_profiles = {p.user_id: p for p in EmployerProfile.query.filter(EmployerProfile.user_id.in_(author_ids)).all()}
-            # Attach profiles to authors
-            for comment in all_comments:
-                if comment.author_id:
-                    if comment.author_id in resident_profiles:
-                        comment.author.resident_profile = resident_profiles[comment.author_id]
-                    if comment.author_id in employer_profiles:
-                        comment.author.employer_profile = employer_profiles[comment.author_id]
-        
-        # Build comment tree structure in Python
-        # Use _nested_replies to avoid conflict with SQLAlchemy's 'replies' relationship
-        comment_dict = {}  # id -> comment object
-        top_level_comments = []
-        
-        # First pass: create dictionary and initialize nested replies list
-        for comment in all_comments:
-            # Use _nested_replies to avoid SQLAlchemy relationship conflict
-            comment._nested_replies = []
-            comment_dict[comment.id] = comment
-        
-        # Second pass: build tree structure (include deleted comments to maintain tree structure)
-        # IMPORTANT: Only process each comment once, and ensure nested comments go to their parents
-        for comment in all_comments:
-            if comment.parent_comment_id is None:
-                # Top-level comment (no parent) - only add if not already added
-                if comment not in top_level_comments:
-                    top_level_comments.append(comment)
-            else:
-                # This comment has a parent - MUST attach it to the parent, never to top-level
-                parent = comment_dict.get(comment.parent_comment_id)
-                if parent:
-                    # Parent exists - attach as reply (even if parent is deleted)
-                    if comment not in parent._nested_replies:
-                        parent._nested_replies.append(comment)
-                    # Make sure it's not in top_level_comments (defensive)
-                    if comment in top_level_comments:
-                        top_level_comments.remove(comment)
-                else:
-                    # Parent not found - this is a data integrity issue, but log it
-                    # Still don't add to top-level to avoid showing nested as top-level
-                    current_app.logger.warning(f"Comment {comment.id} has parent_comment_id {comment.parent_comment_id} but parent not found")
-        
-        # Helper function to sort replies recursively
-        def sort_replies_recursive(comment):
-            # Sort replies by created_at (oldest first for nested replies)
-            comment._nested_replies.sort(key=lambda c: c.created_at)
-            # Recursively sort nested replies
-            for reply in comment._nested_replies:
-                sort_replies_recursive(reply)
-        
-        # Sort replies within each comment
-        for comment in top_level_comments:
-            sort_replies_recursive(comment)
-        
-        # Sort top-level comments based on sort_by parameter
-        if sort_by == "most_voted":
-            pass  # Will sort after loading vote data
-        elif sort_by == "newest" or sort_by == "most_recent":
-            top_level_comments.sort(key=lambda c: c.created_at, reverse=True)
-        elif sort_by == "oldest":
-            top_level_comments.sort(key=lambda c: c.created_at)
-        # else: already sorted by created_at.asc() in query
-        
-        # Batch load vote counts for all comments in one query
-        comment_ids = [c.id for c in all_comments]
-        if comment_ids:
-            vote_counts = db.session.query(
-                ForumVote.comment_id,
-                ForumVote.vote_type,
-                func.count(ForumVote.id).label('count')
-            ).filter(
-                ForumVote.comment_id.in_(comment_ids),
-                ForumVote.comment_id.isnot(None)
-            ).group_by(ForumVote.comment_id, ForumVote.vote_type).all()
-            
-            # Build vote count dictionaries
-            upvote_dict = {}
-            downvote_dict = {}
-            for comment_id, vote_type, count in vote_counts:
-                if vote_type == 'upvote':
-                    upvote_dict[comment_id] = count
-                elif vote_type == 'downvote':
-                    downvote_dict[comment_id] = count
-        else:
-            upvote_dict = {}
-            downvote_dict = {}
-        
-        # Batch load user vote states for all comments in one query
-        user_comment_vote_dict = {}
-        if current_user and current_user.is_authenticated and comment_ids:
-            user_votes = ForumVote.query.filter(
-                ForumVote.user_id == current_user.id,
-                ForumVote.comment_id.in_(comment_ids),
-                ForumVote.comment_id.isnot(None)
-            ).all()
-            user_comment_vote_dict = {vote.comment_id: vote.vote_type for vote in user_votes}
-        
-        # Attach vote data to all comments (recursively)
-        def attach_vote_data(comment):
-            upvotes = upvote_dict.get(comment.id, 0)
-            downvotes = downvote_dict.get(comment.id, 0)
-            comment._total_votes = upvotes - downvotes
-            comment._user_vote = user_comment_vote_dict.get(comment.id, None)
-            
-            # Process replies recursively
-            for reply in comment._nested_replies:
-                attach_vote_data(reply)
-        
-        for comment in top_level_comments:
-            attach_vote_data(comment)
-        
-        # Sort top-level comments by votes if needed
-        if sort_by == "most_voted":
-            top_level_comments.sort(key=lambda c: c._total_votes, reverse=True)
-        elif sort_by == "most_downvoted":
-            top_level_comments.sort(key=lambda c: c._total_votes)  # Ascending (most negative first)
-        
-        # Calculate comment count excluding deleted comments
-        non_deleted_count = sum(1 for c in all_comments if not c.is_deleted)
+        comments, comments_cursor = get_comment_page(post, sort_by, current_user.id if current_user.is_authenticated else None)
         
         # Render just the comments section
         return render_template("forum/comments_section.html", 
                              post=post, 
-                             comments=top_level_comments,
-                             comment_count=non_deleted_count,
+                             comments=comments,
+                             comments_cursor=comments_cursor,
+                             comment_count=post.comment_count,
                              current_sort=sort_by)
     
     except Exception as e:
@@ -911,6 +758,40 @@ def get_comments(post_id):
         return f"Error loading comments: {str(e)}", 500
 
 
+@forum_bp.route("/forum/post/<int:post_id>/comments/more")
+def more_comments(post_id):
+    """Next page of top-level comments (for "Load more comments")"""
+    post = ForumPost.query.get_or_404(post_id)
+    sort_by = request.args.get("sort", "oldest")
+    
+    comments, comments_cursor = get_comment_page(
+        post, sort_by, current_user.id if current_user.is_authenticated else None,
+        after=request.args.get("after")
+    )
+    
+    return render_template("forum/comment_page.html",
+                         post=post,
+                         comments=comments,
+                         comments_cursor=comments_cursor)
+
+
+@forum_bp.route("/forum/comment/<int:comment_id>/replies")
+def comment_replies(comment_id):
+    """Next page of replies to a comment (for "Show more replies")"""
+    comment = ForumComment.query.get_or_404(comment_id)
+    post = ForumPost.query.get_or_404(comment.post_id)
+    
+    replies, replies_cursor = get_reply_page(
+        post, comment_id, current_user.id if current_user.is_authenticated else None,
+        after=request.args.get("after")
+    )
+    
+    return render_template("forum/reply_page.html",
+                         post=post,
+                         replies=replies,
+                         parent={"id": comment_id, "replies_cursor": replies_cursor, "hidden_reply_count": 0})
+
+
 # Photo upload functionality
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
@@ -921,30 +802,6 @@ def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def resize_image(image_path, max_width=1200, max_height=1200, quality=85):
-    """Resize image to fit within max dimensions while maintaining aspect ratio"""
-    try:
-        with Image.open(image_path) as img:
-            # Convert to RGB if necessary
-            if img.mode in ('RGBA', 'LA', 'P'):
-                img = img.convert('RGB')
-            
-            # Calculate new dimensions
-            width, height = img.size
-            if width <= max_width and height <= max_height:
-                return  # No resize needed
-            
-            # Calculate new size maintaining aspect ratio
-            ratio = min(max_width/width, max_height/height)
-            new_width = int(width * ratio)
-            new_height = int(height * ratio)
-            
-            # Resize image
-            img_resized = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            img_resized.save(image_path, 'JPEG', quality=quality, optimize=True)
-    except Exception as e:
-        print(f"Error resizing image {image_path}: {e}")
-
 @forum_bp.route("/api/upload-photo", methods=["POST"])
 @login_required
 def upload_photo():
@@ -968,24 +825,19 @@ def upload_photo():
         if file_size > MAX_FILE_SIZE:
             return jsonify({'success': False, 'error': 'File too large. Maximum size: 5MB'}), 400
         
-        # Generate unique filename
-        filename = secure_filename(file.filename)
-        name, ext = os.path.splitext(filename)
-        unique_filename = f"{uuid.uuid4().hex}{ext}"
-        
-        # Save file
-        upload_dir = os.path.join(current_app.static_folder, 'uploads', 'photos')
-        os.makedirs(upload_dir, exist_ok=True)
-        file_path = os.path.join(upload_dir, unique_filename)
-        file.save(file_path)
+        # Header check only; decoding and resizing happen in the background
+        image_format = sniff_image(file.stream)
+        if image_format not in IMAGE_EXTENSIONS:
+            return jsonify({'success': False, 'error': 'File is not a valid image'}), 400
         
-        # Resize image
-        resize_image(file_path)
+        # Store the original as uploaded (deduplicated by content) and queue the resized variants
+        asset = store_upload(file, image_format, uploaded_by_id=current_user.id)
         
         return jsonify({
             'success': True, 
-            'filename': unique_filename,
-            'url': f'/static/uploads/photos/{unique_filename}'
+            'filename': asset.filename,
+            'url': f'{PHOTO_URL_PREFIX}{asset.filename}',
+            'status': asset.status
         })
         
     except Exception as e:
@@ -1002,12 +854,17 @@ def delete_photo():
         if not filename:
             return jsonify({'success': False, 'error': 'No filename provided'}), 400
         
-        # Security check - ensure filename is safe
-        filename = secure_filename(filename)
-        file_path = os.path.join(current_app.static_folder, 'uploads', 'photos', filename)
+        # Security check - only names the upload store produced
+        if not is_stored_name(filename):
+            return jsonify({'success': False, 'error': 'Invalid filename'}), 400
+        
+        # Identical uploads share one file: leave it alone unless this user
+        # uploaded it and nothing has been posted with it
+        asset = PhotoAsset.query.filter_by(filename=filename).first()
+        if asset is not None and (asset.uploaded_by_id != current_user.id or is_photo_referenced(filename)):
+            return jsonify({'success': True})
         
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        if delete_photo_files(filename):
             return jsonify({'success': True})
         else:
             return jsonify({'success': False, 'error': 'File not found'}), 404
@@ -0,0 +1,76 @@
+"""
+"Hot" ranking for forum posts
+
+hot = (score + COMMENT_WEIGHT * comments + 1) / (age_hours + 2) ** GRAVITY
+
+The value is stored in the indexed forum_post.hot_score column so the hot
+listing is an index scan. It is recomputed for a single post whenever it is
+voted on or commented on, and a periodic sweep refreshes every post inside
+HOT_WINDOW so that ranking decays with age even when nothing happens.
+Posts older than the window have decayed to effectively zero and are left alone.
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam
+
+from .background import background
+from .models import db, ForumPost
+
+HOT_GRAVITY = 1.8
+HOT_COMMENT_WEIGHT = 0.5
+HOT_WINDOW = timedelta(days=14)
+HOT_SWEEP_INTERVAL = 600  # seconds
+HOT_BATCH_SIZE = 500
+
+# Same formula as hot_score(), for use inside PostgreSQL statements that
+# already hold the post row (t = forum_post, score = the new net score)
+HOT_SCORE_PG_SQL = (
+    "(({score}) + " + str(HOT_COMMENT_WEIGHT) + " * t.comment_count + 1)"
+    " / power(EXTRACT(EPOCH FROM (now() AT TIME ZONE 'utc') - t.created_at) / 3600.0 + 2, " + str(HOT_GRAVITY) + ")"
+)
+
+
+def hot_score(score, comment_count, created_at, now=None):
+    """Time-decayed ranking value for a post"""
+    now = now or datetime.utcnow()
+    age_hours = max((now - created_at).total_seconds(), 0) / 3600.0
+    return ((score or 0) + HOT_COMMENT_WEIGHT * (comment_count or 0) + 1) / (age_hours + 2) ** HOT_GRAVITY
+
+
+def refresh_hot_scores(post_ids=None):
+    """
+    Recompute hot_score for the given posts, or for every post inside HOT_WINDOW.
+    Does not commit; the caller owns the transaction.
+    """
+    now = datetime.utcnow()
+    query = db.session.query(ForumPost.id, ForumPost.score, ForumPost.created_at, ForumPost.comment_count)
+
+    if post_ids is not None:
+        if not post_ids:
+            return 0
+        query = query.filter(ForumPost.id.in_(post_ids))
+    else:
+        query = query.filter(ForumPost.created_at >= now - HOT_WINDOW)
+
+    rows = [
+        {"post_id": post_id, "hot": hot_score(score, count, created_at, now)}
+        for post_id, score, created_at, count in query.all()
+    ]
+
+    table = ForumPost.__table__
+    statement = table.update().where(table.c.id == bindparam("post_id")).values(
+        hot_score=bindparam("hot"),
+        # Keep updated_at untouched - re-ranking is not an edit
+        updated_at=table.c.updated_at
+    )
+    for start in range(0, len(rows), HOT_BATCH_SIZE):
+        db.session.execute(statement, rows[start:start + HOT_BATCH_SIZE])
+    return len(rows)
+
+
+@background.periodic(HOT_SWEEP_INTERVAL)
+def sweep_hot_scores():
+    """Periodic decay of hot scores for recent posts"""
+    refresh_hot_scores()
+    db.session.commit()
@@ -0,0 +1,47 @@
+"""
+Rendered forum post bodies and photo lists
+
+The HTML body (escaped, newlines as <br>), the index excerpt and the parsed
+photos column of a post are built once per version of the row and kept in a
+bounded LRU keyed by (post id, updated_at). Editing a post bumps updated_at,
+so a stale body is never served; votes, views and re-ranking leave
+updated_at alone and keep the entry warm. Old versions simply age out.
+
+Comments need no separate cache: their parsed photo lists are built into the
+comment tree nodes, which are already cached per comments_version.
+"""
+
+import re
+from collections import namedtuple
+
+from markupsafe import Markup, escape
+
+from .cache import TTLCache
+from .photos import parse_photo_list
+
+EXCERPT_LENGTH = 200
+
+_NEWLINE_RE = re.compile(r"\r\n|\r|\n")
+
+RenderedPost = namedtuple("RenderedPost", "body_html excerpt photos")
+
+# (post id, updated_at) -> RenderedPost
+_rendered_cache = TTLCache(maxsize=2048, ttl=3600)
+
+
+def render_body(text):
+    """User text as safe HTML, line breaks kept"""
+    if not text:
+        return Markup("")
+    return Markup(_NEWLINE_RE.sub("<br>", str(escape(text))))
+
+
+def _render_post(post):
+    content = post.content or ""
+    excerpt = content[:EXCERPT_LENGTH] + ("..." if len(content) > EXCERPT_LENGTH else "")
+    return RenderedPost(render_body(content), excerpt, tuple(parse_photo_list(post.photos)))
+
+
+def rendered_post(post):
+    """Cached RenderedPost for a ForumPost (template helper)"""
+    return _rendered_cache.get_or_set((post.id, post.updated_at), lambda: _render_post(post))
@@ -0,0 +1,345 @@
+"""
+Full-text search indexes and queries
+
+PostgreSQL uses stored generated tsvector columns with GIN indexes, so the
+index is maintained by the database on every insert/update. SQLite (local
+development) uses FTS5 external-content tables kept in sync by triggers.
+Any other database falls back to a plain ILIKE scan.
+"""
+
+import logging
+import re
+
+from markupsafe import escape
+from sqlalchemy import Float, Integer, column, text
+
+from .models import db
+from .pagination import decode_cursor, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+# Highlight sentinels: the database wraps matches in these, then the snippet is
+# HTML-escaped and the sentinels are swapped for <mark> tags
+_HIGHLIGHT_START = "\x02"
+_HIGHLIGHT_STOP = "\x03"
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+def ensure_message_search_index():
+    """Create the message full-text index if it does not exist yet"""
+    dialect = _dialect()
+    if dialect == 'postgresql':
+        db.session.execute(text("""
+            ALTER TABLE message
+            ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (to_tsvector('english', coalesce(body, ''))) STORED
+        """))
+        db.session.execute(text("""
+            CREATE INDEX IF NOT EXISTS ix_message_search_vector
+            ON message USING GIN (search_vector)
+        """))
+        db.session.commit()
+        return True
+
+    if dialect == 'sqlite':
+        exists = db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'message_fts'"
+        )).fetchone() is not None
+        if not exists:
+            db.session.execute(text("""
+                CREATE VIRTUAL TABLE message_fts
+                USING fts5(body, content='message', content_rowid='id')
+            """))
+        db.session.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS message_fts_insert AFTER INSERT ON message BEGIN
+                INSERT INTO message_fts(rowid, body) VALUES (new.id, new.body);
+            END
+        """))
+        db.session.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS message_fts_delete AFTER DELETE ON message BEGIN
+                INSERT INTO message_fts(message_fts, rowid, body) VALUES ('delete', old.id, old.body);
+            END
+        """))
+        db.session.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS message_fts_update AFTER UPDATE OF body ON message BEGIN
+                INSERT INTO message_fts(message_fts, rowid, body) VALUES ('delete', old.id, old.body);
+                INSERT INTO message_fts(rowid, body) VALUES (new.id, new.body);
+            END
+        """))
+        if not exists:
+            # Index messages written before the table existed
+            db.session.execute(text("INSERT INTO message_fts(message_fts) VALUES ('rebuild')"))
+        db.session.commit()
+        return True
+
+    logger.info(f"Full-text search not available for {dialect}, falling back to ILIKE")
+    return False
+
+
+def ensure_forum_search_index():
+    """Create the forum post/comment full-text indexes if they do not exist yet"""
+    dialect = _dialect()
+    if dialect == 'postgresql':
+        # Title matches weigh more than body matches
+        db.session.execute(text("""
+            ALTER TABLE forum_post
+            ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+                setweight(to_tsvector('english', coalesce(content, '')), 'B')
+            ) STORED
+        """))
+        db.session.execute(text("""
+            ALTER TABLE forum_comment
+            ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (to_tsvector('english', coalesce(content, ''))) STORED
+        """))
+        db.session.execute(text("""
+            CREATE INDEX IF NOT EXISTS ix_forum_post_search_vector
+            ON forum_post USING GIN (search_vector)
+        """))
+        db.session.execute(text("""
+            CREATE INDEX IF NOT EXISTS ix_forum_comment_search_vector
+            ON forum_comment USING GIN (search_vector)
+        """))
+        db.session.commit()
+        return True
+
+    if dialect == 'sqlite':
+        for table, columns in (('forum_post', ('title', 'content')), ('forum_comment', ('content',))):
+            fts = f"{table}_fts"
+            column_list = ", ".join(columns)
+            new_values = ", ".join(f"new.{c}" for c in columns)
+            old_values = ", ".join(f"old.{c}" for c in columns)
+            exists = db.session.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+            ), {'name': fts}).fetchone() is not None
+            if not exists:
+                db.session.execute(text(f"""
+                    CREATE VIRTUAL TABLE {fts}
+                    USING fts5({column_list}, content='{table}', content_rowid='id')
+                """))
+            db.session.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN
+                    INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values});
+                END
+            """))
+            db.session.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN
+                    INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+                END
+            """))
+            db.session.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {column_list} ON {table} BEGIN
+                    INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+                    INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values});
+                END
+            """))
+            if not exists:
+                db.session.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+        db.session.commit()
+        return True
+
+    logger.info(f"Forum full-text search not available for {dialect}, falling back to ILIKE")
+    return False
+
+
+def highlight(snippet):
+    """Escape a database snippet and turn the highlight sentinels into <mark> tags"""
+    if not snippet:
+        return ''
+    escaped = str(escape(snippet))
+    return escaped.replace(_HIGHLIGHT_START, '<mark>').replace(_HIGHLIGHT_STOP, '</mark>')
+
+
+def fts5_query(query):
+    """Turn free text into a safe FTS5 query: every word quoted, all words required"""
+    words = _WORD_RE.findall(query)
+    return " ".join(f'"{word}"' for word in words)
+
+
+def search_messages(user_id, query, limit=20, offset=0):
+    """
+    Ranked full-text search over messages in the user's threads.
+    Returns a list of dicts with id, conversation_id, sender_id, created_at,
+    rank and an HTML-safe highlighted snippet.
+    """
+    dialect = _dialect()
+    params = {'user_id': user_id, 'limit': limit, 'offset': offset}
+    participant_filter = """
+        m.thread_id IN (
+            SELECT id FROM message_thread
+            WHERE user_low_id = :user_id OR user_high_id = :user_id
+        )
+    """
+
+    if dialect == 'postgresql':
+        params.update({
+            'query': query,
+            'headline_options': f"StartSel={_HIGHLIGHT_START}, StopSel={_HIGHLIGHT_STOP}, MaxWords=24, MinWords=8",
+        })
+        rows = db.session.execute(text(f"""
+            SELECT m.id, m.conversation_id, m.sender_id, m.created_at,
+                   ts_rank(m.search_vector, q) AS rank,
+                   ts_headline('english', m.body, q, :headline_options) AS snippet
+            FROM message m, websearch_to_tsquery('english', :query) q
+            WHERE m.search_vector @@ q AND {participant_filter}
+            ORDER BY rank DESC, m.id DESC
+            LIMIT :limit OFFSET :offset
+        """), params).fetchall()
+    elif dialect == 'sqlite':
+        match = fts5_query(query)
+        if not match:
+            return []
+        params.update({'query': match, 'start': _HIGHLIGHT_START, 'stop': _HIGHLIGHT_STOP})
+        # bm25() is lower-is-better, so negate it to report a higher-is-better rank
+        rows = db.session.execute(text(f"""
+            SELECT m.id, m.conversation_id, m.sender_id, m.created_at,
+                   -bm25(message_fts) AS rank,
+                   snippet(message_fts, 0, :start, :stop, '…', 16) AS snippet
+            FROM message_fts
+            JOIN message m ON m.id = message_fts.rowid
+            WHERE message_fts MATCH :query AND {participant_filter}
+            ORDER BY bm25(message_fts), m.id DESC
+            LIMIT :limit OFFSET :offset
+        """), params).fetchall()
+    else:
+        params['pattern'] = f"%{query}%"
+        rows = db.session.execute(text(f"""
+            SELECT m.id, m.conversation_id, m.sender_id, m.created_at,
+                   0 AS rank, m.body AS snippet
+            FROM message m
+            WHERE m.body ILIKE :pattern AND {participant_filter}
+            ORDER BY m.id DESC
+            LIMIT :limit OFFSET :offset
+        """), params).fetchall()
+
+    return [{
+        'id': row.id,
+        'conversation_id': row.conversation_id,
+        'sender_id': row.sender_id,
+        'created_at': row.created_at,
+        'rank': float(row.rank or 0),
+        'snippet': highlight(row.snippet),
+    } for row in rows]
+
+
+# Forum search pages on (rank, kind, id) descending; kind is 0 for posts, 1 for comments
+_FORUM_CURSOR_COLUMNS = (column('rank', Float), column('kind', Integer), column('id', Integer))
+
+
+def search_forum(query, limit=20, after=None):
+    """
+    Ranked full-text search over forum posts and (not deleted) comments.
+    Returns (results, next_cursor); each result has type, id, post_id, title,
+    rank and an HTML-safe highlighted snippet.
+    """
+    dialect = _dialect()
+    params = {'limit': limit + 1}
+    cursor = decode_cursor(after, _FORUM_CURSOR_COLUMNS)
+    cursor_filter = ""
+    if cursor is not None:
+        params.update({'c_rank': cursor[0], 'c_kind': cursor[1], 'c_id': cursor[2]})
+        cursor_filter = "WHERE (h.rank, h.kind, h.id) < (:c_rank, :c_kind, :c_id)"
+
+    if dialect == 'postgresql':
+        params.update({
+            'query': query,
+            'headline_options': f"StartSel={_HIGHLIGHT_START}, StopSel={_HIGHLIGHT_STOP}, MaxWords=30, MinWords=10",
+        })
+        # Rank every match, page, then build headlines for the page only
+        rows = db.session.execute(text(f"""
+            WITH q AS (SELECT websearch_to_tsquery('english', :query) AS q),
+            hits AS (
+                SELECT 0 AS kind, p.id, p.id AS post_id, ts_rank(p.search_vector, q.q)::float8 AS rank
+                FROM forum_post p, q
+                WHERE p.search_vector @@ q.q
+                UNION ALL
+                SELECT 1 AS kind, c.id, c.post_id, ts_rank(c.search_vector, q.q)::float8 AS rank
+                FROM forum_comment c, q
+                WHERE c.search_vector @@ q.q AND c.is_deleted = false
+            ),
+            page AS (
+                SELECT h.* FROM hits h
+                {cursor_filter}
+                ORDER BY h.rank DESC, h.kind DESC, h.id DESC
+                LIMIT :limit
+            )
+            SELECT page.kind, page.id, page.post_id, page.rank, p.title,
+                   ts_headline('english', CASE WHEN page.kind = 0 THEN p.content ELSE c.content END,
+                               q.q, :headline_options) AS snippet
+            FROM page
+            CROSS JOIN q
+            JOIN forum_post p ON p.id = page.post_id
+            LEFT JOIN forum_comment c ON page.kind = 1 AND c.id = page.id
+            ORDER BY page.rank DESC, page.kind DESC, page.id DESC
+        """), params).fetchall()
+    elif dialect == 'sqlite':
+        match = fts5_query(query)
+        if not match:
+            return [], None
+        params.update({'query': match, 'start': _HIGHLIGHT_START, 'stop': _HIGHLIGHT_STOP})
+        # bm25() is lower-is-better, so negate it to report a higher-is-better rank
+        rows = db.session.execute(text(f"""
+            WITH hits AS (
+                SELECT 0 AS kind, p.id AS id, p.id AS post_id,
+                       -bm25(forum_post_fts, 2.0, 1.0) AS rank,
+                       snippet(forum_post_fts, -1, :start, :stop, '…', 24) AS snippet
+                FROM forum_post_fts
+                JOIN forum_post p ON p.id = forum_post_fts.rowid
+                WHERE forum_post_fts MATCH :query
+                UNION ALL
+                SELECT 1 AS kind, c.id AS id, c.post_id AS post_id,
+                       -bm25(forum_comment_fts) AS rank,
+                       snippet(forum_comment_fts, 0, :start, :stop, '…', 24) AS snippet
+                FROM forum_comment_fts
+                JOIN forum_comment c ON c.id = forum_comment_fts.rowid
+                WHERE forum_comment_fts MATCH :query AND c.is_deleted = 0
+            )
+            SELECT h.kind, h.id, h.post_id, h.rank, h.snippet, p.title
+            FROM hits h
+            JOIN forum_post p ON p.id = h.post_id
+            {cursor_filter}
+            ORDER BY h.rank DESC, h.kind DESC, h.id DESC
+            LIMIT :limit
+        """), params).fetchall()
+    else:
+        params['pattern'] = f"%{query}%"
+        rows = db.session.execute(text(f"""
+            WITH hits AS (
+                SELECT 0 AS kind, p.id, p.id AS post_id, 0.0 AS rank, p.content AS snippet
+                FROM forum_post p
+                WHERE p.title ILIKE :pattern OR p.content ILIKE :pattern
+                UNION ALL
+                SELECT 1 AS kind, c.id, c.post_id, 0.0 AS rank, c.content AS snippet
+                FROM forum_comment c
+                WHERE c.content ILIKE :pattern AND c.is_deleted = false
+            )
+            SELECT h.kind, h.id, h.post_id, h.rank, h.snippet, p.title
+            FROM hits h
+            JOIN forum_post p ON p.id = h.post_id
+            {cursor_filter}
+            ORDER BY h.rank DESC, h.kind DESC, h.id DESC
+            LIMIT :limit
+        """), params).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor((float(last.rank or 0), last.kind, last.id))
+
+    results = [{
+        'type': 'post' if row.kind == 0 else 'comment',
+        'id': row.id,
+        'post_id': row.post_id,
+        'title': row.title,
+        'rank': float(row.rank or 0),
+        'snippet': highlight(row.snippet),
+    } for row in rows]
+    return results, next_cursor
@@ -0,0 +1,114 @@
+"""
+Content-addressed storage and serving for uploaded files
+
+Uploads are stored under the SHA-256 of their bytes in a two-level fan-out
+tree, <root>/ab/cd/abcd...ef.jpg, so identical uploads share one file and no
+directory grows past a few hundred entries. Derived files (resized variants)
+sit next to their original as <hash>_<name>.<ext>.
+
+Since a content-addressed path can never point at different bytes, these
+files are served with a year-long immutable Cache-Control and the file name
+as a strong ETag. Files saved under the old flat uuid names are still served,
+with the normal revalidating headers.
+
+The byte transfer can be handed to the front proxy (MEDIA_OFFLOAD): the
+view only checks the path and sets headers, then nginx (X-Accel-Redirect to
+an internal location) or Apache/lighttpd (X-Sendfile, via Flask's
+USE_X_SENDFILE) sends the file, including Range requests. Without offload,
+Werkzeug answers Range and conditional requests itself.
+"""
+
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+from urllib.parse import quote
+
+from flask import abort, current_app, send_from_directory
+from werkzeug.security import safe_join
+
+HASH_CHUNK_SIZE = 64 * 1024
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# ab/cd/<64 hex digits>[_variant].ext, with the shard directories matching the hash
+CONTENT_PATH_RE = re.compile(r"^([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}(?:_[a-z]+)?\.[a-z0-9]+$")
+LEGACY_NAME_RE = re.compile(r"^[0-9a-f]{32}(?:_[a-z]+)?\.[A-Za-z0-9]+$")
+LEGACY_ORIGINAL_RE = re.compile(r"^[0-9a-f]{32}\.[A-Za-z0-9]+$")
+
+
+def profile_upload_dir():
+    """Directory behind the /uploads route (profile photos)"""
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads")
+
+
+def is_stored_name(filename):
+    """True for names this module produced: content-addressed paths or legacy uuid names"""
+    return bool(filename and (CONTENT_PATH_RE.match(filename) or LEGACY_NAME_RE.match(filename)))
+
+
+def save_content_addressed(file, root, extension):
+    """
+    Stream an uploaded file into `root` under its content hash.
+    Returns (relative path, created); created is False when identical bytes were already stored.
+    """
+    tmp_dir = os.path.join(root, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            file.stream.seek(0)
+            for chunk in iter(lambda: file.stream.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+                out.write(chunk)
+
+        content_hash = digest.hexdigest()
+        relative_path = f"{content_hash[:2]}/{content_hash[2:4]}/{content_hash}{extension.lower()}"
+        target = os.path.join(root, relative_path)
+        if os.path.exists(target):
+            return relative_path, False
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.chmod(tmp_path, 0o644)  # mkstemp creates the file owner-only
+        os.replace(tmp_path, target)
+        return relative_path, True
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _accel_response(filename, accel_prefix, immutable):
+    """Empty response telling nginx to send the file from its internal location"""
+    response = current_app.response_class(
+        mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    )
+    response.headers["X-Accel-Redirect"] = accel_prefix + quote(filename)
+    if immutable:
+        # nginx passes Cache-Control through and adds its own ETag, Last-Modified and Range handling
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+
+def send_media(root, filename, accel_prefix=None):
+    """
+    Serve a stored upload, with immutable caching for content-addressed paths.
+    accel_prefix is the nginx internal location for `root`, used when MEDIA_OFFLOAD is "x-accel".
+    """
+    path = safe_join(root, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    immutable = bool(CONTENT_PATH_RE.match(filename))
+    if accel_prefix and current_app.config.get("MEDIA_OFFLOAD") == "x-accel":
+        return _accel_response(filename, accel_prefix, immutable)
+
+    # With USE_X_SENDFILE set, Flask replaces the body with an X-Sendfile header
+    if immutable:
+        response = send_from_directory(root, filename, etag=os.path.basename(filename), max_age=IMMUTABLE_MAX_AGE)
+        response.cache_control.immutable = True
+        return response
+    return send_from_directory(root, filename)
@@ -1,3 +1,4 @@
+import json
 from datetime import datetime
 from enum import Enum
 
@@ -149,6 +150,7 @@ class Opportunity(db.Model):
     is_active = db.Column(db.Boolean, default=True, nullable=False, index=True)
     is_filled = db.Column(db.Boolean, default=False, nullable=False, index=True)  # New field
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    view_count = db.Column(db.Integer, default=0, nullable=False)  # Buffered, see view_counts
 
     # Calendar availability
     calendar_slots = db.relationship("CalendarSlot", backref="opportunity", lazy=True, cascade="all, delete-orphan")
@@ -166,7 +168,7 @@ class Opportunity(db.Model):
 
 class CalendarSlot(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    opportunity_id = db.Column(db.Integer, db.ForeignKey("opportunity.id"), nullable=False, index=True)
+    opportunity_id = db.Column(db.Integer, db.ForeignKey("opportunity.id", ondelete="CASCADE"), nullable=False, index=True)
     date = db.Column(db.Date, nullable=False, index=True)
     start_time = db.Column(db.Time, nullable=False)
     end_time = db.Column(db.Time, nullable=False)
@@ -177,22 +179,75 @@ class CalendarSlot(db.Model):
         return f"<CalendarSlot {self.date} {self.start_time}-{self.end_time}>"
 
 
+class MessageThread(db.Model):
+	"""Canonical thread shared by every conversation between one pair of users"""
+	id = db.Column(db.Integer, primary_key=True)
+	user_low_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)  # min(user_a, user_b)
+	user_high_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)  # max(user_a, user_b)
+	created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+	__table_args__ = (
+		# One thread per pair; also serves lookups by user_low_id alone
+		db.UniqueConstraint("user_low_id", "user_high_id", name="unique_message_thread_pair"),
+		db.CheckConstraint("user_low_id < user_high_id", name="message_thread_ordered_pair"),
+	)
+
+	@staticmethod
+	def pair_key(user_a_id: int, user_b_id: int):
+		"""Return the (low, high) key for a pair of users regardless of order"""
+		return (min(user_a_id, user_b_id), max(user_a_id, user_b_id))
+
+	@classmethod
+	def find(cls, user_a_id: int, user_b_id: int):
+		low_id, high_id = cls.pair_key(user_a_id, user_b_id)
+		return cls.query.filter_by(user_low_id=low_id, user_high_id=high_id).first()
+
+	@classmethod
+	def get_or_create(cls, user_a_id: int, user_b_id: int):
+		"""Find the thread for a pair of users, creating it if needed (safe under concurrent creates)"""
+		thread = cls.find(user_a_id, user_b_id)
+		if thread:
+			return thread
+
+		from sqlalchemy.exc import IntegrityError
+		low_id, high_id = cls.pair_key(user_a_id, user_b_id)
+		try:
+			with db.session.begin_nested():
+				thread = cls(user_low_id=low_id, user_high_id=high_id)
+				db.session.add(thread)
+		except IntegrityError:
+			# Another request created the thread first
+			thread = cls.find(user_a_id, user_b_id)
+		return thread
+
+	def other_user_id(self, user_id: int) -> int:
+		return self.user_high_id if user_id == self.user_low_id else self.user_low_id
+
+
 class Conversation(db.Model):
 	id = db.Column(db.Integer, primary_key=True)
 	opportunity_id = db.Column(db.Integer, db.ForeignKey("opportunity.id"), nullable=True, index=True)
 	resident_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
 	employer_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
+	thread_id = db.Column(db.Integer, db.ForeignKey("message_thread.id"), nullable=True)
 	created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 	unread_count = db.Column(db.Integer, default=0, nullable=False)  # Track unread messages
 
 	resident = db.relationship("User", foreign_keys=[resident_id])
 	employer = db.relationship("User", foreign_keys=[employer_id])
 	opportunity = db.relationship("Opportunity", foreign_keys=[opportunity_id])
+	thread = db.relationship("MessageThread", backref=db.backref("conversations", lazy=True))
+
+	__table_args__ = (
+		# Serves "all / most recent conversation between A and B" as a single index seek
+		db.Index("ix_conversation_thread_created", "thread_id", "created_at"),
+	)
 
 
 class Message(db.Model):
 	id = db.Column(db.Integer, primary_key=True)
-	conversation_id = db.Column(db.Integer, db.ForeignKey("conversation.id"), nullable=False, index=True)
+	conversation_id = db.Column(db.Integer, db.ForeignKey("conversation.id", ondelete="CASCADE"), nullable=False, index=True)
+	thread_id = db.Column(db.Integer, db.ForeignKey("message_thread.id"), nullable=True)  # Denormalized from conversation
 	sender_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
 	body = db.Column(db.Text, nullable=False)
 	created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
@@ -201,10 +256,15 @@ class Message(db.Model):
 	conversation = db.relationship("Conversation", backref=db.backref("messages", lazy=True, order_by="Message.created_at"))
 	sender = db.relationship("User")
 
+	__table_args__ = (
+		# Message fan-in across every conversation of a pair, in order
+		db.Index("ix_message_thread_created", "thread_id", "created_at"),
+	)
+
 
 class Application(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    opportunity_id = db.Column(db.Integer, db.ForeignKey("opportunity.id"), nullable=False, index=True)
+    opportunity_id = db.Column(db.Integer, db.ForeignKey("opportunity.id", ondelete="CASCADE"), nullable=False, index=True)
     resident_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
     status = db.Column(db.Enum(ApplicationStatus), default=ApplicationStatus.PENDING, nullable=False, index=True)
     applied_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
@@ -273,30 +333,76 @@ class ForumPost(db.Model):
     is_locked = db.Column(db.Boolean, default=False, nullable=False)
     photos = db.Column(db.Text, nullable=True)  # JSON string of photo filenames
     
+    # Denormalized vote tallies, updated in the same transaction as the ForumVote change
+    upvotes = db.Column(db.Integer, default=0, nullable=False)
+    downvotes = db.Column(db.Integer, default=0, nullable=False)
+    score = db.Column(db.Integer, default=0, nullable=False, index=True)  # upvotes - downvotes
+    hot_score = db.Column(db.Float, default=0, nullable=False, index=True)  # Time-decayed rank, see forum_ranking
+    comment_count = db.Column(db.Integer, default=0, nullable=False)  # Comments not soft-deleted
+    comments_version = db.Column(db.Integer, default=0, nullable=False)  # Bumped on any comment change, keys the comment tree cache
+    view_count = db.Column(db.Integer, default=0, nullable=False)  # Buffered, see view_counts
+    
     # Relationships
     author = db.relationship("User", backref="forum_posts")
     comments = db.relationship("ForumComment", backref="post", lazy=True, cascade="all, delete-orphan", order_by="ForumComment.created_at.desc()")
     
+    # Keyset pagination indexes for the forum index sort modes, see forum.FORUM_SORT_KEYS
+    __table_args__ = (
+        db.Index("ix_forum_post_created_id", "created_at", "id"),
+        db.Index("ix_forum_post_score_id", "score", "id"),
+        db.Index("ix_forum_post_hot_id", "hot_score", "id"),
+        db.Index("ix_forum_post_comments_id", "comment_count", "id"),
+        db.Index("ix_forum_post_views_id", "view_count", "id"),
+    )
+    
     def __repr__(self):
         return f"<ForumPost {self.title}>"
     
-    @property
-    def comment_count(self):
-        return len(self.comments)
-    
     @property
     def total_votes(self):
-        """Calculate total net votes for the post"""
-        upvotes = ForumVote.query.filter_by(post_id=self.id, vote_type="upvote").count()
-        downvotes = ForumVote.query.filter_by(post_id=self.id, vote_type="downvote").count()
-        return upvotes - downvotes
+        """Total net votes for the post"""
+        return self.score or 0
+    
+    @classmethod
+    def adjust_comment_count(cls, post_id, delta):
+        """Add delta to a post's comment_count (and bump comments_version) in the caller's transaction"""
+        cls.query.filter_by(id=post_id).update({
+            cls.comment_count: cls.comment_count + delta,
+            cls.comments_version: cls.comments_version + 1,
+            cls.updated_at: cls.updated_at
+        }, synchronize_session=False)
+    
+    @classmethod
+    def bump_comments_version(cls, post_id=None, comment_id=None):
+        """Mark a post's comment tree as changed, by post id or by one of its comment ids"""
+        if comment_id is not None:
+            post_id = db.select(ForumComment.post_id).where(ForumComment.id == comment_id).scalar_subquery()
+        cls.query.filter(cls.id == post_id).update({
+            cls.comments_version: cls.comments_version + 1,
+            cls.updated_at: cls.updated_at
+        }, synchronize_session=False)
+    
+    @classmethod
+    def recount_comments(cls, post_ids):
+        """Recompute comment_count from the comments table (after bulk deletes)"""
+        if not post_ids:
+            return
+        live_comments = db.select(db.func.count(ForumComment.id)).where(
+            ForumComment.post_id == cls.id,
+            ForumComment.is_deleted == False
+        ).scalar_subquery()
+        cls.query.filter(cls.id.in_(list(post_ids))).update({
+            cls.comment_count: live_comments,
+            cls.comments_version: cls.comments_version + 1,
+            cls.updated_at: cls.updated_at
+        }, synchronize_session=False)
 
 
 class ForumComment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    post_id = db.Column(db.Integer, db.ForeignKey("forum_post.id"), nullable=False, index=True)
+    post_id = db.Column(db.Integer, db.ForeignKey("forum_post.id", ondelete="CASCADE"), nullable=False, index=True)
     author_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
-    parent_comment_id = db.Column(db.Integer, db.ForeignKey("forum_comment.id"), nullable=True, index=True)  # For nested replies
+    parent_comment_id = db.Column(db.Integer, db.ForeignKey("forum_comment.id", ondelete="CASCADE"), nullable=True, index=True)  # For nested replies
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
@@ -304,26 +410,35 @@ class ForumComment(db.Model):
     is_deleted = db.Column(db.Boolean, default=False, nullable=False)
     photos = db.Column(db.Text, nullable=True)  # JSON string of photo filenames
     
+    # Denormalized vote tallies, updated in the same transaction as the ForumVote change
+    upvotes = db.Column(db.Integer, default=0, nullable=False)
+    downvotes = db.Column(db.Integer, default=0, nullable=False)
+    score = db.Column(db.Integer, default=0, nullable=False, index=True)  # upvotes - downvotes
+    
     # Relationships
     author = db.relationship("User", backref="forum_comments")
     parent_comment = db.relationship("ForumComment", remote_side=[id], backref="replies")
     
+    # Cursor queries for lazily loaded threads, see comment_tree
+    __table_args__ = (
+        db.Index("ix_forum_comment_thread_created", "post_id", "parent_comment_id", "created_at", "id"),
+        db.Index("ix_forum_comment_thread_score", "post_id", "parent_comment_id", "score", "id"),
+    )
+    
     def __repr__(self):
         return f"<ForumComment {self.id} on post {self.post_id}>"
     
     @property
     def total_votes(self):
-        """Calculate total net votes for the comment"""
-        upvotes = ForumVote.query.filter_by(comment_id=self.id, vote_type="upvote").count()
-        downvotes = ForumVote.query.filter_by(comment_id=self.id, vote_type="downvote").count()
-        return upvotes - downvotes
+        """Total net votes for the comment"""
+        return self.score or 0
 
 
 class ForumVote(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
-    post_id = db.Column(db.Integer, db.ForeignKey("forum_post.id"), nullable=True, index=True)
-    comment_id = db.Column(db.Integer, db.ForeignKey("forum_comment.id"), nullable=True, index=True)
+    post_id = db.Column(db.Integer, db.ForeignKey("forum_post.id", ondelete="CASCADE"), nullable=True, index=True)
+    comment_id = db.Column(db.Integer, db.ForeignKey("forum_comment.id", ondelete="CASCADE"), nullable=True, index=True)
     vote_type = db.Column(db.String(10), nullable=False)  # "upvote" or "downvote"
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     
@@ -343,6 +458,72 @@ class ForumVote(db.Model):
         db.UniqueConstraint("user_id", "comment_id", name="unique_user_comment_vote"),
     )
 
+
+class PhotoAsset(db.Model):
+    """An uploaded forum photo and the manifest of resized variants generated for it"""
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), unique=True, nullable=False)  # Original file, stored as uploaded
+    uploaded_by_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=True, index=True)
+    status = db.Column(db.String(20), default="pending", nullable=False)  # "pending", "ready" or "failed"
+    width = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
+    variants = db.Column(db.Text, nullable=True)  # JSON manifest: {"thumb": {"filename": ..., "width": ..., "height": ...}, ...}
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<PhotoAsset {self.filename} {self.status}>"
+
+    @property
+    def variant_manifest(self):
+        try:
+            return json.loads(self.variants) if self.variants else {}
+        except (json.JSONDecodeError, TypeError):
+            return {}
+
+
+class PhotoReference(db.Model):
+    """One use of an uploaded photo by a forum post or comment (the photos JSON columns, indexed)"""
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), nullable=False, index=True)
+    post_id = db.Column(db.Integer, db.ForeignKey("forum_post.id", ondelete="CASCADE"), nullable=True, index=True)
+    comment_id = db.Column(db.Integer, db.ForeignKey("forum_comment.id", ondelete="CASCADE"), nullable=True, index=True)
+
+    __table_args__ = (
+        db.CheckConstraint("(post_id IS NOT NULL AND comment_id IS NULL) OR (post_id IS NULL AND comment_id IS NOT NULL)"),
+    )
+
+    def __repr__(self):
+        return f"<PhotoReference {self.filename} post={self.post_id} comment={self.comment_id}>"
+
+
+class BackgroundJob(db.Model):
+    """Status and progress of a long-running job started from a request (see background.start_job)"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), default="queued", nullable=False)  # "queued", "running", "done" or "failed"
+    progress = db.Column(db.Integer, default=0, nullable=False)  # Steps completed
+    total = db.Column(db.Integer, nullable=True)  # Steps overall, once known
+    message = db.Column(db.Text, nullable=True)  # Current step, or the error
+    created_by_id = db.Column(db.Integer, nullable=True)  # No FK: the job outlives deleted users
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<BackgroundJob {self.kind} {self.status}>"
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "total": self.total,
+            "message": self.message,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
 class ProgramReview(db.Model):
     """Model for medical residency program reviews"""
     id = db.Column(db.Integer, primary_key=True)
@@ -391,10 +572,54 @@ class CompensationData(db.Model):
     # Relationships
     user = db.relationship('User', backref='compensation_submissions')
     
+    # Serves the presorted per-cohort lookups in compensation_stats.compensation_rank
+    __table_args__ = (
+        db.Index("ix_compensation_data_cohort", "specialty", "region", "practice_type", "total_compensation"),
+    )
+    
     def __repr__(self):
         return f'<CompensationData {self.specialty} {self.year} {self.region}>'
 
 
+class CompensationCube(db.Model):
+    """
+    Pre-aggregated CompensationData, one row per (year, region, specialty, practice_type).
+    Kept up to date by compensation_stats on every submission and delete.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    year = db.Column(db.Integer, nullable=False)
+    region = db.Column(db.String(100), nullable=False)
+    specialty = db.Column(db.String(100), nullable=False)
+    practice_type = db.Column(db.String(100), nullable=False, default="")  # "" when not given
+    record_count = db.Column(db.Integer, default=0, nullable=False)
+
+    # count / sum / sum of squares of the non-null values of each metric
+    total_comp_count = db.Column(db.Integer, default=0, nullable=False)
+    total_comp_sum = db.Column(db.Float, default=0, nullable=False)
+    total_comp_sumsq = db.Column(db.Float, default=0, nullable=False)
+    base_salary_count = db.Column(db.Integer, default=0, nullable=False)
+    base_salary_sum = db.Column(db.Float, default=0, nullable=False)
+    base_salary_sumsq = db.Column(db.Float, default=0, nullable=False)
+    bonus_count = db.Column(db.Integer, default=0, nullable=False)
+    bonus_sum = db.Column(db.Float, default=0, nullable=False)
+    bonus_sumsq = db.Column(db.Float, default=0, nullable=False)
+    rvu_rate_count = db.Column(db.Integer, default=0, nullable=False)
+    rvu_rate_sum = db.Column(db.Float, default=0, nullable=False)
+    rvu_rate_sumsq = db.Column(db.Float, default=0, nullable=False)
+    hours_count = db.Column(db.Integer, default=0, nullable=False)
+    hours_sum = db.Column(db.Float, default=0, nullable=False)
+    hours_sumsq = db.Column(db.Float, default=0, nullable=False)
+
+    total_comp_sketch = db.Column(db.Text, nullable=True)  # JSON QuantileSketch buckets, see compensation_stats
+
+    __table_args__ = (
+        db.UniqueConstraint("year", "region", "specialty", "practice_type", name="unique_compensation_cube_cell"),
+    )
+
+    def __repr__(self):
+        return f'<CompensationCube {self.specialty} {self.year} {self.region} {self.practice_type}: {self.record_count}>'
+
+
 class JobReview(db.Model):
     """Model for job practice reviews by attending physicians"""
     id = db.Column(db.Integer, primary_key=True)
@@ -459,7 +684,7 @@ class ShiftSession(db.Model):
 class RVURecord(db.Model):
     """Model for individual RVU records within a shift"""
     id = db.Column(db.Integer, primary_key=True)
-    shift_session_id = db.Column(db.Integer, db.ForeignKey('shift_session.id'), nullable=False)
+    shift_session_id = db.Column(db.Integer, db.ForeignKey('shift_session.id', ondelete='CASCADE'), nullable=False)
     study_name = db.Column(db.String(200), nullable=False)
     wrvu_value = db.Column(db.Float, nullable=False)
     recorded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
@@ -3,6 +3,7 @@ from flask_login import login_required, current_user
 from sqlalchemy import and_
 from .models import db, Opportunity, OpportunityType, UserRole, CalendarSlot, User, Application, ApplicationStatus, TrainingLevel, WorkDuration, PayType
 from .forms import OpportunityForm, FilterForm
+from .chat import invalidate_user_profile
 from datetime import date, datetime, timedelta
 import math
 from pyzipcode import ZipCodeDatabase
@@ -150,7 +151,10 @@ def list_opportunities():
         except Exception:
             pass
 
-    opportunities = query.order_by(Opportunity.created_at.desc()).all()
+    if request.args.get("sort") == "most_viewed":
+        opportunities = query.order_by(Opportunity.view_count.desc(), Opportunity.created_at.desc()).all()
+    else:
+        opportunities = query.order_by(Opportunity.created_at.desc()).all()
     
     # Apply training level filtering after getting all opportunities
     if form.pgy_year.data and form.pgy_year.data != "":
@@ -372,7 +376,10 @@ def edit_opportunity(opportunity_id):
 @opp_bp.route("/opportunities/<int:opportunity_id>")
 def show_opportunity(opportunity_id: int):
     from .models import Opportunity
+    from .view_counts import view_counter
     opp = Opportunity.query.get_or_404(opportunity_id)
+    if not (current_user.is_authenticated and current_user.id == opp.employer_id):
+        view_counter.record(Opportunity, opp.id)
     return render_template("opportunities/detail.html", opp=opp)
 
 
@@ -617,24 +624,13 @@ def resident_profile():
         if "photo" in request.files:
             photo = request.files["photo"]
             if photo and photo.filename:
-                import os
-                import uuid
-                from werkzeug.utils import secure_filename
-                
-                # Generate unique filename
-                file_ext = os.path.splitext(photo.filename)[1]
-                unique_filename = f"{uuid.uuid4().hex}{file_ext}"
+                from .photos import save_profile_photo
                 
-                # Save file to uploads directory
-                uploads_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads')
-                os.makedirs(uploads_dir, exist_ok=True)
-                file_path = os.path.join(uploads_dir, unique_filename)
-                photo.save(file_path)
-                
-                # Store unique filename in database
-                profile.photo_filename = unique_filename
+                # Stored by content hash; identical photos share one file
+                profile.photo_filename = save_profile_photo(photo)
         
         db.session.commit()
+        invalidate_user_profile(current_user.id)
         flash("Profile updated successfully!", "success")
         return redirect(url_for("opportunities.resident_profile"))
     
@@ -683,24 +679,13 @@ def employer_profile():
         if "photo" in request.files:
             photo = request.files["photo"]
             if photo and photo.filename:
-                import os
-                import uuid
-                from werkzeug.utils import secure_filename
-                
-                # Generate unique filename
-                file_ext = os.path.splitext(photo.filename)[1]
-                unique_filename = f"{uuid.uuid4().hex}{file_ext}"
+                from .photos import save_profile_photo
                 
-                # Save file to uploads directory
-                uploads_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads')
-                os.makedirs(uploads_dir, exist_ok=True)
-                file_path = os.path.join(uploads_dir, unique_filename)
-                photo.save(file_path)
-                
-                # Store unique filename in database
-                profile.photo_filename = unique_filename
+                # Stored by content hash; identical photos share one file
+                profile.photo_filename = save_profile_photo(photo)
         
         db.session.commit()
+        invalidate_user_profile(current_user.id)
         flash("Practice profile updated successfully!", "success")
         return redirect(url_for("opportunities.employer_profile"))
     
@@ -897,7 +882,7 @@ def apply_to_opportunity(opportunity_id):
     if current_user.role != UserRole.RESIDENT:
         abort(403)
     
-    from .models import Opportunity, Application, Conversation
+    from .models import Opportunity, Application, Conversation, MessageThread
     
     opportunity = Opportunity.query.get_or_404(opportunity_id)
     
@@ -925,10 +910,12 @@ def apply_to_opportunity(opportunity_id):
     db.session.add(application)
     
     # Create conversation for messaging
+    thread = MessageThread.get_or_create(current_user.id, opportunity.employer_id)
     conversation = Conversation(
         opportunity_id=opportunity_id,
         employer_id=opportunity.employer_id,
-        resident_id=current_user.id
+        resident_id=current_user.id,
+        thread_id=thread.id
     )
     db.session.add(conversation)
     
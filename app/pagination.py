@@ -0,0 +1,106 @@
+"""
+Keyset (cursor) pagination
+
+Pages are addressed by the sort key of the last row seen instead of an
+OFFSET, so every page is a bounded index range scan no matter how deep the
+reader goes. Sort keys always end in a unique column (normally the primary
+key) so the order is total and ties never repeat or skip rows.
+
+Cursors are opaque URL-safe tokens holding the key values of a boundary row.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import literal, tuple_
+
+
+def encode_cursor(values):
+    """Encode a tuple of sort key values as an opaque URL-safe token"""
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+def decode_cursor(token, key_columns):
+    """Decode a cursor back into typed key values, or None if it is missing or malformed"""
+    if not token:
+        return None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(payload, list) or len(payload) != len(key_columns):
+            return None
+        values = []
+        for raw, column in zip(payload, key_columns):
+            python_type = column.type.python_type
+            if raw is None:
+                values.append(None)
+            elif python_type is datetime:
+                values.append(datetime.fromisoformat(raw))
+            else:
+                values.append(python_type(raw))
+        return tuple(values)
+    except (ValueError, TypeError, NotImplementedError):
+        return None
+
+
+class KeysetPage:
+    """One page of keyset-paginated results"""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def keyset_paginate(query, key_columns, ascending=False, after=None, before=None, per_page=20, total=None):
+    """
+    Return a KeysetPage of `query` ordered by key_columns.
+
+    All key columns sort in the same direction; the last one must be unique.
+    Pass `after` (the previous page's next_cursor) to page forward or
+    `before` (its prev_cursor) to page back.
+    """
+    backwards = before is not None and after is None
+    cursor = decode_cursor(before if backwards else after, key_columns)
+
+    # Scan in the display direction when going forward, reversed when going back
+    scan_ascending = ascending != backwards
+    if cursor is not None:
+        bound = tuple_(*[literal(value, type_=column.type) for value, column in zip(cursor, key_columns)])
+        keys = tuple_(*key_columns)
+        query = query.filter(keys > bound if scan_ascending else keys < bound)
+
+    order = [column.asc() if scan_ascending else column.desc() for column in key_columns]
+    rows = query.add_columns(*key_columns).order_by(*order).limit(per_page + 1).all()
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    items = [row[0] for row in rows]
+    first_key = tuple(rows[0][1:]) if rows else None
+    last_key = tuple(rows[-1][1:]) if rows else None
+
+    if backwards:
+        has_next, has_prev = cursor is not None, has_more
+    else:
+        has_next, has_prev = has_more, cursor is not None
+
+    return KeysetPage(
+        items,
+        next_cursor=encode_cursor(last_key) if has_next and last_key else None,
+        prev_cursor=encode_cursor(first_key) if has_prev and first_key else None,
+        total=total,
+    )
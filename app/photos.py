@@ -0,0 +1,395 @@
+"""
+Forum photo storage and the resized-variant pipeline
+
+Uploads are stored exactly as received, content-addressed (see media.py),
+and acknowledged straight away; the request only reads the image header to
+reject files that are not images. Uploading the same bytes again reuses the
+existing PhotoAsset and its variants.
+Decoding and resizing happen in a background job (see background.submit),
+which writes a WebP variant per entry in PHOTO_VARIANTS (JPEG when Pillow
+lacks WebP support) and records them in the PhotoAsset manifest.
+
+Templates call photo_sources(filename) to get a src/srcset pair. Until the
+variants are ready, and for photos uploaded before the pipeline existed,
+it falls back to the original file. Views listing many photos call
+preload_photo_sources first so the page costs one asset query.
+
+Photos are uploaded before the post that uses them exists, so every use is
+indexed in PhotoReference and a periodic job deletes uploads older than
+ORPHAN_MIN_AGE that nothing references, in batches.
+"""
+
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+from flask import current_app
+from PIL import ExifTags, Image, ImageOps, UnidentifiedImageError, features
+from sqlalchemy import delete, exists, insert, text, update
+from sqlalchemy.exc import IntegrityError
+
+from .background import background
+from .cache import TTLCache
+from .media import LEGACY_ORIGINAL_RE, is_stored_name, profile_upload_dir, save_content_addressed
+from .models import db, PhotoAsset, PhotoReference, ForumPost, ForumComment
+
+logger = logging.getLogger(__name__)
+
+# (name, longest edge in pixels), largest first
+PHOTO_VARIANTS = (("full", 1600), ("medium", 800), ("thumb", 320))
+VARIANT_FORMAT, VARIANT_EXTENSION = ("WEBP", ".webp") if features.check("webp") else ("JPEG", ".jpg")
+VARIANT_QUALITY = 82
+
+PHOTO_URL_PREFIX = "/static/uploads/photos/"
+
+# Accepted upload formats (as detected from the file header) -> stored extension
+IMAGE_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "GIF": ".gif", "WEBP": ".webp"}
+
+# filename -> sources dict. Finished manifests never change and are kept for
+# the full TTL; the original-file fallback of photos without (ready) variants
+# is cached for UNPROCESSED_SOURCES_TTL so they pick up variants soon after
+UNPROCESSED_SOURCES_TTL = 60  # seconds
+_sources_cache = TTLCache(maxsize=4096, ttl=3600)
+
+# Uploads younger than this may belong to a post that is still being written
+ORPHAN_MIN_AGE = timedelta(hours=24)
+ORPHAN_GC_INTERVAL = 3600  # seconds
+ORPHAN_GC_BATCH_SIZE = 200
+
+
+def photo_dir():
+    return os.path.join(current_app.static_folder, "uploads", "photos")
+
+
+def sniff_image(stream):
+    """Return the image format from the file header without decoding pixels, or None"""
+    try:
+        with Image.open(stream) as img:
+            return img.format
+    except (UnidentifiedImageError, OSError):
+        return None
+    finally:
+        stream.seek(0)
+
+
+def store_upload(file, image_format, uploaded_by_id=None):
+    """
+    Save an upload as-is under its content hash, record it and queue variant
+    generation. Returns the PhotoAsset, which is the existing one for a duplicate.
+    """
+    upload_dir = photo_dir()
+    extension = IMAGE_EXTENSIONS[image_format]
+    filename, created = save_content_addressed(file, upload_dir, extension)
+
+    # A duplicate restarts the orphan clock, so the GC leaves the asset alone while
+    # the post using it is written. If its file had been removed, the upload above
+    # put it back and the variants are rebuilt.
+    values = {"created_at": datetime.utcnow()}
+    if created:
+        values["status"] = "pending"
+    reused = db.session.execute(
+        update(PhotoAsset).where(PhotoAsset.filename == filename).values(**values)
+    ).rowcount
+    db.session.commit()
+    if reused:
+        asset = PhotoAsset.query.filter_by(filename=filename).first()
+        if created:
+            background.submit(generate_variants, asset.id)
+        return asset
+
+    try:
+        with db.session.begin_nested():
+            asset = PhotoAsset(filename=filename, uploaded_by_id=uploaded_by_id)
+            db.session.add(asset)
+    except IntegrityError:
+        # The same bytes were uploaded concurrently
+        return PhotoAsset.query.filter_by(filename=filename).first()
+    db.session.commit()
+
+    # The GC may have collected an earlier asset for these bytes meanwhile
+    if not os.path.exists(os.path.join(upload_dir, filename)):
+        save_content_addressed(file, upload_dir, extension)
+
+    background.submit(generate_variants, asset.id)
+    return asset
+
+
+def save_profile_photo(file):
+    """Store a profile photo content-addressed under the /uploads directory; returns its name"""
+    image_format = sniff_image(file.stream)
+    extension = IMAGE_EXTENSIONS.get(image_format) or os.path.splitext(file.filename)[1]
+    filename, _created = save_content_addressed(file, profile_upload_dir(), extension)
+    return filename
+
+
+def _variant_filename(filename, name):
+    return f"{os.path.splitext(filename)[0]}_{name}{VARIANT_EXTENSION}"
+
+
+def generate_variants(asset_id):
+    """Decode the original once and write every variant smaller than it (background job)"""
+    asset = db.session.get(PhotoAsset, asset_id)
+    if asset is None or asset.status == "ready":
+        return
+
+    upload_dir = photo_dir()
+    manifest = {}
+    try:
+        with Image.open(os.path.join(upload_dir, asset.filename)) as original:
+            width, height = original.size
+            if original.getexif().get(ExifTags.Base.Orientation) in (5, 6, 7, 8):
+                width, height = height, width
+
+            # Resizing an animation would drop every frame but the first; keep serving the original
+            if not getattr(original, "is_animated", False):
+                # Let the JPEG decoder scale down while decoding; never below the largest variant
+                largest = PHOTO_VARIANTS[0][1]
+                original.draft("RGB", (largest, largest))
+                img = ImageOps.exif_transpose(original)
+                if img.mode not in ("RGB", "RGBA"):
+                    img = img.convert("RGBA" if img.mode in ("LA", "PA") or "transparency" in img.info else "RGB")
+                if VARIANT_FORMAT == "JPEG" and img.mode == "RGBA":
+                    img = img.convert("RGB")
+
+                # Each variant is downscaled from the previous, larger one
+                for name, edge in PHOTO_VARIANTS:
+                    if max(img.size) > edge:
+                        img = img.copy()
+                        img.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+                    elif manifest:
+                        continue  # Already at or below this size
+                    variant_filename = _variant_filename(asset.filename, name)
+                    img.save(os.path.join(upload_dir, variant_filename), VARIANT_FORMAT,
+                             quality=VARIANT_QUALITY, method=4 if VARIANT_FORMAT == "WEBP" else 0)
+                    manifest[name] = {"filename": variant_filename, "width": img.width, "height": img.height}
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.error(f"Could not generate variants for {asset.filename}: {e}")
+        asset.status = "failed"
+        db.session.commit()
+        return
+
+    asset.width, asset.height = width, height
+    asset.variants = json.dumps(manifest) if manifest else None
+    asset.status = "ready"
+    db.session.commit()
+
+
+def _cache_sources(filename, asset):
+    original_url = PHOTO_URL_PREFIX + filename
+    sources = {"src": original_url, "srcset": "", "full": original_url}
+
+    if asset is None or asset.status == "pending":
+        # Legacy photo or variants not ready: keep the fallback only briefly
+        _sources_cache.set(filename, sources, ttl=UNPROCESSED_SOURCES_TTL)
+        return sources
+
+    variants = asset.variant_manifest
+    if variants:
+        ordered = sorted(variants.values(), key=lambda v: v["width"])
+        sources["srcset"] = ", ".join(f"{PHOTO_URL_PREFIX}{v['filename']} {v['width']}w" for v in ordered)
+        sources["src"] = PHOTO_URL_PREFIX + variants.get("medium", ordered[-1])["filename"]
+        sources["full"] = PHOTO_URL_PREFIX + ordered[-1]["filename"]
+    _sources_cache.set(filename, sources)
+    return sources
+
+
+def preload_photo_sources(filenames):
+    """Look up the assets of a page's uncached photos in one query, so photo_sources hits the cache"""
+    missing = {filename for filename in filenames if _sources_cache.get(filename) is None}
+    if not missing:
+        return
+    assets = {asset.filename: asset for asset in PhotoAsset.query.filter(PhotoAsset.filename.in_(missing))}
+    for filename in missing:
+        _cache_sources(filename, assets.get(filename))
+
+
+def photo_sources(filename):
+    """
+    Return {"src", "srcset", "full"} URLs for a stored photo. src is the medium
+    variant, srcset lists every variant and full is the largest one.
+    """
+    sources = _sources_cache.get(filename)
+    if sources is not None:
+        return sources
+    return _cache_sources(filename, PhotoAsset.query.filter_by(filename=filename).first())
+
+
+def parse_photo_list(photos_json):
+    """Stored photo names listed in a post or comment photos column, without duplicates"""
+    try:
+        photos = json.loads(photos_json) if photos_json else []
+    except (json.JSONDecodeError, TypeError):
+        return []
+    if not isinstance(photos, list):
+        return []
+    return list(dict.fromkeys(name for name in photos if isinstance(name, str) and is_stored_name(name)))
+
+
+def record_photo_references(photos_json, post_id=None, comment_id=None):
+    """Index the photos of a new post or comment. Does not commit."""
+    db.session.add_all([
+        PhotoReference(filename=name, post_id=post_id, comment_id=comment_id)
+        for name in parse_photo_list(photos_json)
+    ])
+
+
+def backfill_photo_references(batch_size=1000):
+    """Index the photos columns of existing posts and comments, streaming rows in batches"""
+    total = 0
+    for model, owner_column in ((ForumPost, "post_id"), (ForumComment, "comment_id")):
+        rows = db.session.query(model.id, model.photos).filter(
+            model.photos.isnot(None)
+        ).execution_options(yield_per=batch_size)
+        batch = []
+        for owner_id, photos_json in rows:
+            batch.extend({"filename": name, owner_column: owner_id} for name in parse_photo_list(photos_json))
+            if len(batch) >= batch_size:
+                db.session.execute(insert(PhotoReference), batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            db.session.execute(insert(PhotoReference), batch)
+            total += len(batch)
+    return total
+
+
+def is_photo_referenced(filename):
+    """Whether any post or comment still lists the photo (identical uploads share one file)"""
+    return db.session.query(PhotoReference.id).filter_by(filename=filename).first() is not None
+
+
+def _remove_file(path):
+    """os.remove that tolerates the file being gone (every worker runs the GC)"""
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _remove_photo_files(upload_dir, filename, variants_json=None):
+    """Remove an original and its variants from disk. Returns False if the original was missing."""
+    try:
+        variants = json.loads(variants_json) if variants_json else {}
+    except (json.JSONDecodeError, TypeError):
+        variants = {}
+    for variant in variants.values():
+        _remove_file(os.path.join(upload_dir, variant["filename"]))
+    _sources_cache.delete(filename)
+    return _remove_file(os.path.join(upload_dir, filename))
+
+
+def delete_photo_files(filename):
+    """Remove an original, its variants and its manifest. Returns False if the original was missing."""
+    asset = PhotoAsset.query.filter_by(filename=filename).first()
+    variants_json = asset.variants if asset is not None else None
+    if asset is not None:
+        db.session.delete(asset)
+        db.session.commit()
+    return _remove_photo_files(photo_dir(), filename, variants_json)
+
+
+def prune_dangling_references():
+    """Drop references whose post or comment no longer exists. Does not commit."""
+    removed = PhotoReference.query.filter(
+        PhotoReference.post_id.isnot(None),
+        ~exists().where(ForumPost.id == PhotoReference.post_id)
+    ).delete(synchronize_session=False)
+    removed += PhotoReference.query.filter(
+        PhotoReference.comment_id.isnot(None),
+        ~exists().where(ForumComment.id == PhotoReference.comment_id)
+    ).delete(synchronize_session=False)
+    return removed
+
+
+def _collect_orphaned_assets(upload_dir, cutoff):
+    """Delete unreferenced PhotoAssets older than cutoff, a batch per transaction"""
+    unreferenced = ~exists().where(PhotoReference.filename == PhotoAsset.filename)
+    removed, last_id = 0, 0
+    while True:
+        ids = [asset_id for (asset_id,) in db.session.query(PhotoAsset.id).filter(
+            PhotoAsset.id > last_id,
+            PhotoAsset.created_at < cutoff,
+            unreferenced
+        ).order_by(PhotoAsset.id).limit(ORPHAN_GC_BATCH_SIZE)]
+        if not ids:
+            return removed
+        last_id = ids[-1]
+
+        # Re-check in the DELETE itself so a post made (or a duplicate uploaded) meanwhile keeps its photo
+        deleted = db.session.execute(
+            delete(PhotoAsset).where(PhotoAsset.id.in_(ids), PhotoAsset.created_at < cutoff, unreferenced)
+            .returning(PhotoAsset.filename, PhotoAsset.variants)
+        ).all()
+        db.session.commit()
+        for filename, variants_json in deleted:
+            _remove_photo_files(upload_dir, filename, variants_json)
+        removed += len(deleted)
+
+
+def _collect_orphaned_legacy_files(upload_dir, cutoff):
+    """Delete unreferenced pre-manifest uploads (flat uuid names) older than cutoff"""
+    cutoff_timestamp = cutoff.timestamp()
+    removed = 0
+
+    def collect(names):
+        referenced = {filename for (filename,) in db.session.query(PhotoReference.filename).filter(
+            PhotoReference.filename.in_(names))}
+        managed = {filename for (filename,) in db.session.query(PhotoAsset.filename).filter(
+            PhotoAsset.filename.in_(names))}
+        orphaned = [name for name in names if name not in referenced and name not in managed]
+        return sum(_remove_file(os.path.join(upload_dir, name)) for name in orphaned)
+
+    batch = []
+    with os.scandir(upload_dir) as entries:
+        for entry in entries:
+            if (entry.is_file() and LEGACY_ORIGINAL_RE.match(entry.name)
+                    and entry.stat().st_mtime < cutoff_timestamp):
+                batch.append(entry.name)
+                if len(batch) >= ORPHAN_GC_BATCH_SIZE:
+                    removed += collect(batch)
+                    batch = []
+    if batch:
+        removed += collect(batch)
+    return removed
+
+
+def _collect_stale_temp_files(upload_dir, cutoff):
+    """Remove partial uploads left in the temp directory by interrupted requests"""
+    tmp_dir = os.path.join(upload_dir, "tmp")
+    if not os.path.isdir(tmp_dir):
+        return
+    cutoff_timestamp = cutoff.timestamp()
+    with os.scandir(tmp_dir) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.stat().st_mtime < cutoff_timestamp:
+                _remove_file(entry.path)
+
+
+def _photo_references_backfilled():
+    return db.session.execute(text(
+        "SELECT 1 FROM migrations WHERE migration_name = 'add_photo_references'"
+    )).first() is not None
+
+
+@background.periodic(ORPHAN_GC_INTERVAL)
+def collect_orphaned_photos():
+    """Periodic removal of uploaded photos that no post or comment uses"""
+    upload_dir = photo_dir()
+    if not os.path.isdir(upload_dir):
+        return
+    if not _photo_references_backfilled():
+        # Without the backfill every existing photo looks unreferenced
+        logger.warning("Photo GC skipped: the add_photo_references migration has not completed")
+        return
+
+    dangling = prune_dangling_references()
+    db.session.commit()
+
+    cutoff = datetime.utcnow() - ORPHAN_MIN_AGE
+    removed = _collect_orphaned_assets(upload_dir, cutoff)
+    removed += _collect_orphaned_legacy_files(upload_dir, cutoff)
+    _collect_stale_temp_files(upload_dir, cutoff)
+    if removed or dangling:
+        logger.info(f"Photo GC removed {removed} orphaned uploads and {dangling} dangling references")
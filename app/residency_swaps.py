@@ -1,7 +1,6 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
-from sqlalchemy import or_
-from .models import db, ResidencySwap, ResidencyOpening, User, Conversation
+from .models import db, ResidencySwap, ResidencyOpening, User, Conversation, MessageThread
 from datetime import datetime
 
 residency_swaps_bp = Blueprint("residency_swaps", __name__)
@@ -137,22 +136,18 @@ def contact_swap_poster(swap_id):
         return redirect(url_for("residency_swaps.index"))
     
     # Check if conversation already exists
-    existing_convo = Conversation.query.filter(
-        or_(
-            (Conversation.resident_id == current_user.id) & (Conversation.employer_id == poster.id),
-            (Conversation.resident_id == poster.id) & (Conversation.employer_id == current_user.id)
-        ),
-        Conversation.opportunity_id.is_(None)
-    ).first()
+    thread = MessageThread.get_or_create(current_user.id, poster.id)
+    existing_convo = Conversation.query.filter_by(thread_id=thread.id, opportunity_id=None).first()
     
     if existing_convo:
+        db.session.commit()
         return redirect(url_for("chat.thread", conversation_id=existing_convo.id))
     
     # Create new conversation
     if current_user.role.value == "resident":
-        convo = Conversation(resident_id=current_user.id, employer_id=poster.id, opportunity_id=None)
+        convo = Conversation(resident_id=current_user.id, employer_id=poster.id, opportunity_id=None, thread_id=thread.id)
     else:
-        convo = Conversation(resident_id=poster.id, employer_id=current_user.id, opportunity_id=None)
+        convo = Conversation(resident_id=poster.id, employer_id=current_user.id, opportunity_id=None, thread_id=thread.id)
     
     db.session.add(convo)
     db.session.commit()
@@ -174,22 +169,18 @@ def contact_opening_poster(opening_id):
         return redirect(url_for("residency_swaps.index"))
     
     # Check if conversation already exists
-    existing_convo = Conversation.query.filter(
-        or_(
-            (Conversation.resident_id == current_user.id) & (Conversation.employer_id == poster.id),
-            (Conversation.resident_id == poster.id) & (Conversation.employer_id == current_user.id)
-        ),
-        Conversation.opportunity_id.is_(None)
-    ).first()
+    thread = MessageThread.get_or_create(current_user.id, poster.id)
+    existing_convo = Conversation.query.filter_by(thread_id=thread.id, opportunity_id=None).first()
     
     if existing_convo:
+        db.session.commit()
         return redirect(url_for("chat.thread", conversation_id=existing_convo.id))
     
     # Create new conversation
     if current_user.role.value == "resident":
-        convo = Conversation(resident_id=current_user.id, employer_id=poster.id, opportunity_id=None)
+        convo = Conversation(resident_id=current_user.id, employer_id=poster.id, opportunity_id=None, thread_id=thread.id)
     else:
-        convo = Conversation(resident_id=poster.id, employer_id=current_user.id, opportunity_id=None)
+        convo = Conversation(resident_id=poster.id, employer_id=current_user.id, opportunity_id=None, thread_id=thread.id)
     
     db.session.add(convo)
     db.session.commit()
@@ -0,0 +1,61 @@
+"""
+Schema capability registry
+
+Feature switches such as "does forum_post have a specialty column yet" used
+to run a catalog query through the SQLAlchemy inspector on every call, and
+the forum pages made several such calls per request. The registry reads the
+column list of every table once, at startup after the migrations have run,
+and answers those checks from memory.
+
+Anything that changes the schema at runtime must call refresh() afterwards.
+Migration code that needs the live answer between its own ALTER statements
+keeps using auto_migrate.check_column_exists.
+"""
+
+import logging
+import threading
+
+from .models import db
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaCapabilities:
+    """In-memory snapshot of table -> column names for the current database"""
+
+    def __init__(self):
+        self._columns = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Re-read every table's columns from the database catalog"""
+        columns = {}
+        try:
+            inspector = db.inspect(db.engine)
+            for table_name in inspector.get_table_names():
+                columns[table_name] = frozenset(col['name'] for col in inspector.get_columns(table_name))
+        except Exception as e:
+            logger.error(f"Error loading schema capabilities: {e}")
+            # Leave the registry unloaded so the next lookup tries again
+            with self._lock:
+                self._columns = None
+            return False
+
+        with self._lock:
+            self._columns = columns
+        logger.info(f"Loaded schema capabilities for {len(columns)} tables")
+        return True
+
+    def _snapshot(self):
+        if self._columns is None:
+            self.refresh()
+        return self._columns or {}
+
+    def has_table(self, table_name):
+        return table_name in self._snapshot()
+
+    def has_column(self, table_name, column_name):
+        return column_name in self._snapshot().get(table_name, ())
+
+
+schema_capabilities = SchemaCapabilities()
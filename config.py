@@ -62,6 +62,17 @@ class Config:
     MAIL_DEFAULT_SENDER = os.getenv("MAIL_DEFAULT_SENDER", "radnucleus@gmail.com")
     MAIL_SUPPRESS_SEND = os.getenv("MAIL_SUPPRESS_SEND", "false").lower() in ["true", "on", "1"]
     
+    # Periodic tasks and background jobs run in-process (see app/background.py)
+    BACKGROUND_JOBS_ENABLED = os.getenv("BACKGROUND_JOBS_ENABLED", "true").lower() in ["true", "on", "1"]
+    
+    # Uploaded file transfer: "" streams from the worker, "x-accel" hands it to nginx,
+    # "x-sendfile" to Apache/lighttpd (see DEPLOYMENT_CONFIG.md)
+    MEDIA_OFFLOAD = os.getenv("MEDIA_OFFLOAD", "").lower()
+    USE_X_SENDFILE = MEDIA_OFFLOAD == "x-sendfile"
+    # nginx internal locations mapped to the profile upload and forum photo directories
+    MEDIA_ACCEL_UPLOADS_PREFIX = os.getenv("MEDIA_ACCEL_UPLOADS_PREFIX", "/_media/uploads/")
+    MEDIA_ACCEL_PHOTOS_PREFIX = os.getenv("MEDIA_ACCEL_PHOTOS_PREFIX", "/_media/photos/")
+    
     # CORS configuration
     CORS_ORIGINS = os.getenv("CORS_ORIGINS", "*").split(",")
     CORS_SUPPORTS_CREDENTIALS = True
@@ -69,3 +80,4 @@ class Config:
 
 class TestConfig(Config):
     SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
+    BACKGROUND_JOBS_ENABLED = False
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Bulk import of survey compensation data (MGMA-style reference rows)
+
+Usage:
+    python import_compensation_data.py FILE.csv|FILE.xlsx [--skip-invalid] [--dry-run]
+
+Required columns: year, region, specialty, total_compensation. Optional:
+base_salary, bonus, rvu_total, rvu_per_work_rvu, work_rvus, total_rvus,
+hours_per_week, weeks_per_year, practice_type, experience_years, source.
+See app/compensation_import.py for validation rules.
+"""
+import argparse
+import os
+import sys
+
+# Add the app directory to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app
+from app.compensation_import import import_compensation_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import compensation survey data from CSV or XLSX")
+    parser.add_argument("path", help="CSV or XLSX file")
+    parser.add_argument("--skip-invalid", action="store_true", help="load the valid rows even if some rows are invalid")
+    parser.add_argument("--dry-run", action="store_true", help="validate only, load nothing")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        try:
+            with open(args.path, "rb") as stream:
+                report = import_compensation_file(stream, args.path, skip_invalid=args.skip_invalid, dry_run=args.dry_run)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return False
+
+    for line, message in report.errors:
+        print(f"  line {line}: {message}")
+    if report.error_count > len(report.errors):
+        print(f"  ... and {report.error_count - len(report.errors)} more errors")
+    if report.ignored_columns:
+        print(f"Ignored columns: {', '.join(report.ignored_columns)}")
+
+    print(f"Rows read: {report.rows_read}, imported: {report.rows_imported}, errors: {report.error_count}")
+    if args.dry_run:
+        print("Dry run - nothing was loaded")
+    elif not report.committed:
+        print("Nothing was loaded" + (" (fix the errors or use --skip-invalid)" if report.error_count else ""))
+    return report.committed or (args.dry_run and not report.error_count)
+
+
+if __name__ == "__main__":
+    print("Starting compensation data import...")
+    print("=" * 60)
+    success = main()
+    print("=" * 60)
+    if success:
+        print("🎉 Import completed successfully!")
+    else:
+        print("💥 Import failed!")
+        sys.exit(1)
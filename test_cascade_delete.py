@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Tests for the set-based deletes in app/cascade_delete.py
+
+Run with: python -m pytest test_cascade_delete.py
+Each test builds the schema in a fresh SQLite database.
+"""
+
+import pytest
+
+from app import create_app
+from app.cascade_delete import delete_forum_comments, delete_user_data
+from app.forum import toggle_vote
+from app.models import db, ForumCategory, ForumComment, ForumPost, ForumVote, User, UserRole
+from config import Config
+
+
+@pytest.fixture
+def app(tmp_path):
+    class TestConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'test.db'}"
+        TESTING = True
+        BACKGROUND_JOBS_ENABLED = False
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+
+def make_user(name):
+    user = User(email=f"{name}@example.com", name=name, role=UserRole.RESIDENT)
+    user.set_password("password")
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def make_post(author):
+    post = ForumPost(author_id=author.id, title=f"Post by {author.name}", content="Body",
+                     category=ForumCategory.JOB_ADVICE)
+    db.session.add(post)
+    db.session.commit()
+    return post
+
+
+def make_comment(author, post, parent=None):
+    comment = ForumComment(post_id=post.id, author_id=author.id, content="Comment",
+                           parent_comment_id=parent.id if parent else None)
+    db.session.add(comment)
+    ForumPost.adjust_comment_count(post.id, 1)
+    db.session.commit()
+    return comment
+
+
+def vote(user, vote_type, post=None, comment=None):
+    toggle_vote(user.id, post.id if post else None, comment.id if comment else None, vote_type)
+    db.session.commit()
+
+
+def tally(model, entity_id):
+    row = db.session.get(model, entity_id)
+    db.session.refresh(row)
+    return row.upvotes, row.downvotes, row.score
+
+
+def test_delete_user_keeps_surviving_tallies_and_counts(app):
+    doomed, bob, carol = make_user("doomed"), make_user("bob"), make_user("carol")
+
+    # Content that survives: bob's post with carol's comment and a reply thread under doomed
+    bob_post = make_post(bob)
+    carol_comment = make_comment(carol, bob_post)
+    doomed_comment = make_comment(doomed, bob_post)
+    bob_reply = make_comment(bob, bob_post, parent=doomed_comment)
+    carol_reply = make_comment(carol, bob_post, parent=bob_reply)
+
+    # Content that goes: doomed's post with bob's comment and carol's vote on it
+    doomed_post = make_post(doomed)
+    make_comment(bob, doomed_post)
+    vote(carol, "upvote", post=doomed_post)
+
+    vote(doomed, "upvote", post=bob_post)
+    vote(carol, "downvote", post=bob_post)
+    vote(doomed, "downvote", comment=carol_comment)
+    vote(bob, "upvote", comment=carol_comment)
+    vote(carol, "upvote", comment=bob_reply)
+    assert tally(ForumPost, bob_post.id) == (1, 1, 0)
+    assert db.session.get(ForumPost, bob_post.id).comment_count == 4
+
+    bob_post_id, carol_comment_id = bob_post.id, carol_comment.id
+    doomed_id, doomed_post_id = doomed.id, doomed_post.id
+    reply_ids = [doomed_comment.id, bob_reply.id, carol_reply.id]
+
+    steps = []
+    delete_user_data(doomed_id, progress=lambda done, total, message: (db.session.commit(), steps.append(done)))
+    db.session.expire_all()
+
+    assert steps == list(range(1, len(steps) + 1))
+    assert db.session.get(User, doomed_id) is None
+    assert db.session.get(ForumPost, doomed_post_id) is None
+    assert ForumComment.query.filter_by(post_id=doomed_post_id).count() == 0
+    assert ForumVote.query.filter_by(post_id=doomed_post_id).count() == 0
+    assert ForumVote.query.filter_by(user_id=doomed_id).count() == 0
+
+    # doomed's votes are retracted, everyone else's stay counted
+    assert tally(ForumPost, bob_post_id) == (0, 1, -1)
+    assert tally(ForumComment, carol_comment_id) == (1, 0, 1)
+
+    # doomed's comment goes with the whole reply thread below it
+    assert ForumComment.query.filter(ForumComment.id.in_(reply_ids)).count() == 0
+    assert ForumVote.query.filter(ForumVote.comment_id.in_(reply_ids)).count() == 0
+    assert db.session.get(ForumPost, bob_post_id).comment_count == 1
+
+
+def test_delete_comment_removes_nested_replies_and_recounts(app):
+    alice, bob = make_user("alice"), make_user("bob")
+    post = make_post(alice)
+    root = make_comment(alice, post)
+    child = make_comment(bob, post, parent=root)
+    grandchild = make_comment(alice, post, parent=child)
+    sibling = make_comment(bob, post)
+    vote(alice, "upvote", comment=grandchild)
+    post_id, grandchild_id, sibling_id = post.id, grandchild.id, sibling.id
+    version = db.session.get(ForumPost, post_id).comments_version
+
+    deleted = delete_forum_comments([root.id])
+    db.session.commit()
+    db.session.expire_all()
+
+    assert deleted == 3
+    assert [c.id for c in ForumComment.query.filter_by(post_id=post_id)] == [sibling_id]
+    assert ForumVote.query.filter_by(comment_id=grandchild_id).count() == 0
+    refreshed = db.session.get(ForumPost, post_id)
+    assert refreshed.comment_count == 1
+    assert refreshed.comments_version > version